@@ -0,0 +1,127 @@
+"""Measure save_ocr_results / get_ocr_results cost while ocr_results grows.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/db_benchmark.py --rows 20000000
+
+Prints one JSON object per checkpoint, so runs of different commits can be diffed.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from app.database import (
+    DatabaseConnection,
+    create_job,
+    get_ocr_results,
+    init_db,
+    save_ocr_results,
+)
+
+
+def make_page(rows: int) -> dict:
+    # Shape of pytesseract.image_to_data(..., output_type=Output.DICT)
+    ints = {
+        key: [random.randint(0, 2000) for _ in range(rows)]
+        for key in (
+            "block_num",
+            "par_num",
+            "line_num",
+            "word_num",
+            "left",
+            "top",
+            "width",
+            "height",
+        )
+    }
+    return {
+        "level": [5] * rows,
+        "conf": [random.randint(0, 100) for _ in range(rows)],
+        "text": [f"word{i}" for i in range(rows)],
+        **ints,
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    init_db(db_path, logging.getLogger("benchmark"))
+
+    page = make_page(args.rows_per_job)
+    task_ids = []
+    total = 0
+    checkpoint_every = max(1, args.rows // args.checkpoints)
+    next_checkpoint = checkpoint_every
+    insert_seconds = 0.0
+    inserted_since_checkpoint = 0
+
+    while total < args.rows:
+        task_id = str(uuid.uuid4())
+        await create_job(db_path, task_id, "benchmark", datetime.now().isoformat())
+        start = time.perf_counter()
+        await save_ocr_results(
+            db_path, [{"data": page, "page_num": 1}], task_id, storage=args.storage
+        )
+        insert_seconds += time.perf_counter() - start
+        inserted_since_checkpoint += args.rows_per_job
+        task_ids.append(task_id)
+        total += args.rows_per_job
+
+        if total >= next_checkpoint:
+            lookup_seconds = []
+            for task in random.sample(task_ids, min(args.lookups, len(task_ids))):
+                start = time.perf_counter()
+                await get_ocr_results(db_path, task)
+                lookup_seconds.append(time.perf_counter() - start)
+            lookup_seconds.sort()
+
+            start = time.perf_counter()
+            with DatabaseConnection.read(db_path) as conn:
+                conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'pending'"
+                ).fetchone()
+            status_seconds = time.perf_counter() - start
+
+            print(
+                json.dumps(
+                    {
+                        "rows": total,
+                        "insert_us_per_row": round(
+                            insert_seconds / inserted_since_checkpoint * 1e6, 3
+                        ),
+                        "lookup_ms_p50": round(
+                            lookup_seconds[len(lookup_seconds) // 2] * 1e3, 3
+                        ),
+                        "lookup_ms_max": round(lookup_seconds[-1] * 1e3, 3),
+                        "status_count_ms": round(status_seconds * 1e3, 3),
+                        "db_mb": round(os.path.getsize(db_path) / 2**20, 1),
+                    }
+                ),
+                flush=True,
+            )
+            insert_seconds = 0.0
+            inserted_since_checkpoint = 0
+            next_checkpoint += checkpoint_every
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--rows-per-job", type=int, default=2_000)
+    parser.add_argument("--checkpoints", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=50)
+    parser.add_argument("--storage", choices=["rows", "columnar"], default="rows")
+    parser.add_argument("--db", default=None, help="defaults to a temporary file")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
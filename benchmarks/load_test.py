@@ -0,0 +1,331 @@
+"""Load test a running container with the bundled fixtures and synthetic PDFs.
+
+Start the service (e.g. scripts/run.sh), then from the repository root:
+
+    python benchmarks/load_test.py --concurrency 4 --requests 20 --output before.json
+
+Scenarios:
+    ocr         POST /ocr/
+    async       POST /start_ocr/, then poll /results/{task_id} until it is finished
+    searchable  POST /create_searchable/
+
+Latency percentiles, throughput and the per-stage breakdown of the service's
+/metrics are written as one JSON document with sorted keys, so the output of two
+commits can be compared with diff or jq. Pass --pid with the process id of the
+server to also record the peak RSS of the server and its OCR worker processes.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from PIL import Image, ImageDraw
+from pypdf import PdfReader
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = ["test_doc.pdf", "receipt.jpg", "test_png.png", "test_jpeg.jpeg"]
+SCENARIOS = ["ocr", "async", "searchable"]
+STAGE_METRIC = re.compile(
+    r'^ocr_stage_duration_seconds_(sum|count)\{[^}]*stage="([^"]+)"[^}]*\} (\S+)$'
+)
+POLL_SECONDS = 0.05
+
+
+def synthetic_pdf(path: str, pages: int) -> None:
+    # Letter pages at 150 DPI with deterministic text, one paragraph per page
+    images = []
+    for page in range(pages):
+        image = Image.new("L", (1275, 1650), 255)
+        draw = ImageDraw.Draw(image)
+        for line in range(40):
+            text = f"Page {page + 1} line {line + 1}: the quick brown fox jumps over"
+            draw.text((100, 100 + line * 36), text, fill=0)
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=150)
+
+
+def count_pages(path: str) -> int:
+    if path.endswith(".pdf"):
+        return len(PdfReader(path).pages)
+    return 1
+
+
+def unique_payload(name: str, data: bytes) -> bytes:
+    # A trailing PDF comment / bytes after the image data do not change the
+    # document, but give every request a different hash so the result cache misses
+    marker = uuid.uuid4().hex.encode()
+    if name.endswith(".pdf"):
+        return data + b"\n%" + marker + b"\n"
+    return data + marker
+
+
+def multipart(name: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = b"".join(
+        [
+            f"--{boundary}\r\n".encode(),
+            f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'.encode(),
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            data,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ]
+    )
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def request(url: str, body: bytes | None = None, content_type: str | None = None):
+    headers = {"Content-Type": content_type} if content_type else {}
+    req = urllib.request.Request(
+        url, data=body, headers=headers, method="POST" if body else "GET"
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=600) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def run_request(base_url: str, scenario: str, name: str, data: bytes) -> dict:
+    body, content_type = multipart(name, data)
+    start = time.perf_counter()
+    if scenario == "ocr":
+        status, _ = request(f"{base_url}/ocr/", body, content_type)
+    elif scenario == "searchable":
+        status, _ = request(f"{base_url}/create_searchable/", body, content_type)
+    else:
+        status, content = request(f"{base_url}/start_ocr/", body, content_type)
+        if status == 200:
+            task_id = json.loads(content)["task_id"]
+            while True:
+                status, content = request(
+                    f"{base_url}/results/{task_id}?fields=level&level=1"
+                )
+                job_status = (
+                    json.loads(content).get("status") if status == 200 else None
+                )
+                if job_status == "failed":
+                    status = 500
+                if job_status not in ("pending", "processing"):
+                    break
+                time.sleep(POLL_SECONDS)
+    return {"status": status, "seconds": time.perf_counter() - start}
+
+
+def percentile(values: list, q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def read_stage_metrics(base_url: str) -> dict:
+    # Sum and count of ocr_stage_duration_seconds per stage, over all labels
+    status, content = request(f"{base_url}/metrics")
+    stages: dict = defaultdict(lambda: {"sum": 0.0, "count": 0.0})
+    if status != 200:
+        return stages
+    for line in content.decode().splitlines():
+        match = STAGE_METRIC.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            stages[stage][kind] += float(value)
+    return stages
+
+
+def stage_breakdown(before: dict, after: dict) -> dict:
+    breakdown = {}
+    for stage, values in after.items():
+        count = values["count"] - before.get(stage, {}).get("count", 0)
+        seconds = values["sum"] - before.get(stage, {}).get("sum", 0)
+        if count > 0:
+            breakdown[stage] = {
+                "count": int(count),
+                "total_s": round(seconds, 3),
+                "mean_ms": round(seconds / count * 1e3, 2),
+            }
+    return breakdown
+
+
+def process_tree_rss(pid: int) -> int:
+    # Resident set size of pid and all of its descendants, in bytes
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def run_scenario(args, scenario: str, fixtures: list) -> dict:
+    results = {}
+    for name, data, pages in fixtures:
+        warmup = args.warmup
+        payloads = [
+            data if args.allow_cache else unique_payload(name, data)
+            for _ in range(warmup + args.requests)
+        ]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for payload in payloads[:warmup]:
+                run_request(args.url, scenario, name, payload)
+
+            sampler = RssSampler(args.pid) if args.pid else None
+            if sampler:
+                sampler.start()
+            metrics_before = read_stage_metrics(args.url)
+            start = time.perf_counter()
+            runs = list(
+                executor.map(
+                    lambda payload: run_request(args.url, scenario, name, payload),
+                    payloads[warmup:],
+                )
+            )
+            elapsed = time.perf_counter() - start
+            metrics_after = read_stage_metrics(args.url)
+            peak_rss = sampler.stop() if sampler else None
+
+        latencies = [run["seconds"] for run in runs if run["status"] == 200]
+        errors: dict = defaultdict(int)
+        for run in runs:
+            if run["status"] != 200:
+                errors[str(run["status"])] += 1
+
+        results[name] = {
+            "requests": len(runs),
+            "errors": dict(errors),
+            "pages_per_request": pages,
+            "latency_ms": {
+                f"p{q}": round(value * 1e3, 1) if value is not None else None
+                for q in (50, 95, 99)
+                for value in [percentile(latencies, q)]
+            },
+            "throughput_rps": round(len(latencies) / elapsed, 3),
+            "throughput_pages_per_s": round(len(latencies) * pages / elapsed, 3),
+            "peak_rss_mb": round(peak_rss / 2**20, 1) if peak_rss else None,
+            "stages": stage_breakdown(metrics_before, metrics_after),
+        }
+        print(
+            f"{scenario} {name}: {json.dumps(results[name]['latency_ms'])}",
+            file=sys.stderr,
+        )
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--fixtures", nargs="+", default=FIXTURES)
+    parser.add_argument(
+        "--synthetic-pages",
+        type=int,
+        nargs="*",
+        default=[10],
+        help="page counts of the generated PDFs, none to skip them",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=10, help="per fixture")
+    parser.add_argument("--warmup", type=int, default=1, help="per fixture")
+    parser.add_argument(
+        "--allow-cache",
+        action="store_true",
+        help="upload identical files, so repeated requests can hit the result cache",
+    )
+    parser.add_argument("--pid", type=int, help="server pid for peak RSS sampling")
+    parser.add_argument("--output", help="defaults to stdout")
+    args = parser.parse_args()
+
+    fixtures = []
+    for name in args.fixtures:
+        path = os.path.join(REPO_ROOT, "tests", name)
+        with open(path, "rb") as f:
+            fixtures.append((name, f.read(), count_pages(path)))
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.synthetic_pages:
+            path = os.path.join(tmp, f"synthetic_{pages}p.pdf")
+            synthetic_pdf(path, pages)
+            with open(path, "rb") as f:
+                fixtures.append((os.path.basename(path), f.read(), pages))
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "allow_cache": args.allow_cache,
+        },
+        "scenarios": {
+            scenario: run_scenario(args, scenario, fixtures)
+            for scenario in args.scenarios
+        },
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
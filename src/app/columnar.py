@@ -0,0 +1,123 @@
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Dict, List
+
+# image_to_data columns stored as typed integer arrays, page_num is stored once per page
+INT_COLUMNS = [
+    "level",
+    "block_num",
+    "par_num",
+    "line_num",
+    "word_num",
+    "left",
+    "top",
+    "width",
+    "height",
+    "conf",
+]
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<BI")
+
+
+def _smallest_typecode(values: List[int]) -> str:
+    low = min(values, default=0)
+    high = max(values, default=0)
+    for typecode in ("b", "h", "i"):
+        bits = array(typecode).itemsize * 8
+        if -(2 ** (bits - 1)) <= low and high < 2 ** (bits - 1):
+            return typecode
+    return "q"
+
+
+def _to_bytes(values: array) -> bytes:
+    # Blobs are always little endian
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, raw: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_page(data: Dict[str, List[Any]]) -> bytes:
+    num_rows = len(data["level"])
+    columns = [
+        array(_smallest_typecode(data[name]), data[name]) for name in INT_COLUMNS
+    ]
+
+    # Packed string table: one length per row followed by all utf-8 encoded texts
+    texts = [str(text).encode("utf-8") for text in data["text"]]
+    lengths = [len(text) for text in texts]
+    text_lengths = array(_smallest_typecode(lengths), lengths)
+
+    parts = [
+        HEADER.pack(FORMAT_VERSION, num_rows),
+        "".join(column.typecode for column in columns).encode("ascii"),
+        text_lengths.typecode.encode("ascii"),
+    ]
+    parts.extend(_to_bytes(column) for column in columns)
+    parts.append(_to_bytes(text_lengths))
+    parts.extend(texts)
+    return zlib.compress(b"".join(parts))
+
+
+class ColumnarPage:
+    # Decompresses the blob on first access, columns are decoded one at a time
+
+    def __init__(self, blob: bytes, page_num: int):
+        self.blob = blob
+        self.page_num = page_num
+        self._raw: bytes | None = None
+        self._offsets: Dict[str, tuple] = {}
+        self._columns: Dict[str, Any] = {}
+        self.num_rows = 0
+
+    def _load(self) -> bytes:
+        if self._raw is not None:
+            return self._raw
+        raw = zlib.decompress(self.blob)
+        version, self.num_rows = HEADER.unpack_from(raw)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar page version: {version}")
+
+        position = HEADER.size
+        end = position + len(INT_COLUMNS) + 1
+        typecodes = raw[position:end].decode("ascii")
+        position = end
+        for name, typecode in zip(INT_COLUMNS + ["text_lengths"], typecodes):
+            size = array(typecode).itemsize * self.num_rows
+            self._offsets[name] = (typecode, position, position + size)
+            position += size
+        self._offsets["text"] = ("", position, len(raw))
+        self._raw = raw
+        return raw
+
+    def __len__(self) -> int:
+        self._load()
+        return self.num_rows
+
+    def column(self, name: str) -> Any:
+        raw = self._load()
+        if name == "page_num":
+            return [self.page_num] * self.num_rows
+        if name not in self._columns:
+            if name == "text":
+                _, start, _ = self._offsets["text"]
+                texts = []
+                for length in self.column("text_lengths"):
+                    end = start + length
+                    texts.append(raw[start:end].decode("utf-8"))
+                    start = end
+                self._columns[name] = texts
+            else:
+                typecode, start, end = self._offsets[name]
+                self._columns[name] = _from_bytes(typecode, raw[start:end])
+        return self._columns[name]
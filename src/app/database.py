@@ -1,36 +1,223 @@
+import asyncio
 import logging
+import os
+import queue
 import sqlite3
+import sys
+import threading
 import uuid
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Future
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
 
 from fastapi import HTTPException
 
+from app.columnar import ColumnarPage, encode_page
+from app.metrics import timed_db
+
+# The WAL file is truncated back to this size after checkpoints
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+# Writes queued while a transaction commits are committed together, up to this many
+DB_WRITE_BATCH_MAX = int(os.getenv("DB_WRITE_BATCH_MAX", 256))
+# Read-only connections kept open for the request handlers
+DB_READ_CONNECTIONS = int(os.getenv("DB_READ_CONNECTIONS", 4))
+# Jobs in these states are never touched by retention
+FINISHED_STATUSES = ("completed", "failed")
+
+# Columns /jobs can be sorted and filtered by
+JOB_SORT_COLUMNS = ["start_datetime", "end_datetime"]
+
+# Columns of a result row, in the order of pytesseract.image_to_data
+RESULT_COLUMNS = [
+    "level",
+    "page_num",
+    "block_num",
+    "par_num",
+    "line_num",
+    "word_num",
+    "left",
+    "top",
+    "width",
+    "height",
+    "conf",
+    "text",
+]
+
+
+def connect(db_path: str, read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(
+            f"file:{quote(os.path.abspath(db_path))}?mode=ro",
+            uri=True,
+            timeout=30,
+            check_same_thread=False,
+        )
+    else:
+        # Transactions are managed explicitly by the writer
+        conn = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT}")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class DatabaseWriter:
+    # The only connection writing to the database, owned by one thread. Writes queued
+    # while a transaction commits are run back to back in the next transaction and
+    # share its commit. Each runs in a savepoint, so a failing write only undoes itself.
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func: Callable[[sqlite3.Connection], Any]) -> Future:
+        future: Future = Future()
+        self._queue.put((func, future))
+        return future
+
+    async def run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        return await asyncio.wrap_future(self.submit(func))
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        conn = connect(self.db_path)
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < DB_WRITE_BATCH_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            writes = [item for item in batch if item is not None]
+            if writes:
+                self._write(conn, writes)
+            if stop:
+                conn.close()
+                return
+
+    def _write(self, conn: sqlite3.Connection, writes: List[Tuple]) -> None:
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, future in writes:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((future, func(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    results.append((future, None, e))
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+        except Exception as e:
+            # BEGIN or COMMIT failed, none of the writes is stored
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(future, None, e) for _, future in writes if future.running()]
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class ReadPool:
+    # Read-only WAL connections, reads never wait for the writer or each other
+
+    def __init__(self, db_path: str, size: int):
+        self.db_path = db_path
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = connect(self.db_path, read_only=True)
+        try:
+            yield conn
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    async def run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        # Reads run in a thread, the event loop is not blocked while they scan
+        return await asyncio.to_thread(self._read, func)
+
+    def _read(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self.connection() as conn:
+            return func(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
 
 class DatabaseConnection:
-    _instance: Optional[sqlite3.Connection] = None
+    _writers: Dict[str, DatabaseWriter] = {}
+    _readers: Dict[str, ReadPool] = {}
+    _lock = threading.Lock()
 
     @classmethod
-    def get_instance(cls, db_path: str) -> sqlite3.Connection:
-        if cls._instance is None:
-            cls._instance = sqlite3.connect(
-                db_path, timeout=30, check_same_thread=False
-            )
-            cls._instance.row_factory = sqlite3.Row
-            cls.enable_wal_mode(cls._instance)
-        return cls._instance
+    def writer(cls, db_path: str) -> DatabaseWriter:
+        with cls._lock:
+            if db_path not in cls._writers:
+                cls._writers[db_path] = DatabaseWriter(db_path)
+            return cls._writers[db_path]
 
-    @staticmethod
-    def enable_wal_mode(conn: sqlite3.Connection) -> None:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA journal_mode=WAL;")
-        conn.commit()
+    @classmethod
+    def reader(cls, db_path: str) -> ReadPool:
+        with cls._lock:
+            if db_path not in cls._readers:
+                cls._readers[db_path] = ReadPool(db_path, DB_READ_CONNECTIONS)
+            return cls._readers[db_path]
+
+    @classmethod
+    def read(cls, db_path: str):
+        return cls.reader(db_path).connection()
+
+    @classmethod
+    def close(cls, db_path: str) -> None:
+        # Commits the queued writes and closes all connections
+        with cls._lock:
+            writer = cls._writers.pop(db_path, None)
+            pool = cls._readers.pop(db_path, None)
+        if writer is not None:
+            writer.stop()
+        if pool is not None:
+            pool.close()
 
 
 def init_db(db_path: str, logger: logging.Logger) -> None:
-    conn = DatabaseConnection.get_instance(db_path)
-    cursor = conn.cursor()
+    # Runs before the writer starts, on a connection of its own. IMMEDIATE, so API
+    # processes starting at the same time migrate the schema one after the other.
+    with closing(connect(db_path)) as conn:
+        enable_incremental_vacuum(conn, db_path, logger)
+        conn.execute("BEGIN IMMEDIATE")
+        create_schema(conn.cursor())
+        conn.execute("COMMIT")
+
+    logger.info(f"Database initialized at {db_path}")
+    print(f"Database initialized at {db_path}")
 
+
+def create_schema(cursor: sqlite3.Cursor) -> None:
     # Create jobs table
     cursor.execute(
         """
@@ -73,15 +260,202 @@ def init_db(db_path: str, logger: logging.Logger) -> None:
     """
     )
 
-    conn.commit()
+    # Compact storage mode: one compressed columnar blob per page
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS ocr_pages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        uuid TEXT,
+        page_num INTEGER,
+        num_rows INTEGER,
+        data BLOB,
+        FOREIGN KEY (uuid) REFERENCES jobs(uuid)
+    )
+    """
+    )
 
-    logger.info(f"Database initialized at {db_path}")
-    print(f"Database initialized at {db_path}")
+    # Batches of jobs submitted together
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS batches (
+        batch_id TEXT PRIMARY KEY,
+        created_datetime TEXT,
+        num_jobs INTEGER
+    )
+    """
+    )
+
+    # Cache of completed jobs, keyed on the file hash and the OCR parameters
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS ocr_cache (
+        cache_key TEXT PRIMARY KEY,
+        uuid TEXT,
+        created_datetime TEXT,
+        last_hit_datetime TEXT,
+        hits INTEGER DEFAULT 0,
+        FOREIGN KEY (uuid) REFERENCES jobs(uuid)
+    )
+    """
+    )
 
+    migrate_schema(cursor)
 
-def check_db_operations(db_path: str) -> None:
-    try:
-        conn = DatabaseConnection.get_instance(db_path)
+
+def enable_incremental_vacuum(
+    conn: sqlite3.Connection, db_path: str, logger: logging.Logger
+) -> None:
+    # Pages freed by the retention purge are returned to the file system with
+    # PRAGMA incremental_vacuum. The setting only takes effect with a VACUUM once the
+    # file exists (connect() switched it to WAL already), which is instant for a new
+    # database. An existing one takes minutes and twice the disk space when it is
+    # large, so it is left to convert_incremental_vacuum.
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] == 2:
+        return
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+    if cursor.fetchone()[0] > 0:
+        logger.warning(
+            f"{db_path} does not use incremental vacuum, purged space is reused but "
+            "not returned to the file system. Convert it once while the API is "
+            f"stopped: python -m app.database {db_path}"
+        )
+        return
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("VACUUM")
+
+
+def convert_incremental_vacuum(db_path: str, logger: logging.Logger) -> None:
+    # Needs about the size of the database in free disk space
+    with closing(connect(db_path)) as conn:
+        logger.info(f"Converting {db_path} to incremental vacuum")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info(f"Converted {db_path} to incremental vacuum")
+
+
+def migrate_schema(cursor: sqlite3.Cursor) -> None:
+    # Columns and indexes added after the first release, existing databases are migrated in place
+    add_missing_columns(
+        cursor,
+        "jobs",
+        {
+            "cache_hit": "INTEGER DEFAULT 0",
+            # Parameters of queued jobs, so they can be re-run after a restart
+            "lang": "TEXT",
+            "config": "TEXT",
+            "preprocess": "TEXT",
+            "priority": "INTEGER DEFAULT 0",
+            "input_path": "TEXT",
+            "batch_id": "TEXT",
+            # "ocr" or "searchable_pdf"
+            "kind": "TEXT DEFAULT 'ocr'",
+            "output_path": "TEXT",
+            # Compact JSON of JobTrace, see app/tracing.py
+            "trace": "TEXT",
+            # Jobs submitted with debug=true are profiled
+            "debug": "INTEGER DEFAULT 0",
+            # JSON list of the regions OCRed instead of the whole pages, see app/regions.py
+            "regions": "TEXT",
+            # API process running the job and until when, renewed by its heartbeat
+            "lease_owner": "TEXT",
+            "lease_expires": "TEXT",
+            # Pages whose results are saved, in page order, of num_pages
+            "pages_done": "INTEGER DEFAULT 0",
+        },
+    )
+
+    # One index on the results, so the batched inserts maintain only one. Rows are
+    # saved in page order, so it also returns a job's rows in id order.
+    cursor.execute("DROP INDEX IF EXISTS idx_ocr_results_uuid")
+    cursor.execute("DROP INDEX IF EXISTS idx_ocr_results_page")
+    cursor.execute(
+        """ CREATE INDEX IF NOT EXISTS idx_ocr_results_uuid_page
+             ON ocr_results (uuid, page_num) """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id)")
+    cursor.execute(
+        """ CREATE INDEX IF NOT EXISTS idx_jobs_queue
+             ON jobs (status, priority DESC, start_datetime) """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ocr_pages_uuid ON ocr_pages (uuid, page_num)"
+    )
+    # Retention purges finished jobs oldest first
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_end ON jobs (end_datetime)")
+    # Keyset pagination of /jobs, the rowid of the index entries breaks ties
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_start ON jobs (start_datetime)")
+    cursor.execute(
+        """ CREATE INDEX IF NOT EXISTS idx_jobs_status_start
+             ON jobs (status, start_datetime) """
+    )
+    cursor.execute(
+        """ CREATE INDEX IF NOT EXISTS idx_jobs_status_end
+             ON jobs (status, end_datetime) """
+    )
+
+    create_job_counts(cursor)
+
+
+def create_job_counts(cursor: sqlite3.Cursor) -> None:
+    # Jobs per status, maintained by triggers so reading them never scans jobs
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_counts'"
+    )
+    exists = cursor.fetchone() is not None
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS job_counts (
+        status TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    )
+    """
+    )
+    if not exists:
+        cursor.execute(
+            """ INSERT INTO job_counts (status, count)
+                 SELECT COALESCE(status, ''), COUNT(*) FROM jobs
+                 GROUP BY COALESCE(status, '') """
+        )
+
+    increment = """
+        INSERT INTO job_counts (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+        ON CONFLICT (status) DO UPDATE SET count = count + 1;
+    """
+    decrement = """
+        UPDATE job_counts SET count = count - 1
+        WHERE status = COALESCE(OLD.status, '');
+    """
+    cursor.execute(
+        f""" CREATE TRIGGER IF NOT EXISTS jobs_count_insert AFTER INSERT ON jobs
+             BEGIN {increment} END """
+    )
+    cursor.execute(
+        f""" CREATE TRIGGER IF NOT EXISTS jobs_count_delete AFTER DELETE ON jobs
+             BEGIN {decrement} END """
+    )
+    cursor.execute(
+        f""" CREATE TRIGGER IF NOT EXISTS jobs_count_update
+             AFTER UPDATE OF status ON jobs
+             WHEN OLD.status IS NOT NEW.status
+             BEGIN {decrement} {increment} END """
+    )
+
+
+def add_missing_columns(
+    cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]
+) -> None:
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+async def check_db_operations(db_path: str) -> None:
+    def write(conn: sqlite3.Connection) -> None:
         cursor = conn.cursor()
 
         # Insert a test entry
@@ -105,85 +479,707 @@ def check_db_operations(db_path: str) -> None:
         if cursor.fetchone() is not None:
             raise Exception("Test deletion failed")
 
-        conn.commit()
+    try:
+        await DatabaseConnection.writer(db_path).run(write)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Database operation check failed: {e}"
         )
 
 
-def create_job(db_path: str, task_id: str, file_name: str, start_datetime: str) -> None:
-    sql = """
-    INSERT INTO jobs (uuid, file_name, start_datetime, status)
-    VALUES (?, ?, ?, ?)
+@timed_db
+async def create_job(
+    db_path: str,
+    task_id: str,
+    file_name: str,
+    start_datetime: str,
+    fields: Optional[Dict[str, Any]] = None,
+) -> None:
+    columns = {"status": "pending", **(fields or {})}
+    sql = f"""
+    INSERT INTO jobs (uuid, file_name, start_datetime, {", ".join(columns)})
+    VALUES (?, ?, ?, {", ".join("?" for _ in columns)})
     """
-    values = (task_id, file_name, start_datetime, "pending")
+    values = (task_id, file_name, start_datetime, *columns.values())
 
-    conn = DatabaseConnection.get_instance(db_path)
-    cursor = conn.cursor()
+    def write(conn: sqlite3.Connection) -> None:
+        try:
+            conn.execute(sql, values)
+        except sqlite3.Error as e:
+            raise Exception(f"Failed to create job with id: {task_id}: {e}")
+
+    await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def create_batch(
+    db_path: str,
+    batch_id: str,
+    created_datetime: str,
+    jobs: List[Tuple[str, str, str]],
+    fields: Dict[str, Any],
+) -> None:
+    # One transaction for the batch and all of its (task_id, file_name, input_path) jobs
+    columns = {"status": "pending", **fields}
+    sql = f"""
+    INSERT INTO jobs (
+        uuid, file_name, input_path, start_datetime, batch_id, {", ".join(columns)}
+    ) VALUES (?, ?, ?, ?, ?, {", ".join("?" for _ in columns)})
+    """
+
+    def write(conn: sqlite3.Connection) -> None:
+        try:
+            conn.execute(
+                """ INSERT INTO batches (batch_id, created_datetime, num_jobs)
+                     VALUES (?, ?, ?) """,
+                (batch_id, created_datetime, len(jobs)),
+            )
+            conn.executemany(
+                sql,
+                [(*job, created_datetime, batch_id, *columns.values()) for job in jobs],
+            )
+        except sqlite3.Error as e:
+            raise Exception(f"Failed to create batch with id: {batch_id}: {e}")
+
+    await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def get_batch_jobs(db_path: str, batch_id: str) -> Optional[List[sqlite3.Row]]:
+    def read(conn: sqlite3.Connection) -> Optional[List[sqlite3.Row]]:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM batches WHERE batch_id = ?", (batch_id,))
+        if cursor.fetchone() is None:
+            return None
+        cursor.execute(
+            """ SELECT uuid, file_name, status, num_pages, error_message
+                 FROM jobs WHERE batch_id = ? ORDER BY rowid """,
+            (batch_id,),
+        )
+        return cursor.fetchall()
+
+    return await DatabaseConnection.reader(db_path).run(read)
+
+
+class LeaseLostError(Exception):
+    # The job was re-queued or claimed by another API process, e.g. because the
+    # heartbeat of this one stalled, and its writes are rejected
+    def __init__(self, task_id: str):
+        super().__init__(f"Lease of job {task_id} was lost")
+        self.task_id = task_id
+
+
+def write_job_fields(
+    conn: sqlite3.Connection,
+    task_id: str,
+    fields: Dict[str, Any],
+    owner: Optional[str],
+) -> None:
+    # With owner, the fields are only written while owner holds the job's lease
+    set_clause = ", ".join(f"{key} = ?" for key in fields)
+    sql = f"UPDATE jobs SET {set_clause} WHERE uuid = ?"
+    params = [*fields.values(), task_id]
+    if owner is not None:
+        sql += " AND lease_owner = ?"
+        params.append(owner)
     try:
-        cursor.execute(sql, values)
-        conn.commit()
+        updated = conn.execute(sql, params).rowcount
     except sqlite3.Error as e:
-        raise Exception(f"Failed to create job with id: {task_id}: {e}")
+        raise Exception(f"Failed to update job with id: {task_id}: {e}")
+    if owner is not None and updated == 0:
+        raise LeaseLostError(task_id)
 
 
-def update_job(db_path: str, task_id: str, fields: Dict[str, Any]) -> None:
+@timed_db
+async def update_job(
+    db_path: str, task_id: str, fields: Dict[str, Any], owner: Optional[str] = None
+) -> None:
     if not fields:
         raise ValueError("No fields to update provided.")
 
-    set_clause = ", ".join([f"{key} = ?" for key in fields.keys()])
-    values = list(fields.values()) + [task_id]
+    def write(conn: sqlite3.Connection) -> None:
+        write_job_fields(conn, task_id, fields, owner)
 
-    sql = f"""
-    UPDATE jobs
-    SET {set_clause}
-    WHERE uuid = ?
-    """
+    await DatabaseConnection.writer(db_path).run(write)
 
-    conn = DatabaseConnection.get_instance(db_path)
-    cursor = conn.cursor()
+
+@timed_db
+async def save_ocr_results(
+    db_path: str, all_data: List[Dict[str, Any]], task_id: str, storage: str = "rows"
+) -> None:
+    # The rows are built in the writer thread, off the event loop
+    def write(conn: sqlite3.Connection) -> None:
+        if storage == "columnar":
+            save_pages(conn, all_data, task_id)
+        else:
+            save_rows(conn, all_data, task_id)
+
+    await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def save_page_results(
+    db_path: str,
+    task_id: str,
+    page: Dict[str, Any],
+    fields: Dict[str, Any],
+    storage: str = "rows",
+    owner: Optional[str] = None,
+) -> None:
+    # Results of one page together with the job's progress fields, so the saved
+    # pages always match the progress a retried job resumes from
+    def write(conn: sqlite3.Connection) -> None:
+        write_job_fields(conn, task_id, fields, owner)
+        if storage == "columnar":
+            save_pages(conn, [page], task_id)
+        else:
+            save_rows(conn, [page], task_id)
+
+    await DatabaseConnection.writer(db_path).run(write)
+
+
+def save_pages(
+    conn: sqlite3.Connection, all_data: List[Dict[str, Any]], task_id: str
+) -> None:
+    pages = [
+        (
+            task_id,
+            page["page_num"],
+            len(page["data"]["level"]),
+            encode_page(page["data"]),
+        )
+        for page in all_data
+    ]
     try:
-        cursor.execute(sql, values)
-        conn.commit()
+        conn.executemany(
+            """ INSERT INTO ocr_pages (uuid, page_num, num_rows, data)
+                 VALUES (?, ?, ?, ?) """,
+            pages,
+        )
     except sqlite3.Error as e:
-        raise Exception(f"Failed to update job with id: {task_id}: {e}")
+        raise Exception(f"Failed to save results of job with id: {task_id}: {e}")
 
 
-def save_ocr_results(
-    db_path: str, all_data: List[Dict[str, Any]], task_id: str
+def save_rows(
+    conn: sqlite3.Connection, all_data: List[Dict[str, Any]], task_id: str
 ) -> None:
-    conn = DatabaseConnection.get_instance(db_path)
-    cursor = conn.cursor()
-
+    rows = []
     for page in all_data:
         data = page["data"]
         page_num = page["page_num"]
+        rows.extend(
+            zip(
+                [task_id] * len(data["level"]),
+                data["level"],
+                [page_num] * len(data["level"]),
+                data["block_num"],
+                data["par_num"],
+                data["line_num"],
+                data["word_num"],
+                data["left"],
+                data["top"],
+                data["width"],
+                data["height"],
+                data["conf"],
+                data["text"],
+            )
+        )
+
+    # One statement for the whole document
+    try:
+        conn.executemany(
+            """
+        INSERT INTO ocr_results (
+            uuid, level, page_num, block_num, par_num,
+            line_num, word_num, left, top, width, height,
+            conf, text
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            rows,
+        )
+    except sqlite3.Error as e:
+        raise Exception(f"Failed to save results of job with id: {task_id}: {e}")
+
+
+def open_read_connection(db_path: str) -> sqlite3.Connection:
+    # Separate connection for long running reads, e.g. streamed responses, so they do
+    # not hold on to a connection of the pool
+    return connect(db_path, read_only=True)
 
-        for i in range(len(data["level"])):
+
+def iter_ocr_rows(
+    db_path: str,
+    task_id: str,
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None,
+    level: Optional[int] = None,
+    min_conf: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    cursor: Optional[str] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    # Yields (cursor, row) pairs, a cursor resumes the iteration right after its row
+    fields = fields or RESULT_COLUMNS
+    after_page, after_seq = (
+        (int(part) for part in cursor.split(":")) if cursor else (0, -1)
+    )
+    if page_from is None or page_from < after_page:
+        page_from = after_page
+
+    conn = open_read_connection(db_path)
+    try:
+        db_cursor = conn.cursor()
+
+        # Jobs stored in columnar mode have their pages in ocr_pages, decoded page by page
+        sql = "SELECT page_num, data FROM ocr_pages WHERE uuid = ? AND page_num >= ?"
+        params: List[Any] = [task_id, page_from]
+        if page_to is not None:
+            sql += " AND page_num <= ?"
+            params.append(page_to)
+        db_cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM ocr_pages WHERE uuid = ?)", (task_id,)
+        )
+        if db_cursor.fetchone()[0]:
+            db_cursor.execute(sql + " ORDER BY page_num", params)
+            for page_row in db_cursor:
+                page = ColumnarPage(page_row["data"], page_row["page_num"])
+                levels = page.column("level")
+                confs = page.column("conf")
+                columns = [page.column(field) for field in fields]
+                for index in range(len(page)):
+                    if page.page_num == after_page and index <= after_seq:
+                        continue
+                    if level is not None and levels[index] != level:
+                        continue
+                    if min_conf is not None and confs[index] < min_conf:
+                        continue
+                    row = {
+                        field: column[index] for field, column in zip(fields, columns)
+                    }
+                    yield f"{page.page_num}:{index}", row
+            return
+
+        sql = f"""SELECT id, page_num AS _page_num, {", ".join(fields)}
+                  FROM ocr_results WHERE uuid = ? AND page_num >= ? AND id > ?"""
+        params = [task_id, page_from, after_seq]
+        if page_to is not None:
+            sql += " AND page_num <= ?"
+            params.append(page_to)
+        if level is not None:
+            sql += " AND level = ?"
+            params.append(level)
+        if min_conf is not None:
+            sql += " AND conf >= ?"
+            params.append(min_conf)
+        # Same as ORDER BY id, but read in index order instead of sorted
+        db_cursor.execute(sql + " ORDER BY page_num, id", params)
+        for row in db_cursor:
+            yield f"{row['_page_num']}:{row['id']}", {
+                field: row[field] for field in fields
+            }
+    finally:
+        conn.close()
+
+
+def iter_ocr_results(
+    db_path: str, task_id: str, **filters: Any
+) -> Iterator[Dict[str, Any]]:
+    for _, row in iter_ocr_rows(db_path, task_id, **filters):
+        yield row
+
+
+@timed_db
+async def get_ocr_results(db_path: str, task_id: str) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(list, iter_ocr_results(db_path, task_id))
+
+
+@timed_db
+async def get_cached_job(
+    db_path: str, cache_key: str, ttl_seconds: int
+) -> Optional[sqlite3.Row]:
+    cutoff = (datetime.now() - timedelta(seconds=ttl_seconds)).isoformat()
+
+    def read(conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+        return conn.execute(
+            """ SELECT jobs.uuid, jobs.num_pages, jobs.page_info
+                 FROM ocr_cache JOIN jobs ON jobs.uuid = ocr_cache.uuid
+                 WHERE ocr_cache.cache_key = ? AND ocr_cache.created_datetime >= ?
+                       AND jobs.status = 'completed' """,
+            (cache_key, cutoff),
+        ).fetchone()
+
+    row = await DatabaseConnection.reader(db_path).run(read)
+    if row is not None:
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                """ UPDATE ocr_cache SET hits = hits + 1, last_hit_datetime = ?
+                     WHERE cache_key = ? """,
+                (datetime.now().isoformat(), cache_key),
+            )
+
+        await DatabaseConnection.writer(db_path).run(write)
+    return row
+
+
+@timed_db
+async def save_cache_entry(
+    db_path: str, cache_key: str, task_id: str, max_entries: int, ttl_seconds: int
+) -> None:
+    def write(conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        now = datetime.now()
+        try:
+            cursor.execute(
+                """ INSERT OR REPLACE INTO ocr_cache
+                     (cache_key, uuid, created_datetime, last_hit_datetime, hits)
+                     VALUES (?, ?, ?, ?, 0) """,
+                (cache_key, task_id, now.isoformat(), now.isoformat()),
+            )
+            # Evict expired entries first, then the least recently used ones
+            cursor.execute(
+                "DELETE FROM ocr_cache WHERE created_datetime < ?",
+                ((now - timedelta(seconds=ttl_seconds)).isoformat(),),
+            )
+            cursor.execute(
+                """ DELETE FROM ocr_cache WHERE cache_key NOT IN (
+                         SELECT cache_key FROM ocr_cache
+                         ORDER BY last_hit_datetime DESC LIMIT ?) """,
+                (max_entries,),
+            )
+        except sqlite3.Error as e:
+            raise Exception(
+                f"Failed to save cache entry for job with id: {task_id}: {e}"
+            )
+
+    await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def copy_ocr_results(
+    db_path: str,
+    source_task_id: str,
+    task_id: str,
+    fields: Dict[str, Any],
+    owner: Optional[str] = None,
+) -> None:
+    # fields are updated on the job in the same transaction, e.g. its progress
+    def write(conn: sqlite3.Connection) -> None:
+        write_job_fields(conn, task_id, fields, owner)
+        cursor = conn.cursor()
+        try:
             cursor.execute(
                 """
             INSERT INTO ocr_results (
                 uuid, level, page_num, block_num, par_num,
                 line_num, word_num, left, top, width, height,
                 conf, text
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) SELECT ?, level, page_num, block_num, par_num,
+                     line_num, word_num, left, top, width, height,
+                     conf, text
+              FROM ocr_results WHERE uuid = ? ORDER BY page_num, id
             """,
-                (
-                    task_id,
-                    data["level"][i],
-                    page_num,
-                    data["block_num"][i],
-                    data["par_num"][i],
-                    data["line_num"][i],
-                    data["word_num"][i],
-                    data["left"][i],
-                    data["top"][i],
-                    data["width"][i],
-                    data["height"][i],
-                    data["conf"][i],
-                    data["text"][i],
-                ),
+                (task_id, source_task_id),
+            )
+            cursor.execute(
+                """ INSERT INTO ocr_pages (uuid, page_num, num_rows, data)
+                     SELECT ?, page_num, num_rows, data
+                     FROM ocr_pages WHERE uuid = ? ORDER BY page_num """,
+                (task_id, source_task_id),
+            )
+        except sqlite3.Error as e:
+            raise Exception(f"Failed to copy results to job with id: {task_id}: {e}")
+
+    await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def count_jobs(db_path: str, statuses: List[str]) -> int:
+    def read(conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            f""" SELECT COALESCE(SUM(count), 0) FROM job_counts
+                 WHERE status IN ({', '.join('?' for _ in statuses)}) """,
+            statuses,
+        ).fetchone()[0]
+
+    return await DatabaseConnection.reader(db_path).run(read)
+
+
+@timed_db
+async def get_job_counts(db_path: str) -> Dict[str, int]:
+    def read(conn: sqlite3.Connection) -> Dict[str, int]:
+        rows = conn.execute("SELECT status, count FROM job_counts WHERE count > 0")
+        return {row["status"]: row["count"] for row in rows}
+
+    return await DatabaseConnection.reader(db_path).run(read)
+
+
+@timed_db
+async def list_jobs(
+    db_path: str,
+    statuses: Optional[List[str]],
+    sort: str,
+    descending: bool,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[Tuple[str, int]] = None,
+    limit: int = 100,
+) -> List[sqlite3.Row]:
+    # One page of jobs in (sort, rowid) order. cursor is the (sort, rowid) of the last
+    # job of the previous page. Every status is read with its own index range scan and
+    # the pages are merged, so the cost depends on limit and not on the history.
+    if sort not in JOB_SORT_COLUMNS:
+        raise ValueError(f"Invalid sort column: {sort}")
+    comparison = "<" if descending else ">"
+    direction = "DESC" if descending else "ASC"
+    conditions = [f"{sort} IS NOT NULL"]
+    params: List[Any] = []
+    if since is not None:
+        conditions.append(f"{sort} >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append(f"{sort} < ?")
+        params.append(until)
+    if cursor is not None:
+        conditions.append(f"({sort}, rowid) {comparison} (?, ?)")
+        params.extend(cursor)
+
+    sql = f"""
+    SELECT rowid, uuid, file_name, start_datetime, status, psm_type, end_datetime,
+        error_message
+    FROM jobs WHERE {{status}} {" AND ".join(conditions)}
+    ORDER BY {sort} {direction}, rowid {direction} LIMIT ?
+    """
+
+    def read(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+        if statuses is None:
+            return conn.execute(sql.format(status=""), [*params, limit]).fetchall()
+
+        rows = []
+        for status in statuses:
+            rows.extend(
+                conn.execute(
+                    sql.format(status="status = ? AND"), [status, *params, limit]
+                ).fetchall()
+            )
+        return rows
+
+    rows = await DatabaseConnection.reader(db_path).run(read)
+    if statuses is None:
+        return rows
+    rows.sort(key=lambda row: (row[sort], row["rowid"]), reverse=descending)
+    return rows[:limit]
+
+
+@timed_db
+async def claim_next_job(
+    db_path: str, owner: str, lease_expires: str
+) -> Optional[sqlite3.Row]:
+    # Atomically move the next queued job to processing, highest priority first.
+    # Other API processes skip it while the lease of owner is renewed.
+    def write(conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+        try:
+            return conn.execute(
+                """
+            UPDATE jobs SET status = 'processing', lease_owner = ?, lease_expires = ?
+            WHERE uuid = (
+                SELECT uuid FROM jobs
+                WHERE status = 'pending' AND input_path IS NOT NULL
+                ORDER BY priority DESC, start_datetime
+                LIMIT 1
             )
+            RETURNING uuid, file_name, kind, lang, dpi, psm_type, config, preprocess,
+                input_path, start_datetime, debug, regions
+            """,
+                (owner, lease_expires),
+            ).fetchone()
+        except sqlite3.Error as e:
+            raise Exception(f"Failed to claim next job: {e}")
+
+    return await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def renew_leases(db_path: str, owner: str, lease_expires: str) -> int:
+    def write(conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            """ UPDATE jobs SET lease_expires = ?
+                 WHERE lease_owner = ? AND status = 'processing' """,
+            (lease_expires, owner),
+        ).rowcount
 
-    conn.commit()
+    return await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def reclaim_expired_jobs(db_path: str, now: str) -> Tuple[int, int]:
+    # Jobs whose API process stopped renewing the lease, e.g. because it died:
+    # re-queue the ones whose input was spooled, they resume after their saved pages,
+    # and fail the ones that cannot be re-run. Jobs from before leases were introduced
+    # have none and count as expired.
+    expired = "(lease_expires IS NULL OR lease_expires < ?)"
+
+    def write(conn: sqlite3.Connection) -> Tuple[int, int]:
+        cursor = conn.cursor()
+        try:
+            orphaned = f""" SELECT uuid FROM jobs
+                WHERE status = 'processing' AND input_path IS NOT NULL AND {expired}
+                      AND COALESCE(pages_done, 0) = 0 """
+            # Results without saved progress are from before pages were saved one by
+            # one and may be incomplete, these jobs start from scratch
+            cursor.execute(
+                f"DELETE FROM ocr_results WHERE uuid IN ({orphaned})", (now,)
+            )
+            cursor.execute(f"DELETE FROM ocr_pages WHERE uuid IN ({orphaned})", (now,))
+            cursor.execute(
+                f""" UPDATE jobs SET status = 'pending', lease_owner = NULL,
+                        lease_expires = NULL
+                     WHERE status = 'processing' AND input_path IS NOT NULL
+                           AND {expired} """,
+                (now,),
+            )
+            requeued = cursor.rowcount
+
+            cursor.execute(
+                f""" UPDATE jobs SET status = 'failed', end_datetime = ?,
+                        error_message = 'Job was interrupted by a restart',
+                        lease_owner = NULL, lease_expires = NULL
+                     WHERE status IN ('pending', 'processing')
+                           AND input_path IS NULL AND {expired} """,
+                (now, now),
+            )
+            failed = cursor.rowcount
+        except sqlite3.Error as e:
+            raise Exception(f"Failed to reclaim jobs: {e}")
+        return requeued, failed
+
+    return await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+async def get_job_status(db_path: str, task_id: str) -> Optional[str]:
+    row = await get_job(db_path, task_id, ["status"])
+    return row["status"] if row is not None else None
+
+
+@timed_db
+async def get_job(
+    db_path: str, task_id: str, columns: List[str]
+) -> Optional[sqlite3.Row]:
+    def read(conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+        return conn.execute(
+            f"SELECT {', '.join(columns)} FROM jobs WHERE uuid = ?", (task_id,)
+        ).fetchone()
+
+    return await DatabaseConnection.reader(db_path).run(read)
+
+
+@timed_db
+def retention_cutoff(
+    db_path: str, max_age_seconds: float, max_jobs: int
+) -> Optional[str]:
+    # end_datetime up to which finished jobs exceed the age or count limit (0 = no limit)
+    cutoffs = []
+    if max_age_seconds > 0:
+        cutoffs.append(
+            (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        )
+    if max_jobs > 0:
+        with DatabaseConnection.read(db_path) as conn:
+            row = conn.execute(
+                f""" SELECT end_datetime FROM jobs
+                     WHERE end_datetime IS NOT NULL AND status IN {FINISHED_STATUSES}
+                     ORDER BY end_datetime DESC LIMIT 1 OFFSET ? """,
+                (max_jobs,),
+            ).fetchone()
+        if row is not None:
+            cutoffs.append(row["end_datetime"])
+    return max(cutoffs) if cutoffs else None
+
+
+@timed_db
+def find_purgeable_jobs(db_path: str, cutoff: Optional[str], limit: int) -> List[str]:
+    # Oldest finished jobs, all of them up to cutoff or any when it is None
+    sql = "SELECT uuid FROM jobs WHERE end_datetime IS NOT NULL"
+    params: List[Any] = []
+    if cutoff is not None:
+        sql += " AND end_datetime <= ?"
+        params.append(cutoff)
+    sql += f" AND status IN {FINISHED_STATUSES} ORDER BY end_datetime LIMIT ?"
+    params.append(limit)
+    with DatabaseConnection.read(db_path) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [row["uuid"] for row in rows]
+
+
+@timed_db
+async def delete_jobs(db_path: str, task_ids: List[str]) -> List[sqlite3.Row]:
+    # Jobs with their results, cache entries and emptied batches in one write. Jobs
+    # being processed are skipped. Returns the deleted jobs, whose files are left to
+    # the caller.
+    def write(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+        placeholders = ", ".join("?" for _ in task_ids)
+        try:
+            deleted = conn.execute(
+                f""" DELETE FROM jobs
+                     WHERE uuid IN ({placeholders}) AND status != 'processing'
+                     RETURNING uuid, input_path, output_path, batch_id """,
+                task_ids,
+            ).fetchall()
+            if not deleted:
+                return []
+            ids = [row["uuid"] for row in deleted]
+            placeholders = ", ".join("?" for _ in ids)
+            for table in ("ocr_results", "ocr_pages", "ocr_cache"):
+                conn.execute(f"DELETE FROM {table} WHERE uuid IN ({placeholders})", ids)
+            batch_ids = list({row["batch_id"] for row in deleted if row["batch_id"]})
+            if batch_ids:
+                conn.execute(
+                    f""" DELETE FROM batches
+                         WHERE batch_id IN ({", ".join("?" for _ in batch_ids)})
+                         AND NOT EXISTS (
+                             SELECT 1 FROM jobs WHERE jobs.batch_id = batches.batch_id
+                         ) """,
+                    batch_ids,
+                )
+        except sqlite3.Error as e:
+            raise Exception(f"Failed to delete jobs: {e}")
+        return deleted
+
+    return await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+def database_size(db_path: str) -> Tuple[int, int]:
+    # Bytes in use and bytes of free pages not yet returned to the file system
+    with DatabaseConnection.read(db_path) as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - free_pages) * page_size, free_pages * page_size
+
+
+@timed_db
+async def incremental_vacuum(db_path: str, pages: int) -> int:
+    # Return up to pages free pages to the file system, returns the free pages left
+    def write(conn: sqlite3.Connection) -> int:
+        conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    return await DatabaseConnection.writer(db_path).run(write)
+
+
+@timed_db
+def checkpoint_wal(db_path: str) -> None:
+    # PASSIVE never waits for readers or writers, journal_size_limit then caps the file
+    # Own connection, checkpoints cannot run inside the transactions of the writer
+    with closing(connect(db_path)) as conn:
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+
+if __name__ == "__main__":
+    # One-off conversion of a database created before incremental vacuum
+    logging.basicConfig(level=logging.INFO)
+    convert_incremental_vacuum(
+        sys.argv[1] if len(sys.argv) > 1 else "app/ocr_results.db",
+        logging.getLogger("app.database"),
+    )
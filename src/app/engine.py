@@ -0,0 +1,166 @@
+import os
+import shlex
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr needs the Tesseract headers at build time
+    tesserocr = None
+
+# "auto" uses tesserocr when it is installed and falls back to pytesseract
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+# Number of initialized Tesseract instances kept alive per worker process
+OCR_ENGINE_CACHE_SIZE = int(os.getenv("OCR_ENGINE_CACHE_SIZE", 4))
+
+TSV_COLUMNS = [
+    "level",
+    "page_num",
+    "block_num",
+    "par_num",
+    "line_num",
+    "word_num",
+    "left",
+    "top",
+    "width",
+    "height",
+    "conf",
+    "text",
+]
+
+
+def build_config(lang: str, dpi: int | None, psm: int, config: str | None) -> str:
+    custom_config = f"-l {lang} --psm {psm}"
+    if dpi:
+        custom_config += f" --dpi {dpi}"
+    if config and config.startswith("-"):
+        custom_config += f" {config}"
+    return custom_config
+
+
+def parse_tsv(tsv: str) -> Dict[str, List[Any]]:
+    # Same layout as pytesseract.image_to_data(..., output_type=Output.DICT)
+    data: Dict[str, List[Any]] = {column: [] for column in TSV_COLUMNS}
+    for line in tsv.splitlines():
+        if not line:
+            continue
+        cells = line.split("\t")
+        if len(cells) < len(TSV_COLUMNS):
+            cells.append("")
+        for column, cell in zip(TSV_COLUMNS[:-1], cells):
+            data[column].append(int(float(cell)))
+        data["text"].append(cells[len(TSV_COLUMNS) - 1])
+    return data
+
+
+class PytesseractEngine:
+    # Spawns one tesseract process per call
+    name = "pytesseract"
+
+    def image_to_data(
+        self,
+        image: Image.Image,
+        lang: str,
+        dpi: int | None,
+        psm: int,
+        config: str | None,
+    ) -> Dict[str, List[Any]]:
+        return pytesseract.image_to_data(
+            image,
+            config=build_config(lang, dpi, psm, config),
+            output_type=pytesseract.Output.DICT,
+        )
+
+
+class TesserocrEngine:
+    # Keeps initialized Tesseract instances alive and hands them raw pixel buffers
+    name = "tesserocr"
+
+    def __init__(self, cache_size: int = OCR_ENGINE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._apis: OrderedDict[Tuple[str, int, str], Any] = OrderedDict()
+
+    @staticmethod
+    def parse_config(config: str | None) -> Optional[Dict[str, Any]]:
+        # Translate the tesseract CLI options into init arguments, None if unsupported
+        options: Dict[str, Any] = {"variables": {}}
+        args = shlex.split(config or "")
+        while args:
+            arg = args.pop(0)
+            if arg == "--oem" and args:
+                options["oem"] = int(args.pop(0))
+            elif arg == "--tessdata-dir" and args:
+                options["path"] = args.pop(0)
+            elif arg == "-c" and args and "=" in args[0]:
+                key, value = args.pop(0).split("=", 1)
+                options["variables"][key] = value
+            else:
+                return None
+        return options
+
+    def _get_api(self, lang: str, psm: int, config: str, options: Dict[str, Any]):
+        key = (lang, psm, config)
+        api = self._apis.get(key)
+        if api is not None:
+            self._apis.move_to_end(key)
+            return api
+
+        kwargs: Dict[str, Any] = {"lang": lang, "psm": psm}
+        if "oem" in options:
+            kwargs["oem"] = options["oem"]
+        if "path" in options:
+            kwargs["path"] = options["path"]
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        for name, value in options["variables"].items():
+            if not api.SetVariable(name, value):
+                api.End()
+                raise ValueError(f"Unknown Tesseract variable: {name}")
+
+        self._apis[key] = api
+        if len(self._apis) > self.cache_size:
+            _, evicted = self._apis.popitem(last=False)
+            evicted.End()
+        return api
+
+    def image_to_data(
+        self,
+        image: Image.Image,
+        lang: str,
+        dpi: int | None,
+        psm: int,
+        config: str | None,
+    ) -> Dict[str, List[Any]]:
+        options = self.parse_config(config)
+        if options is None:
+            return fallback_engine.image_to_data(image, lang, dpi, psm, config)
+
+        api = self._get_api(lang, psm, config or "", options)
+        try:
+            image = image.convert("RGB")
+            width, height = image.size
+            api.SetImageBytes(image.tobytes(), width, height, 3, width * 3)
+            if dpi:
+                api.SetSourceResolution(dpi)
+            return parse_tsv(api.GetTSVText(0))
+        finally:
+            api.Clear()
+
+
+fallback_engine = PytesseractEngine()
+_engine: PytesseractEngine | TesserocrEngine | None = None
+
+
+def get_engine() -> PytesseractEngine | TesserocrEngine:
+    # One engine per worker process, created on first use
+    global _engine
+    if _engine is None:
+        if OCR_ENGINE == "pytesseract" or (OCR_ENGINE == "auto" and tesserocr is None):
+            _engine = fallback_engine
+        elif tesserocr is None:
+            raise RuntimeError("OCR_ENGINE=tesserocr but tesserocr is not installed")
+        else:
+            _engine = TesserocrEngine()
+    return _engine
@@ -0,0 +1,99 @@
+import asyncio
+import inspect
+import logging
+import os
+import subprocess
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List
+
+import pytesseract
+
+# Seconds between two runs of the readiness checks
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 30))
+# Results older than this many intervals count as failed, e.g. when the checks hang
+HEALTH_STALE_INTERVALS = 3
+
+
+# The installed Tesseract does not change while the container runs, so it is only
+# asked once. Failures are not cached and are retried on the next call.
+@lru_cache(maxsize=1)
+def tesseract_version() -> str:
+    result = subprocess.run(
+        ["tesseract", "--version"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError("Tesseract is not available")
+    return result.stdout.splitlines()[0]
+
+
+@lru_cache(maxsize=1)
+def tesseract_languages() -> List[str]:
+    return pytesseract.get_languages(config="")
+
+
+class HealthMonitor:
+    # Runs the readiness checks in the background, so probes only read the last results
+
+    def __init__(
+        self,
+        checks: Dict[str, Callable[[], Any]],
+        logger: logging.Logger,
+        interval: float = HEALTH_CHECK_INTERVAL,
+    ):
+        self.checks = checks
+        self.logger = logger
+        self.interval = interval
+        self.results: Dict[str, str] = {}
+        self.checked_at: float | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self) -> None:
+        results = {}
+        for name, check in self.checks.items():
+            try:
+                if inspect.iscoroutinefunction(check):
+                    await check()
+                else:
+                    await asyncio.to_thread(check)
+                results[name] = "ok"
+            except Exception as e:
+                results[name] = str(e) or type(e).__name__
+        failed = [name for name, result in results.items() if result != "ok"]
+        if failed and failed != self.failed():
+            self.logger.warning(f"Health checks failed: {failed}")
+        self.results = results
+        self.checked_at = time.time()
+
+    def failed(self) -> List[str]:
+        return [name for name, result in self.results.items() if result != "ok"]
+
+    def ready(self) -> bool:
+        if self.checked_at is None:
+            return False
+        age = time.time() - self.checked_at
+        return age < self.interval * HEALTH_STALE_INTERVALS and not self.failed()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready() else "not ready",
+            "checks": self.results,
+            "checked_at": self.checked_at,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List
+
+from app.database import (
+    LeaseLostError,
+    claim_next_job,
+    count_jobs,
+    reclaim_expired_jobs,
+    renew_leases,
+)
+
+# Seconds a job stays leased to the API process running it without a heartbeat.
+# Jobs of a process that died are re-queued by the others once their lease expired.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+# Leases are renewed this many times per lease period
+HEARTBEATS_PER_LEASE = 3
+# Identifies this process as lease owner, the pid alone is reused across restarts
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    # Durable queue on top of the jobs table: jobs are persisted as "pending" and
+    # a fixed number of workers claim them one at a time. Several API processes can
+    # share the table, each claims jobs under a lease it renews while they run.
+
+    def __init__(
+        self,
+        db_path: str,
+        handler: Callable[[sqlite3.Row], Awaitable[None]],
+        workers: int,
+        max_depth: int,
+        logger: logging.Logger,
+    ):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.logger = logger
+        self.avg_job_seconds = 5.0
+        self.owner = WORKER_ID
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        await self.reclaim()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self.notify()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Cancelled jobs are left in processing, expire their leases right away so
+        # the other API processes or the next start pick them up
+        await renew_leases(self.db_path, self.owner, datetime.now().isoformat())
+
+    def lease(self) -> Dict[str, Any]:
+        # Job fields of a job run by this process, e.g. a synchronous /ocr/ request
+        return {"lease_owner": self.owner, "lease_expires": self._lease_expires()}
+
+    async def reclaim(self) -> None:
+        requeued, failed = await reclaim_expired_jobs(
+            self.db_path, datetime.now().isoformat()
+        )
+        if requeued or failed:
+            self.logger.info(
+                f"Reclaimed jobs with expired leases: {requeued} re-queued, "
+                f"{failed} failed"
+            )
+        if requeued:
+            self.notify()
+
+    async def depth(self) -> int:
+        return await count_jobs(self.db_path, ["pending"])
+
+    def retry_after(self, depth: int) -> int:
+        # Rough time until the backlog in front of a new job has been worked off
+        return max(1, math.ceil(depth * self.avg_job_seconds / self.workers))
+
+    async def check_admission(self) -> None:
+        depth = await self.depth()
+        if depth >= self.max_depth:
+            raise QueueFullError(self.retry_after(depth))
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def _worker(self) -> None:
+        while True:
+            self._wakeup.clear()
+            job = await claim_next_job(self.db_path, self.owner, self._lease_expires())
+            if job is None:
+                try:
+                    # The timeout also picks up jobs queued by other processes
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            start = time.monotonic()
+            try:
+                await self.handler(job)
+            except LeaseLostError as e:
+                self.logger.warning(f"Job {job['uuid']} stopped: {e}")
+            except Exception as e:
+                self.logger.error(f"Job {job['uuid']} failed: {e}")
+            self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * (
+                time.monotonic() - start
+            )
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / HEARTBEATS_PER_LEASE)
+            try:
+                await renew_leases(self.db_path, self.owner, self._lease_expires())
+                await self.reclaim()
+            except Exception as e:
+                self.logger.error(f"Job lease heartbeat failed: {e}")
+
+    def _lease_expires(self) -> str:
+        return (datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat()
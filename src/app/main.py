@@ -1,32 +1,92 @@
 import asyncio
+import hashlib
 import json
 import logging
 import os
 import platform
+import re
 import shutil
-import sqlite3
-import subprocess
-# import time
+import tarfile
+import tempfile
+import time
 import uuid
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
 from datetime import datetime  # timedelta
-from io import BytesIO
-from typing import Any, Dict
+from functools import partial
+from itertools import groupby, islice
+from typing import IO, Any, Awaitable, Callable, Dict, List, Tuple
 
 # import psutil
-import pytesseract
 from fastapi import BackgroundTasks, FastAPI, File, HTTPException, UploadFile
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
-from pdf2image import convert_from_bytes
-from PIL import Image
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from app.database import (
+    FINISHED_STATUSES,
+    JOB_SORT_COLUMNS,
+    RESULT_COLUMNS,
+    DatabaseConnection,
+    LeaseLostError,
     check_db_operations,
+    copy_ocr_results,
+    create_batch,
     create_job,
+    delete_jobs,
+    get_batch_jobs,
+    get_cached_job,
+    get_job,
+    get_job_counts,
+    get_job_status,
+    get_ocr_results,
     init_db,
-    save_ocr_results,
+    iter_ocr_results,
+    iter_ocr_rows,
+    list_jobs,
+    save_cache_entry,
+    save_page_results,
     update_job,
 )
+from app.health import HealthMonitor, tesseract_languages, tesseract_version
+from app.job_queue import JobQueue, QueueFullError
+from app.metrics import (
+    CACHE_LOOKUPS,
+    JOBS,
+    POOL_BUSY,
+    POOL_WORKERS,
+    QUEUE_ACTIVE,
+    QUEUE_DEPTH,
+    UPLOAD_BYTES,
+    observe_pages,
+    observe_stage,
+    render_metrics,
+    stage_timer,
+)
+from app.ocr import (
+    count_pages,
+    create_pool,
+    merge_pdfs,
+    ocr_page,
+    ocr_regions,
+    page_resolutions,
+    rasterize_pages,
+    searchable_page,
+)
+from app.preprocess import parse_steps
+from app.profiler import SamplingProfiler, collapse, run_profiled
+from app.regions import merge_regions, parse_regions, split_regions
+from app.retention import RetentionPurger
+from app.tracing import JobTrace, current_trace, start_trace
+from app.uploads import UploadLimitMiddleware
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,20 +98,351 @@ DB_PATH = "app/ocr_results.db"
 PORT = 8000
 HOST = "0.0.0.0"
 tmp_dir = "/tmp"
+# API processes started by app/serve.py, they share the cores between their pools
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+OCR_WORKERS = int(
+    os.getenv("OCR_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY))
+)
+# Upper bound of pages of a single document that are OCRed concurrently
+OCR_MAX_PAGES_PER_JOB = int(
+    os.getenv("OCR_MAX_PAGES_PER_JOB", max(1, OCR_WORKERS // 2))
+)
+# Number of PDF pages rasterized to disk in one go
+PDF_RASTER_WINDOW = int(os.getenv("PDF_RASTER_WINDOW", 4))
+# Result cache for re-submitted documents, 0 entries disables it
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", 1000))
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", 7 * 24 * 60 * 60))
+# "rows" keeps one ocr_results row per word, "columnar" one compressed blob per page
+OCR_STORAGE = os.getenv("OCR_STORAGE", "rows")
+# Result rows sent per chunk of a streamed NDJSON response
+NDJSON_CHUNK_ROWS = 500
+RESPONSE_FORMATS = ["json", "ndjson"]
+RESULT_FORMATS = RESPONSE_FORMATS + ["text"]
+# "pending" lists the waiting and the running jobs
+JOB_STATUS_FILTERS = {
+    "pending": ["pending", "processing"],
+    "processing": ["processing"],
+    "completed": ["completed"],
+    "failed": ["failed"],
+    "all": None,
+}
+JOBS_MAX_LIMIT = 1000
+# Uploads of queued jobs are kept here until the job is finished
+SPOOL_DIR = os.getenv("SPOOL_DIR", "app/spool")
+# Number of queued jobs processed at the same time and how many may wait
+OCR_QUEUE_WORKERS = int(
+    os.getenv("OCR_QUEUE_WORKERS", max(2, OCR_WORKERS // OCR_MAX_PAGES_PER_JOB))
+)
+OCR_QUEUE_MAX_DEPTH = int(os.getenv("OCR_QUEUE_MAX_DEPTH", 1000))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 500))
+# Total size of the files of a batch after unpacking archives
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_MB", 2048)) * 1024 * 1024
+# Searchable PDFs of /start_searchable/ jobs
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "app/output")
+# Uploads are copied to SPOOL_DIR in chunks and may not exceed MAX_UPLOAD_MB, bodies
+# over the limit are already stopped while they are received (see app/uploads.py)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", 200)) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Sampled stacks of jobs submitted with debug=true
+PROFILE_DIR = os.getenv("PROFILE_DIR", "app/profiles")
+# The service reports not ready below this much free space in SPOOL_DIR
+MIN_FREE_DISK_BYTES = int(os.getenv("MIN_FREE_DISK_MB", 1024)) * 1024 * 1024
+
+# Process pool running the CPU bound rasterization / Tesseract work
+ocr_pool: ProcessPoolExecutor | None = None
+
+
+async def run_in_pool(func: Callable[..., Any], *args: Any) -> Any:
+    if ocr_pool is None:
+        raise RuntimeError("OCR worker pool is not running")
+    loop = asyncio.get_running_loop()
+    POOL_BUSY.inc()
+    try:
+        return await loop.run_in_executor(ocr_pool, func, *args)
+    finally:
+        POOL_BUSY.dec()
+
+
+async def document_pages(
+    input_path: str, page_parts: Callable[[int], List[Tuple[Any, ...]]] | None = None
+) -> List[int]:
+    # Numbers of the pages to process, pages without parts are skipped
+    num_pages = 1
+    if is_pdf(input_path):  # Check if the file is a PDF
+        # Poppler reads the spooled upload directly
+        num_pages = await asyncio.to_thread(count_pages, input_path)
+    return [
+        page_num
+        for page_num in range(1, num_pages + 1)
+        if page_parts is None or page_parts(page_num)
+    ]
+
+
+async def run_pages(
+    input_path: str,
+    dpi: int | None,
+    page_func: Callable[..., Any],
+    *args: Any,
+    lang: str,
+    psm: int,
+    pages: List[int] | None = None,
+    page_parts: Callable[[int], List[Tuple[Any, ...]]] | None = None,
+    on_page: Callable[[Any], Awaitable[Any]] | None = None,
+) -> List[Any]:
+    # Runs page_func(source, page_num, *args) in the pool for the given pages of the
+    # document (default: all), lang and psm label the stage metrics. With page_parts,
+    # page_func(source, page_num, *args, *part) runs for every part of a page in
+    # parallel and a page's results are returned as a list. Pages without parts are
+    # skipped. With on_page, every page's result is handed to on_page in page order as
+    # soon as the page and the ones before it are done, and its return values are
+    # returned instead, so results do not pile up until the end.
+    if pages is None:
+        pages = await document_pages(input_path, page_parts)
+    semaphore = asyncio.Semaphore(OCR_MAX_PAGES_PER_JOB)
+    part_tasks: List[asyncio.Task] = []
+    page_tasks: List[asyncio.Task] = []
+
+    async def run_part(
+        page_num: int, source: str, render_dpi: int | None, part: Tuple[Any, ...]
+    ) -> Any:
+        try:
+            func = partial(
+                page_func, rasterized=render_dpi is not None, render_dpi=render_dpi
+            )
+            trace = current_trace.get()
+            with stage_timer("page", lang, psm):
+                if trace is None or trace.profile is None:
+                    return await run_in_pool(func, source, page_num, *args, *part)
+                result, counts = await run_in_pool(
+                    run_profiled,
+                    func,
+                    f"worker;page {page_num}",
+                    source,
+                    page_num,
+                    *args,
+                    *part,
+                )
+                trace.profile.update(counts)
+                return result
+        finally:
+            semaphore.release()
+
+    async def finish_page(
+        parts: List[asyncio.Task], previous: asyncio.Task | None
+    ) -> Any:
+        results = await asyncio.gather(*parts)
+        result = results if page_parts is not None else results[0]
+        if on_page is None:
+            return result
+        if previous is not None:
+            # Pages are handed over in page order
+            await previous
+        return await on_page(result)
+
+    async def submit_page(
+        page_num: int, source: str, render_dpi: int | None = None
+    ) -> None:
+        if page_tasks and page_tasks[-1].done():
+            # A page failed, e.g. on_page could not save it, the others are not needed
+            page_tasks[-1].result()
+        parts = page_parts(page_num) if page_parts is not None else [()]
+        sources = [source] * len(parts)
+        if render_dpi is not None:
+            # Every part deletes the rendered page once loaded, so each gets a hard
+            # link of its own
+            sources = [source] + [
+                hard_link(source, f"{source}.{i}") for i in range(1, len(parts))
+            ]
+        tasks = []
+        for part_source, part in zip(sources, parts):
+            # Wait for a free slot, so pages are only rendered ahead of the OCR by one
+            # window
+            await semaphore.acquire()
+            tasks.append(
+                asyncio.create_task(run_part(page_num, part_source, render_dpi, part))
+            )
+            part_tasks.append(tasks[-1])
+        previous = page_tasks[-1] if page_tasks else None
+        page_tasks.append(asyncio.create_task(finish_page(tasks, previous)))
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        try:
+            if is_pdf(input_path):
+                # Stream the document through the pool window by window
+                for start in range(0, len(pages), PDF_RASTER_WINDOW):
+                    end = start + PDF_RASTER_WINDOW
+                    window = pages[start:end]
+                    for first_page, last_page in consecutive_runs(window):
+                        with stage_timer("probe", lang, psm):
+                            resolutions = await asyncio.to_thread(
+                                page_resolutions,
+                                input_path,
+                                first_page,
+                                last_page,
+                                dpi,
+                            )
+                        # Consecutive pages with the same resolution are rendered together
+                        page_num = first_page
+                        for render_dpi, group in groupby(resolutions):
+                            count = len(list(group))
+                            with stage_timer("rasterize", lang, psm):
+                                paths = await asyncio.to_thread(
+                                    rasterize_pages,
+                                    input_path,
+                                    page_num,
+                                    page_num + count - 1,
+                                    render_dpi,
+                                    work_dir,
+                                )
+                            for path in paths:
+                                await submit_page(page_num, path, render_dpi)
+                                page_num += 1
+            elif pages:
+                await submit_page(1, input_path)
+
+            # gather() keeps the pages in page order
+            return await asyncio.gather(*page_tasks)
+        except BaseException:
+            for task in part_tasks + page_tasks:
+                task.cancel()
+            await asyncio.gather(*part_tasks, *page_tasks, return_exceptions=True)
+            raise
+
+
+def consecutive_runs(pages: List[int]) -> List[Tuple[int, int]]:
+    # (first, last) of every run of consecutive page numbers
+    runs: List[Tuple[int, int]] = []
+    for page_num in pages:
+        if runs and runs[-1][1] == page_num - 1:
+            runs[-1] = (runs[-1][0], page_num)
+        else:
+            runs.append((page_num, page_num))
+    return runs
+
+
+def hard_link(source: str, path: str) -> str:
+    os.link(source, path)
+    return path
+
+
+def region_parts(
+    regions: List[Dict[str, Any]] | None,
+) -> Callable[[int], List[Tuple[Any, ...]]] | None:
+    # Only the crops of the regions are OCRed, spread over the pool
+    if regions is None:
+        return None
+    return partial(split_regions, regions, OCR_MAX_PAGES_PER_JOB)
+
+
+async def run_ocr(
+    input_path: str,
+    pages: List[int],
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+    preprocess: List[str],
+    regions: List[Dict[str, Any]] | None,
+    save_page: Callable[[Tuple[Dict[str, Any], Dict[str, Any]]], Awaitable[None]],
+) -> None:
+    # Every page's (data, page_info) is handed to save_page in page order
+    if regions is not None:
+
+        async def save_regions(parts: List[Any]) -> None:
+            await save_page(merge_regions(parts))
+
+        await run_pages(
+            input_path,
+            dpi,
+            ocr_regions,
+            lang,
+            dpi,
+            psm,
+            config,
+            preprocess,
+            lang=lang,
+            psm=psm,
+            pages=pages,
+            page_parts=region_parts(regions),
+            on_page=save_regions,
+        )
+    else:
+        await run_pages(
+            input_path,
+            dpi,
+            ocr_page,
+            lang,
+            dpi,
+            psm,
+            config,
+            preprocess,
+            lang=lang,
+            psm=psm,
+            pages=pages,
+            on_page=save_page,
+        )
+
+
+def is_pdf(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) == b"%PDF"
+
 
-available_languages = pytesseract.get_languages(config="")
+def compute_cache_key(
+    input_path: str,
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+    preprocess: List[str],
+    regions: List[Dict[str, Any]] | None = None,
+) -> str:
+    with open(input_path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256")
+    # Without preprocessing and regions the key is the same as before they existed
+    params: List[Any] = [lang, dpi, psm, config]
+    if preprocess:
+        params.append(preprocess)
+    if regions is not None:
+        params.append(regions)
+    digest.update(json.dumps(params).encode())
+    return digest.hexdigest()
+
+
+def most_common_dpi(pages: List[Dict[str, Any]]) -> int | None:
+    resolutions = [page["dpi"] for page in pages if page.get("dpi")]
+    if not resolutions:
+        return None
+    return Counter(resolutions).most_common(1)[0][0]
 
 
 async def process_file(
-    contents, task_id: str, lang: str, dpi: int | None, psm: int, config: str | None
-):
+    input_path: str,
+    task_id: str,
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+    preprocess: str | None = None,
+    debug: bool = False,
+    regions: str | None = None,
+) -> Dict[str, Any]:
     await asyncio.sleep(0)  # Yield control to the event loop
+    start = time.perf_counter()
+    steps = parse_steps(preprocess)
+    region_list = parse_regions(regions)
+    # Endpoints start the trace before the upload, queued jobs when they are claimed
+    trace = current_trace.get() or start_trace()
+    profiler = start_profile(trace) if debug else None
+    # Pages saved by a previous attempt of a retried job are kept
+    progress = await get_job(DB_PATH, task_id, ["pages_done", "page_info"])
     result_info: Dict[str, Any] = {
-        "pages": [],
-        "file_type": "PDF" if contents[:4] == b"%PDF" else "Image",
+        "pages": json.loads(progress["page_info"]) if progress["pages_done"] else [],
+        "file_type": "PDF" if is_pdf(input_path) else "Image",
         "used_dpi": dpi,
+        "cache_hit": False,
     }
-    update_job(
+    await update_job(
         DB_PATH,
         task_id,
         {
@@ -60,103 +451,458 @@ async def process_file(
             "dpi": dpi,
             "file_type": result_info["file_type"],
         },
+        owner=job_queue.owner,
     )
 
-    try:
-        if contents[:4] == b"%PDF":  # Check if the file is a PDF
-            if dpi:
-                images = convert_from_bytes(contents, dpi=dpi)
-            else:
-                images = convert_from_bytes(contents)
-        else:
-            pil_image = Image.open(BytesIO(contents))
-            images = [pil_image]
-
-        ocr_data = []
-
-        for page_num, image in enumerate(images, start=1):
-            image = image.convert("RGB")
+    async def save_page(page: Tuple[Dict[str, Any], Dict[str, Any]]) -> None:
+        # Saved as soon as it is done, /results shows the pages so far
+        page_data, page_info = page
+        observe_pages([page_info], lang, psm)
+        result_info["pages"].append(page_info)
+        with stage_timer("db_write", lang, psm):
+            await save_page_results(
+                DB_PATH,
+                task_id,
+                page_data,
+                {
+                    "pages_done": len(result_info["pages"]),
+                    "page_info": json.dumps(result_info["pages"]),
+                },
+                storage=OCR_STORAGE,
+                owner=job_queue.owner,
+            )
 
-            custom_config = f"-l {lang} --psm {psm}"
-            if dpi:
-                custom_config += f" --dpi {dpi}"
-            if config and config.startswith("--"):
-                custom_config += f" {config}"
+    try:
+        cache_key = None
+        if OCR_CACHE_MAX_ENTRIES > 0:
+            cache_key = await asyncio.to_thread(
+                compute_cache_key,
+                input_path,
+                lang,
+                dpi,
+                psm,
+                config,
+                steps,
+                region_list,
+            )
+        if cache_key is not None and not result_info["pages"]:
+            cached_job = await get_cached_job(DB_PATH, cache_key, OCR_CACHE_TTL)
+            CACHE_LOOKUPS.labels("miss" if cached_job is None else "hit").inc()
+            if cached_job is not None:
+                # Same file and parameters were processed before, reuse the stored results
+                result_info["pages"] = json.loads(cached_job["page_info"])
+                result_info["cache_hit"] = True
+                await copy_ocr_results(
+                    DB_PATH,
+                    cached_job["uuid"],
+                    task_id,
+                    {
+                        "pages_done": len(result_info["pages"]),
+                        "page_info": cached_job["page_info"],
+                    },
+                    owner=job_queue.owner,
+                )
 
-            # Perform OCR on the image
-            data = pytesseract.image_to_data(
-                image, config=custom_config, output_type=pytesseract.Output.DICT
+        if not result_info["cache_hit"]:
+            pages = await document_pages(input_path, region_parts(region_list))
+            await update_job(
+                DB_PATH, task_id, {"num_pages": len(pages)}, owner=job_queue.owner
+            )
+            # Pages are saved in page order, a retried job resumes after the last one
+            last_saved = (
+                result_info["pages"][-1]["page_num"] if result_info["pages"] else 0
+            )
+            await run_ocr(
+                input_path,
+                [page_num for page_num in pages if page_num > last_saved],
+                lang,
+                dpi,
+                psm,
+                config,
+                steps,
+                region_list,
+                save_page,
             )
 
-            page_data = {"data": data, "page_num": page_num}
-            ocr_data.append(page_data)
+        # Without a requested dpi, record the resolution most pages were OCRed at
+        if dpi is None:
+            result_info["used_dpi"] = most_common_dpi(result_info["pages"])
 
-            # Add page info to result_info
-            width, height = image.size
-            result_info["pages"].append(
-                {"page_num": page_num, "width": width, "height": height}
-            )
+        observe_stage("total", lang, psm, time.perf_counter() - start)
+        if not result_info["cache_hit"]:
+            trace.add_pages(result_info["pages"])
+        result_info["trace"] = trace.to_dict()
 
-        save_ocr_results(DB_PATH, ocr_data, task_id)
-        update_job(
+        await update_job(
             DB_PATH,
             task_id,
             {
                 "end_datetime": datetime.now().isoformat(),
                 "status": "completed",
-                "num_pages": len(images),
+                "num_pages": len(result_info["pages"]),
                 "page_info": json.dumps(result_info["pages"]),
+                "cache_hit": result_info["cache_hit"],
+                "dpi": result_info["used_dpi"],
+                "trace": trace.encode(),
             },
+            owner=job_queue.owner,
         )
 
+        if cache_key is not None and not result_info["cache_hit"]:
+            await save_cache_entry(
+                DB_PATH, cache_key, task_id, OCR_CACHE_MAX_ENTRIES, OCR_CACHE_TTL
+            )
+
+    except LeaseLostError:
+        # The job belongs to another API process now, which finishes it
+        raise
+
     except Exception as e:
-        update_job(
+        await update_job(
             DB_PATH,
             task_id,
             {
                 "end_datetime": datetime.now().isoformat(),
                 "status": "failed",
-                "error_message": f"Failed to process image: {e}",
+                "error_message": f"Failed to process file: {e}",
+                "trace": trace.encode(),
             },
+            owner=job_queue.owner,
         )
+        JOBS.labels("ocr", "failed").inc()
         raise e
 
+    finally:
+        if profiler is not None:
+            await asyncio.to_thread(save_profile, task_id, trace, profiler)
+
+    JOBS.labels("ocr", "completed").inc()
     return result_info
 
 
-async def generate_pdf(contents, task_id, lang, dpi, psm, config):
-    await asyncio.sleep(0)  # Yield control to the event loop
-    pil_image = Image.open(BytesIO(contents))
+def start_profile(trace: JobTrace) -> SamplingProfiler:
+    # Samples every thread of the API process, concurrent jobs show up as well.
+    # The pages are profiled inside the workers, see run_pages.
+    trace.profile = Counter()
+    return SamplingProfiler().start()
+
+
+def save_profile(task_id: str, trace: JobTrace, profiler: SamplingProfiler) -> None:
+    trace.profile.update(profiler.stop())
+    with open(os.path.join(PROFILE_DIR, f"{task_id}.txt"), "w") as f:
+        f.write(collapse(trace.profile))
+
+
+async def generate_pdf(input_path, output_path, lang, dpi, psm, config):
+    # Pages are OCRed in parallel into page PDFs on disk, then merged in page order
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as pages_dir:
+        pages = await run_pages(
+            input_path,
+            dpi,
+            searchable_page,
+            lang,
+            dpi,
+            psm,
+            config,
+            pages_dir,
+            lang=lang,
+            psm=psm,
+        )
+        await run_in_pool(merge_pdfs, pages, output_path)
+    return output_path
+
+
+async def process_searchable(
+    input_path: str,
+    task_id: str,
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+) -> str:
+    output_path = os.path.join(OUTPUT_DIR, f"{task_id}.pdf")
+    trace = current_trace.get() or start_trace()
+    await update_job(
+        DB_PATH,
+        task_id,
+        {
+            "status": "processing",
+            "psm_type": psm,
+            "dpi": dpi,
+            "file_type": "PDF" if is_pdf(input_path) else "Image",
+        },
+        owner=job_queue.owner,
+    )
 
-    custom_config = f"-l {lang} --psm {psm}"
-    if dpi:
-        custom_config += f" --dpi {dpi}"
-    if config and config.startswith("--"):
-        custom_config += f" {config}"
+    try:
+        with stage_timer("total", lang, psm):
+            await generate_pdf(input_path, output_path, lang, dpi, psm, config)
+        await update_job(
+            DB_PATH,
+            task_id,
+            {
+                "end_datetime": datetime.now().isoformat(),
+                "status": "completed",
+                "output_path": output_path,
+                "trace": trace.encode(),
+            },
+            owner=job_queue.owner,
+        )
+    except LeaseLostError:
+        raise
 
-    pdf = pytesseract.image_to_pdf_or_hocr(
-        pil_image, config=custom_config, extension="pdf"
-    )
-    pdf_path = f"{tmp_dir}/{task_id}.pdf"
-    with open(pdf_path, "wb") as f:
-        f.write(pdf)
-    return pdf_path
+    except Exception as e:
+        await update_job(
+            DB_PATH,
+            task_id,
+            {
+                "end_datetime": datetime.now().isoformat(),
+                "status": "failed",
+                "error_message": f"Failed to create searchable PDF: {e}",
+                "trace": trace.encode(),
+            },
+            owner=job_queue.owner,
+        )
+        JOBS.labels("searchable_pdf", "failed").inc()
+        raise e
+
+    JOBS.labels("searchable_pdf", "completed").inc()
+    return output_path
 
 
 def delete_file(path: str):
     os.remove(path)
 
 
+def remove_file(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def spool_upload(file: UploadFile, path: str) -> int:
+    # Copy the upload to disk chunk by chunk and enforce the size limit on the way
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=upload_limit_message())
+
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=upload_limit_message())
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        remove_file(path)
+        raise
+    UPLOAD_BYTES.inc(size)
+    return size
+
+
+def remove_job_files(job) -> None:
+    # Files of a deleted job: its spooled input, searchable PDF and debug profile
+    for path in (job["input_path"], job["output_path"]):
+        if path:
+            remove_file(path)
+    remove_file(os.path.join(PROFILE_DIR, f"{job['uuid']}.txt"))
+
+
+def upload_limit_message() -> str:
+    return f"File exceeds the upload limit of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+
+
+async def run_queued_job(job) -> None:
+    QUEUE_ACTIVE.inc()
+    trace = start_trace()
+    queued_at = datetime.fromisoformat(job["start_datetime"])
+    trace.queue_wait_ms = (datetime.now() - queued_at).total_seconds() * 1000
+    finished = False
+    try:
+        if job["kind"] == "searchable_pdf":
+            await process_searchable(
+                job["input_path"],
+                job["uuid"],
+                job["lang"],
+                job["dpi"],
+                job["psm_type"],
+                job["config"],
+            )
+        else:
+            await process_file(
+                job["input_path"],
+                job["uuid"],
+                job["lang"],
+                job["dpi"],
+                job["psm_type"],
+                job["config"],
+                job["preprocess"],
+                bool(job["debug"]),
+                job["regions"],
+            )
+        finished = True
+    except (asyncio.CancelledError, LeaseLostError):
+        # E.g. a shutdown: the job stays in processing with its spooled input and is
+        # re-queued once its lease expired. A job whose lease was lost already is, and
+        # its new owner needs the input.
+        raise
+    except Exception:
+        # Failed jobs are marked as failed, unless that write failed as well
+        finished = await get_job_status(DB_PATH, job["uuid"]) in FINISHED_STATUSES
+        raise
+    finally:
+        # The spooled input is only needed until the job is finished
+        if finished:
+            remove_file(job["input_path"])
+        QUEUE_ACTIVE.dec()
+
+
+# Queue of the jobs submitted to /start_ocr/
+job_queue = JobQueue(
+    DB_PATH, run_queued_job, OCR_QUEUE_WORKERS, OCR_QUEUE_MAX_DEPTH, logger
+)
+
+
+def check_tesseract() -> None:
+    tesseract_version()
+    tesseract_languages()
+
+
+def check_disk() -> None:
+    free = shutil.disk_usage(SPOOL_DIR).free
+    if free < MIN_FREE_DISK_BYTES:
+        raise RuntimeError(f"Only {free // (1024 * 1024)} MB free in {SPOOL_DIR}")
+
+
+def check_workers() -> None:
+    # A pool whose worker died stays broken, every page submitted to it fails
+    if ocr_pool is None or getattr(ocr_pool, "_broken", False):
+        raise RuntimeError("OCR worker pool is not running")
+
+
+# Deletes expired jobs and compacts the database every RETENTION_INTERVAL seconds
+retention_purger = RetentionPurger(DB_PATH, remove_job_files, logger)
+
+# Readiness checks, run in the background every HEALTH_CHECK_INTERVAL seconds
+health_monitor = HealthMonitor(
+    {
+        "tesseract": check_tesseract,
+        "disk": check_disk,
+        "database": partial(check_db_operations, DB_PATH),
+        "workers": check_workers,
+    },
+    logger,
+)
+
+
+def stream_results(
+    header: Dict[str, Any],
+    task_id: str,
+    filters: Dict[str, Any] | None = None,
+    limit: int | None = None,
+    headers: Dict[str, str] | None = None,
+) -> StreamingResponse:
+    # NDJSON: the job info on the first line, then one result row per line
+    def generate():
+        yield json.dumps(header) + "\n"
+        chunk = []
+        last_cursor = None
+        rows = iter_ocr_rows(DB_PATH, task_id, **(filters or {}))
+        for count, (cursor, row) in enumerate(rows):
+            if limit is not None and count == limit:
+                # More rows left, the last line carries the cursor of the next page
+                chunk.append(json.dumps({"next_cursor": last_cursor}))
+                break
+            chunk.append(json.dumps(row))
+            last_cursor = cursor
+            if len(chunk) >= NDJSON_CHUNK_ROWS:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return StreamingResponse(
+        generate(), media_type="application/x-ndjson", headers=headers
+    )
+
+
+def read_result_rows(
+    task_id: str, filters: Dict[str, Any], limit: int | None
+) -> List[Tuple[str, Dict[str, Any]]]:
+    # (cursor, row) pairs of up to limit rows, the read connection is closed right away
+    rows = iter_ocr_rows(DB_PATH, task_id, **filters)
+    try:
+        return list(rows if limit is None else islice(rows, limit))
+    finally:
+        rows.close()
+
+
+def build_text(task_id: str, filters: Dict[str, Any]) -> str:
+    # Rebuild the plain text from the word level rows: lines, blank line between
+    # paragraphs and a form feed between pages, like tesseract's txt output
+    pages: List[str] = []
+    lines: List[str] = []
+    words: List[str] = []
+    current_page = current_par = current_line = None
+    fields = ["page_num", "block_num", "par_num", "line_num", "text"]
+    for row in iter_ocr_results(DB_PATH, task_id, level=5, fields=fields, **filters):
+        par = (row["block_num"], row["par_num"])
+        line = (par, row["line_num"])
+        if row["page_num"] != current_page:
+            if words:
+                lines.append(" ".join(words))
+            if current_page is not None:
+                pages.append("\n".join(lines))
+            lines, words = [], []
+        elif line != current_line:
+            lines.append(" ".join(words))
+            if par != current_par:
+                lines.append("")
+            words = []
+        current_page, current_par, current_line = row["page_num"], par, line
+        if row["text"].strip():
+            words.append(row["text"])
+    if words:
+        lines.append(" ".join(words))
+    if current_page is not None:
+        pages.append("\n".join(lines))
+    return "\f".join(pages)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    global ocr_pool
     init_db(DB_PATH, logger)
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    ocr_pool = create_pool(OCR_WORKERS)
+    POOL_WORKERS.set(OCR_WORKERS)
+    logger.info(f"OCR worker pool started with {OCR_WORKERS} processes")
+    await job_queue.start()
+    await health_monitor.start()
+    await retention_purger.start()
     yield
+    # Shutdown
+    await retention_purger.stop()
+    await health_monitor.stop()
+    await job_queue.stop()
+    ocr_pool.shutdown(cancel_futures=True)
+    ocr_pool = None
+    DatabaseConnection.close(DB_PATH)
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+def upload_limit(path: str) -> int:
+    # A batch uploads several files or archives
+    return BATCH_MAX_BYTES if path == "/start_batch/" else MAX_UPLOAD_BYTES
+
+
+app.add_middleware(UploadLimitMiddleware, limit=upload_limit)
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url="/docs")
@@ -173,13 +919,17 @@ async def perform_ocr(
     dpi: int | None = None,
     config: str | None = None,
     psm: int = 3,
+    preprocess: str | None = None,
+    regions: str | None = None,
+    format: str = "json",
+    debug: bool = False,
 ):
     # Common validation logic
-    if lang not in available_languages:
+    if lang not in tesseract_languages():
         return JSONResponse(
             content={
                 "error": "Specified language is not available",
-                "available_languages": available_languages,
+                "available_languages": tesseract_languages(),
             },
             status_code=400,
         )
@@ -201,124 +951,74 @@ async def perform_ocr(
             content={"error": "Config must start with '--'"}, status_code=400
         )
 
+    error = validate_preprocess(preprocess) or validate_regions(regions)
+    if error is not None:
+        return error
+
+    if format not in RESPONSE_FORMATS:
+        return JSONResponse(
+            content={"error": f"Invalid format. Must be one of: {RESPONSE_FORMATS}"},
+            status_code=400,
+        )
+
     # Create a new job in the database
-    contents = await file.read()
     task_id = str(uuid.uuid4())
+    input_path = os.path.join(SPOOL_DIR, task_id)
+    trace = start_trace()
+    with stage_timer("upload", lang, psm):
+        await spool_upload(file, input_path)
     start_datetime = datetime.now().isoformat()
-    create_job(DB_PATH, task_id, str(file.filename), start_datetime=start_datetime)
+    await create_job(
+        DB_PATH,
+        task_id,
+        str(file.filename),
+        start_datetime=start_datetime,
+        fields={"status": "processing", **job_queue.lease()},
+    )
 
     try:
-        result_info: Dict[str, Any] = {
-            "pages": [],
-            "file_type": "PDF" if contents[:4] == b"%PDF" else "Image",
-            "used_dpi": dpi,
-        }
-        update_job(
-            DB_PATH,
-            task_id,
-            {
-                "status": "processing",
-                "psm_type": psm,
-                "dpi": dpi,
-                "file_type": result_info["file_type"],
-            },
+        result_info = await process_file(
+            input_path, task_id, lang, dpi, psm, config, preprocess, debug, regions
         )
-
-        if contents[:4] == b"%PDF":  # Check if the file is a PDF
-            if dpi:
-                images = convert_from_bytes(contents, dpi=dpi)
-            else:
-                images = convert_from_bytes(contents)
-        else:
-            pil_image = Image.open(BytesIO(contents))
-            images = [pil_image]
-
-        ocr_data = []
-        for page_num, image in enumerate(images, start=1):
-            image = image.convert("RGB")
-
-            custom_config = f"-l {lang} --psm {psm}"
-            if dpi:
-                custom_config += f" --dpi {dpi}"
-            if config and config.startswith("--"):
-                custom_config += f" {config}"
-
-            # Perform OCR on the image
-            data = pytesseract.image_to_data(
-                image, config=custom_config, output_type=pytesseract.Output.DICT
-            )
-
-            page_data = {"data": data, "page_num": page_num}
-            ocr_data.append(page_data)
-
-            # Add page info to result_info
-            width, height = image.size
-            result_info["pages"].append(
-                {"page_num": page_num, "width": width, "height": height}
-            )
-
-        save_ocr_results(DB_PATH, ocr_data, task_id)
+        headers = {"Server-Timing": trace.server_timing()}
         end_datetime = datetime.now().isoformat()
-        update_job(
-            DB_PATH,
-            task_id,
-            {
-                "end_datetime": end_datetime,
-                "status": "completed",
-                "num_pages": len(images),
-                "page_info": json.dumps(result_info["pages"]),
-            },
-        )
-
-        results = []
-        for data in ocr_data:
-            for i in range(len(data["data"]["level"])):
-                results.append(
-                    {
-                        "level": data["data"]["level"][i],
-                        "page_num": data["data"]["page_num"][i],
-                        "block_num": data["data"]["block_num"][i],
-                        "par_num": data["data"]["par_num"][i],
-                        "line_num": data["data"]["line_num"][i],
-                        "word_num": data["data"]["word_num"][i],
-                        "left": data["data"]["left"][i],
-                        "top": data["data"]["top"][i],
-                        "width": data["data"]["width"][i],
-                        "height": data["data"]["height"][i],
-                        "conf": data["data"]["conf"][i],
-                        "text": data["data"]["text"][i],
-                    }
-                )
 
         response = {
             "task_id": task_id,
             "file_name": str(file.filename),
             "file_type": result_info["file_type"],
-            "num_pages": len(images),
+            "num_pages": len(result_info["pages"]),
             "start_datetime": start_datetime,
             "end_datetime": end_datetime,
             "status": "completed",
-            "dpi": dpi,
+            "dpi": result_info["used_dpi"],
             "page_info": result_info["pages"],
             "psm_type": psm,
-            "results": results,
+            "cache_hit": result_info["cache_hit"],
+            "trace": result_info["trace"],
         }
 
-        return JSONResponse(content=response)
+        # Pages were saved as they finished, the rows are read back from the database
+        if format == "ndjson":
+            return stream_results(response, task_id, headers=headers)
 
-    except Exception as e:
-        end_datetime = datetime.now().isoformat()
-        update_job(
-            DB_PATH,
-            task_id,
-            {
-                "end_datetime": end_datetime,
-                "status": "failed",
-                "error_message": f"Failed to process file: {e}",
-            },
+        results = await get_ocr_results(DB_PATH, task_id)
+        response["results"] = results
+
+        return JSONResponse(content=response, headers=headers)
+
+    except LeaseLostError:
+        # Another API process failed the job, this one stalled for longer than a lease
+        raise HTTPException(
+            status_code=503, detail="Processing was interrupted, retry the request"
         )
+
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process file: {e}")
 
+    finally:
+        remove_file(input_path)
+
 
 @app.post(
     "/start_ocr/",
@@ -326,19 +1026,22 @@ async def perform_ocr(
     description="This endpoint starts OCR processing and returns a task_id.",
 )
 async def start_ocr_processing(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     lang: str = "eng",
     dpi: int | None = None,
     config: str | None = None,
     psm: int = 3,
+    preprocess: str | None = None,
+    regions: str | None = None,
+    priority: int = 0,
+    debug: bool = False,
 ):
     # Common validation logic
-    if lang not in available_languages:
+    if lang not in tesseract_languages():
         return JSONResponse(
             content={
                 "error": "Specified language is not available",
-                "available_languages": available_languages,
+                "available_languages": tesseract_languages(),
             },
             status_code=400,
         )
@@ -360,38 +1063,437 @@ async def start_ocr_processing(
             content={"error": "Config must start with '--'"}, status_code=400
         )
 
-    # Create a new job in the database
-    contents = await file.read()
+    error = validate_preprocess(preprocess) or validate_regions(regions)
+    if error is not None:
+        return error
+
+    # Reject new work while the queue is full
+    try:
+        await job_queue.check_admission()
+    except QueueFullError as e:
+        return JSONResponse(
+            content={"error": str(e)},
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    # Spool the upload to disk, so the job survives a restart
     task_id = str(uuid.uuid4())
-    create_job(
-        DB_PATH, task_id, str(file.filename), start_datetime=datetime.now().isoformat()
+    input_path = os.path.join(SPOOL_DIR, task_id)
+    with stage_timer("upload", lang, psm):
+        await spool_upload(file, input_path)
+
+    # Create a new job in the database
+    await create_job(
+        DB_PATH,
+        task_id,
+        str(file.filename),
+        start_datetime=datetime.now().isoformat(),
+        fields={
+            "lang": lang,
+            "dpi": dpi,
+            "psm_type": psm,
+            "config": config,
+            "preprocess": preprocess,
+            "regions": regions,
+            "priority": priority,
+            "input_path": input_path,
+            "debug": debug,
+        },
     )
 
-    # Process the image in the background
-    background_tasks.add_task(process_file, contents, task_id, lang, dpi, psm, config)
+    # Process the file in the background
+    job_queue.notify()
     return JSONResponse(content={"task_id": task_id})
 
 
+def validate_params(
+    lang: str, dpi: int | None, psm: int, config: str | None
+) -> JSONResponse | None:
+    if lang not in tesseract_languages():
+        return JSONResponse(
+            content={
+                "error": "Specified language is not available",
+                "available_languages": tesseract_languages(),
+            },
+            status_code=400,
+        )
+
+    if dpi is not None and dpi <= 0:
+        return JSONResponse(
+            content={"error": "DPI must be more than 0"}, status_code=400
+        )
+
+    valid_psm_values = [0, 1, 2, 3, 4, 6, 8, 9, 11, 12, 13]
+    if psm not in valid_psm_values:
+        return JSONResponse(
+            content={"error": f"Invalid PSM value. Must be one of: {valid_psm_values}"},
+            status_code=400,
+        )
+
+    if config and not config.startswith("--"):
+        return JSONResponse(
+            content={"error": "Config must start with '--'"}, status_code=400
+        )
+    return None
+
+
+def validate_preprocess(preprocess: str | None) -> JSONResponse | None:
+    try:
+        parse_steps(preprocess)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    return None
+
+
+def validate_regions(regions: str | None) -> JSONResponse | None:
+    try:
+        parse_regions(regions)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    return None
+
+
+class BatchBudget:
+    # Files and bytes a batch may still spool. Charged while archives are unpacked,
+    # so an oversized batch is rejected before it fills the spool directory.
+
+    def __init__(self, max_files: int, max_bytes: int):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.files = 0
+        self.bytes = 0
+
+    def add_file(self) -> None:
+        self.files += 1
+        if self.files > self.max_files:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A batch can contain at most {self.max_files} files",
+            )
+
+    def add_bytes(self, size: int) -> None:
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch exceeds the limit of {self.max_bytes // (1024 * 1024)} MB",
+            )
+
+
+def expand_archive(
+    file_name: str, path: str, budget: BatchBudget
+) -> List[Tuple[str, str, str]]:
+    # ZIP and TAR (optionally compressed) archives are unpacked into the spool
+    # directory, other files are kept as is. Returns (task_id, file_name, path).
+    documents: List[Tuple[str, str, str]] = []
+    try:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zip_archive:
+                for info in zip_archive.infolist():
+                    if not info.is_dir() and not is_hidden_member(info.filename):
+                        budget.add_file()
+                        documents.append(
+                            spool_member(
+                                f"{file_name}/{info.filename}",
+                                zip_archive.open(info),
+                                budget,
+                            )
+                        )
+        else:
+            try:
+                tar_archive = tarfile.open(path, mode="r:*")
+            except tarfile.TarError:
+                budget.add_file()
+                budget.add_bytes(os.path.getsize(path))
+                return [(os.path.basename(path), file_name, path)]
+            with tar_archive:
+                for member in tar_archive:
+                    extracted = (
+                        tar_archive.extractfile(member) if member.isfile() else None
+                    )
+                    if extracted is not None and not is_hidden_member(member.name):
+                        budget.add_file()
+                        documents.append(
+                            spool_member(
+                                f"{file_name}/{member.name}", extracted, budget
+                            )
+                        )
+    except BaseException:
+        for _, _, member_path in documents:
+            remove_file(member_path)
+        remove_file(path)
+        raise
+
+    os.remove(path)
+    return documents
+
+
+def spool_member(
+    file_name: str, member: IO[bytes], budget: BatchBudget
+) -> Tuple[str, str, str]:
+    task_id = str(uuid.uuid4())
+    path = os.path.join(SPOOL_DIR, task_id)
+    size = 0
+    try:
+        with member, open(path, "wb") as f:
+            while chunk := member.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"{file_name}: {upload_limit_message()}",
+                    )
+                budget.add_bytes(len(chunk))
+                f.write(chunk)
+    except BaseException:
+        remove_file(path)
+        raise
+    return task_id, file_name, path
+
+
+def is_hidden_member(name: str) -> bool:
+    # __MACOSX/ resource forks and dotfiles like .DS_Store, "./" prefixes of tar
+    # members are not hidden
+    return any(
+        part == "__MACOSX" or (part.startswith(".") and part not in (".", ".."))
+        for part in name.split("/")
+    )
+
+
+@app.post(
+    "/start_batch/",
+    summary="Starts OCR processing of a batch [ASYNC]",
+    description="""Starts OCR processing of multiple files or of the files in a ZIP/TAR archive
+                and returns a batch_id and the task_ids of the files.""",
+)
+async def start_batch_processing(
+    files: List[UploadFile] = File(...),
+    lang: str = "eng",
+    dpi: int | None = None,
+    config: str | None = None,
+    psm: int = 3,
+    preprocess: str | None = None,
+    priority: int = 0,
+    debug: bool = False,
+):
+    error = validate_params(lang, dpi, psm, config) or validate_preprocess(preprocess)
+    if error is not None:
+        return error
+
+    jobs: List[Tuple[str, str, str]] = []
+    budget = BatchBudget(BATCH_MAX_FILES, BATCH_MAX_BYTES)
+    try:
+        for file in files:
+            upload_path = os.path.join(SPOOL_DIR, str(uuid.uuid4()))
+            with stage_timer("upload", lang, psm):
+                await spool_upload(file, upload_path)
+            jobs.extend(
+                await asyncio.to_thread(
+                    expand_archive, str(file.filename), upload_path, budget
+                )
+            )
+    except BaseException:
+        for _, _, path in jobs:
+            remove_file(path)
+        raise
+
+    error = None
+    if not jobs:
+        error = JSONResponse(content={"error": "No files in batch"}, status_code=400)
+    else:
+        # The whole batch has to fit into the queue
+        depth = await job_queue.depth()
+        if depth + len(jobs) > job_queue.max_depth:
+            retry_after = job_queue.retry_after(depth)
+            error = JSONResponse(
+                content={
+                    "error": f"Job queue is full, retry after {retry_after} seconds"
+                },
+                status_code=429,
+                headers={"Retry-After": str(retry_after)},
+            )
+    if error is not None:
+        for _, _, path in jobs:
+            remove_file(path)
+        return error
+
+    batch_id = str(uuid.uuid4())
+
+    await create_batch(
+        DB_PATH,
+        batch_id,
+        datetime.now().isoformat(),
+        jobs,
+        fields={
+            "lang": lang,
+            "dpi": dpi,
+            "psm_type": psm,
+            "config": config,
+            "preprocess": preprocess,
+            "priority": priority,
+            "debug": debug,
+        },
+    )
+
+    job_queue.notify()
+    return JSONResponse(
+        content={"batch_id": batch_id, "task_ids": [task_id for task_id, _, _ in jobs]}
+    )
+
+
+@app.get(
+    "/batches/{batch_id}",
+    summary="Get Batch Progress",
+    description="Retrieve the aggregate progress and the jobs of a batch.",
+)
+async def get_batch(batch_id: str):
+    jobs = await get_batch_jobs(DB_PATH, batch_id)
+    if jobs is None:
+        raise HTTPException(status_code=404, detail="batch_id not found")
+
+    progress = {"pending": 0, "processing": 0, "completed": 0, "failed": 0}
+    for job in jobs:
+        progress[job["status"]] = progress.get(job["status"], 0) + 1
+
+    return JSONResponse(
+        content={
+            "batch_id": batch_id,
+            "num_jobs": len(jobs),
+            "progress": progress,
+            "done": progress["completed"] + progress["failed"] == len(jobs),
+            "jobs": [
+                {
+                    "task_id": job["uuid"],
+                    "file_name": job["file_name"],
+                    "status": job["status"],
+                }
+                for job in jobs
+            ],
+        }
+    )
+
+
+@app.get(
+    "/batches/{batch_id}/results",
+    summary="Get Batch Results",
+    description="Retrieve the results of all jobs of a batch.",
+)
+async def get_batch_results(batch_id: str, format: str = "json"):
+    if format not in RESPONSE_FORMATS:
+        return JSONResponse(
+            content={"error": f"Invalid format. Must be one of: {RESPONSE_FORMATS}"},
+            status_code=400,
+        )
+
+    jobs = await get_batch_jobs(DB_PATH, batch_id)
+    if jobs is None:
+        raise HTTPException(status_code=404, detail="batch_id not found")
+
+    async def job_result(job) -> Dict[str, Any]:
+        return {
+            "task_id": job["uuid"],
+            "file_name": job["file_name"],
+            "status": job["status"],
+            "num_pages": job["num_pages"],
+            "error_message": job["error_message"],
+            "results": (
+                await get_ocr_results(DB_PATH, job["uuid"])
+                if job["status"] == "completed"
+                else None
+            ),
+        }
+
+    if format == "ndjson":
+        # One line per job, only one job's results are in memory at a time
+        async def generate():
+            for job in jobs:
+                yield json.dumps(await job_result(job)) + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    return JSONResponse(
+        content={
+            "batch_id": batch_id,
+            "jobs": [await job_result(job) for job in jobs],
+        }
+    )
+
+
 @app.get(
     "/results/{task_id}",
     summary="Get Results",
     description="Retrieve results with a task_id.",
 )
-async def get_result(task_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+async def get_result(
+    task_id: str,
+    format: str = "json",
+    page_from: int | None = None,
+    page_to: int | None = None,
+    level: int | None = None,
+    min_conf: int | None = None,
+    fields: str | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+):
+    if format not in RESULT_FORMATS:
+        return JSONResponse(
+            content={"error": f"Invalid format. Must be one of: {RESULT_FORMATS}"},
+            status_code=400,
+        )
+
+    if level is not None and level not in [1, 2, 3, 4, 5]:
+        return JSONResponse(
+            content={"error": "Level must be one of: [1, 2, 3, 4, 5]"},
+            status_code=400,
+        )
+
+    field_list = fields.split(",") if fields else None
+    if field_list and not set(field_list) <= set(RESULT_COLUMNS):
+        return JSONResponse(
+            content={"error": f"Invalid fields. Must be a subset of: {RESULT_COLUMNS}"},
+            status_code=400,
+        )
+
+    if cursor is not None and not re.fullmatch(r"\d+:-?\d+", cursor):
+        return JSONResponse(content={"error": "Invalid cursor"}, status_code=400)
+
+    if limit is not None and limit <= 0:
+        return JSONResponse(
+            content={"error": "Limit must be more than 0"}, status_code=400
+        )
+
+    filters = {
+        "page_from": page_from,
+        "page_to": page_to,
+        "level": level,
+        "min_conf": min_conf,
+        "fields": field_list,
+        "cursor": cursor,
+    }
 
     # Get job info
-    cursor.execute(
-        """ SELECT file_name, file_type, num_pages, start_datetime, end_datetime,
-                    status, dpi, page_info, psm_type, error_message
-             FROM jobs WHERE uuid = ? """,
-        (task_id,),
+    job_row = await get_job(
+        DB_PATH,
+        task_id,
+        [
+            "file_name",
+            "file_type",
+            "num_pages",
+            "start_datetime",
+            "end_datetime",
+            "status",
+            "dpi",
+            "page_info",
+            "psm_type",
+            "error_message",
+            "cache_hit",
+            "trace",
+            "pages_done",
+        ],
     )
-    job_row = cursor.fetchone()
 
     if not job_row:
-        conn.close()
         raise HTTPException(status_code=404, detail="task_id not found")
 
     (
@@ -405,48 +1507,26 @@ async def get_result(task_id: str):
         page_info,
         psm_type,
         error_message,
+        cache_hit,
+        trace,
+        pages_done,
     ) = job_row
 
-    # Get OCR results
-    cursor.execute(
-        """ SELECT level, page_num, block_num, par_num, line_num,
-                    word_num, left, top, width, height, conf,
-                    text FROM ocr_results WHERE uuid = ? """,
-        (task_id,),
-    )
-    ocr_rows = cursor.fetchall()
-    conn.close()
-
     if status == "completed":
-        results = []
-        for row in ocr_rows:
-            results.append(
-                {
-                    "level": row[0],
-                    "page_num": row[1],
-                    "block_num": row[2],
-                    "par_num": row[3],
-                    "line_num": row[4],
-                    "word_num": row[5],
-                    "left": row[6],
-                    "top": row[7],
-                    "conf": row[8],
-                    "text": row[9],
-                }
-            )
-
         response = {
             "state": "SUCCESS",
             "file_name": file_name,
             "file_type": file_type,
             "num_pages": num_pages,
+            "pages_done": pages_done or 0,
             "start_datetime": start_datetime,
             "end_datetime": end_datetime,
             "status": status,
             "dpi": dpi,
             "page_info": json.loads(page_info) if page_info else None,
             "psm_type": psm_type,
-            "results": results,
+            "cache_hit": bool(cache_hit),
+            "trace": json.loads(trace) if trace else None,
         }
     elif status == "failed":
         response = {
@@ -455,20 +1535,23 @@ async def get_result(task_id: str):
             "file_name": file_name,
             "file_type": file_type,
             "num_pages": num_pages,
+            "pages_done": pages_done or 0,
             "start_datetime": start_datetime,
             "end_datetime": end_datetime,
             "dpi": dpi,
             "page_info": json.loads(page_info) if page_info else None,
             "psm_type": psm_type,
             "error_message": error_message,
+            "trace": json.loads(trace) if trace else None,
         }
-    elif status == "running":
+    elif status == "processing":
         response = {
             "state": "RUNNING",
             "status": status,
             "file_name": file_name,
             "file_type": file_type,
             "num_pages": num_pages,
+            "pages_done": pages_done or 0,
             "start_datetime": start_datetime,
             "end_datetime": end_datetime,
             "dpi": dpi,
@@ -483,6 +1566,7 @@ async def get_result(task_id: str):
             "file_name": file_name,
             "file_type": file_type,
             "num_pages": num_pages,
+            "pages_done": pages_done or 0,
             "start_datetime": start_datetime,
             "end_datetime": end_datetime,
             "dpi": dpi,
@@ -490,9 +1574,68 @@ async def get_result(task_id: str):
             "psm_type": psm_type,
         }
 
+    if status not in ("completed", "processing", "failed"):
+        return JSONResponse(content=response)
+
+    # Pages are saved as they finish, running and failed jobs return the ones so far
+    if format == "text":
+        text_filters = {
+            "page_from": page_from,
+            "page_to": page_to,
+            "min_conf": min_conf,
+        }
+        text = await asyncio.to_thread(build_text, task_id, text_filters)
+        return PlainTextResponse(text)
+
+    if format == "ndjson":
+        return stream_results(response, task_id, filters, limit)
+
+    # Get OCR results, one row more than requested tells if there is a next page
+    results = await asyncio.to_thread(
+        read_result_rows, task_id, filters, None if limit is None else limit + 1
+    )
+    response["next_cursor"] = None
+    if limit is not None and len(results) > limit:
+        results = results[:limit]
+        response["next_cursor"] = results[-1][0]
+    response["results"] = [row for _, row in results]
+
     return JSONResponse(content=response)
 
 
+@app.delete(
+    "/results/{task_id}",
+    summary="Delete OCR Results",
+    description="Deletes a finished or pending job with its results and files before the retention period ends.",
+)
+async def delete_result(task_id: str):
+    status = await get_job_status(DB_PATH, task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="task_id not found")
+    if status == "processing":
+        return JSONResponse(
+            content={"error": "Job is being processed, delete it once it finished"},
+            status_code=409,
+        )
+
+    deleted = await delete_jobs(DB_PATH, [task_id])
+    for job in deleted:
+        remove_job_files(job)
+    return JSONResponse(content={"task_id": task_id, "deleted": bool(deleted)})
+
+
+@app.get(
+    "/results/{task_id}/profile",
+    summary="Get the profile of a debug job",
+    description="Stacks sampled while a job submitted with debug=true ran, in the collapsed format of flamegraph.pl and speedscope.",
+)
+async def get_profile(task_id: str):
+    path = os.path.join(PROFILE_DIR, f"{task_id}.txt")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No profile for this task_id")
+    return FileResponse(path=path, media_type="text/plain")
+
+
 @app.post(
     "/create_searchable/",
     summary="Create Searchable PDF [SYNC]",
@@ -506,7 +1649,7 @@ async def generate_searchable_pdf(
     psm: int = 3,
     config: str | None = None,
 ):
-    if lang not in available_languages:
+    if lang not in tesseract_languages():
         return JSONResponse(
             content={"error": "Specified language is not available"}, status_code=400
         )
@@ -524,80 +1667,210 @@ async def generate_searchable_pdf(
             content={"error": "Config must start with '--'"}, status_code=400
         )
 
-    contents = await file.read()
     task_id = str(uuid.uuid4())  # Generate a new UUID for each task
-    pdf_path = await generate_pdf(contents, task_id, lang, dpi, psm, config)
+    input_path = os.path.join(SPOOL_DIR, task_id)
+    trace = start_trace()
+    with stage_timer("upload", lang, psm):
+        await spool_upload(file, input_path)
+    try:
+        with stage_timer("total", lang, psm):
+            pdf_path = await generate_pdf(
+                input_path, f"{tmp_dir}/{task_id}.pdf", lang, dpi, psm, config
+            )
+    finally:
+        remove_file(input_path)
 
     # Schedule the deletion of the PDF file after response
     background_tasks.add_task(delete_file, pdf_path)
 
     return FileResponse(
-        path=pdf_path, filename=f"{file.filename}_ocr.pdf", media_type="application/pdf"
+        path=pdf_path,
+        filename=f"{file.filename}_ocr.pdf",
+        media_type="application/pdf",
+        headers={"Server-Timing": trace.server_timing()},
     )
 
 
+@app.post(
+    "/start_searchable/",
+    summary="Starts Searchable PDF creation [ASYNC]",
+    description="Starts creating a searchable PDF from an image or PDF file and returns a task_id.",
+)
+async def start_searchable_pdf(
+    file: UploadFile = File(...),
+    lang: str = "eng",
+    dpi: int | None = None,
+    psm: int = 3,
+    config: str | None = None,
+    priority: int = 0,
+):
+    error = validate_params(lang, dpi, psm, config)
+    if error is not None:
+        return error
+
+    try:
+        await job_queue.check_admission()
+    except QueueFullError as e:
+        return JSONResponse(
+            content={"error": str(e)},
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    task_id = str(uuid.uuid4())
+    input_path = os.path.join(SPOOL_DIR, task_id)
+    with stage_timer("upload", lang, psm):
+        await spool_upload(file, input_path)
+
+    await create_job(
+        DB_PATH,
+        task_id,
+        str(file.filename),
+        start_datetime=datetime.now().isoformat(),
+        fields={
+            "kind": "searchable_pdf",
+            "lang": lang,
+            "dpi": dpi,
+            "psm_type": psm,
+            "config": config,
+            "priority": priority,
+            "input_path": input_path,
+        },
+    )
+
+    job_queue.notify()
+    return JSONResponse(content={"task_id": task_id})
+
+
 @app.get(
-    "/jobs", summary="Get Jobs", description="Retrieve all jobs or filter by status."
+    "/searchable/{task_id}",
+    summary="Get Searchable PDF",
+    description="Download the searchable PDF of a task_id, or its status while it is not finished.",
 )
-async def get_jobs(status: str = "pending"):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+async def get_searchable_pdf(task_id: str):
+    job_row = await get_job(
+        DB_PATH,
+        task_id,
+        ["kind", "file_name", "status", "output_path", "error_message"],
+    )
 
-    # Get job counts
-    cursor.execute(
-        "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'processing')"
+    if not job_row or job_row["kind"] != "searchable_pdf":
+        raise HTTPException(status_code=404, detail="task_id not found")
+
+    _, file_name, status, output_path, error_message = job_row
+    if status == "completed" and output_path and os.path.exists(output_path):
+        return FileResponse(
+            path=output_path,
+            filename=f"{file_name}_ocr.pdf",
+            media_type="application/pdf",
+        )
+
+    return JSONResponse(
+        content={
+            "status": status,
+            "file_name": file_name,
+            "error_message": error_message,
+        },
+        status_code=202 if status in ("pending", "processing") else 200,
     )
-    waiting_jobs_count = cursor.fetchone()[0]
 
-    cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'completed'")
-    completed_jobs_count = cursor.fetchone()[0]
 
-    cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'failed'")
-    failed_jobs_count = cursor.fetchone()[0]
+@app.get(
+    "/jobs",
+    summary="Get Jobs",
+    description="Retrieve jobs page by page, filtered by status and time range.",
+)
+async def get_jobs(
+    status: str = "pending",
+    sort: str = "start_datetime",
+    order: str = "desc",
+    since: str | None = None,
+    until: str | None = None,
+    cursor: str | None = None,
+    limit: int = 100,
+):
+    if status not in JOB_STATUS_FILTERS:
+        return JSONResponse(
+            content={
+                "error": f"Invalid status. Must be one of: {list(JOB_STATUS_FILTERS)}"
+            },
+            status_code=400,
+        )
 
-    if status == "all":
-        cursor.execute(
-            """SELECT uuid, file_name, start_datetime, status, psm_type, end_datetime, error_message
-                FROM jobs"""
+    if sort not in JOB_SORT_COLUMNS:
+        return JSONResponse(
+            content={"error": f"Invalid sort. Must be one of: {JOB_SORT_COLUMNS}"},
+            status_code=400,
         )
-    elif status == "failed":
-        cursor.execute(
-            """SELECT uuid, file_name, start_datetime, status, psm_type, end_datetime, error_message
-                FROM jobs WHERE status = 'failed'"""
+
+    if order not in ["asc", "desc"]:
+        return JSONResponse(
+            content={"error": "Invalid order. Must be one of: ['asc', 'desc']"},
+            status_code=400,
         )
-    elif status == "completed":
-        cursor.execute(
-            """SELECT uuid, file_name, start_datetime, status, psm_type, end_datetime, error_message
-                FROM jobs WHERE status = 'completed'"""
+
+    if not 0 < limit <= JOBS_MAX_LIMIT:
+        return JSONResponse(
+            content={"error": f"Limit must be between 1 and {JOBS_MAX_LIMIT}"},
+            status_code=400,
         )
-    else:
-        cursor.execute(
-            """SELECT uuid, file_name, start_datetime, status, psm_type, end_datetime, error_message
-                FROM jobs WHERE status IN ('pending', 'processing')"""
+
+    # Stored datetimes are ISO strings, so ranges compare as strings
+    try:
+        since = datetime.fromisoformat(since).isoformat() if since else None
+        until = datetime.fromisoformat(until).isoformat() if until else None
+    except ValueError:
+        return JSONResponse(
+            content={"error": "since and until must be ISO 8601 datetimes"},
+            status_code=400,
         )
 
-    jobs = cursor.fetchall()
-    conn.close()
+    after = None
+    if cursor is not None:
+        match = re.fullmatch(r"([^,]+),(\d+)", cursor)
+        if match is None:
+            return JSONResponse(content={"error": "Invalid cursor"}, status_code=400)
+        after = (match.group(1), int(match.group(2)))
+
+    # Counters are maintained by triggers, reading them does not scan the jobs
+    counts = await get_job_counts(DB_PATH)
+    jobs = await list_jobs(
+        DB_PATH,
+        JOB_STATUS_FILTERS[status],
+        sort,
+        order == "desc",
+        since,
+        until,
+        after,
+        limit + 1,
+    )
+
+    # One row more than requested tells if there is a next page
+    next_cursor = None
+    if len(jobs) > limit:
+        jobs = jobs[:limit]
+        next_cursor = f"{jobs[-1][sort]},{jobs[-1]['rowid']}"
 
     response = []
     for job in jobs:
         job_info = {
-            "id": job[0],
-            "file_name": job[1],
-            "start_datetime": job[2],
-            "end_datetime": job[5],
-            "status": job[3],
-            "psm_type": job[4],
-            "message": job[6],
+            "id": job["uuid"],
+            "file_name": job["file_name"],
+            "start_datetime": job["start_datetime"],
+            "end_datetime": job["end_datetime"],
+            "status": job["status"],
+            "psm_type": job["psm_type"],
+            "message": job["error_message"],
         }
         response.append(job_info)
 
     return JSONResponse(
         content={
-            "queue": waiting_jobs_count,
-            "completed": completed_jobs_count,
-            "failed": failed_jobs_count,
+            "queue": counts.get("pending", 0) + counts.get("processing", 0),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
             "jobs": response,
+            "next_cursor": next_cursor,
         }
     )
 
@@ -608,23 +1881,20 @@ async def get_jobs(status: str = "pending"):
     description="Retrieve system information.",
 )
 async def get_info():
-    # Get available Tesseract languages
-    available_languages = pytesseract.get_languages(config="")
+    # Get available Tesseract languages, cached after the first call
+    try:
+        available_languages = await asyncio.to_thread(tesseract_languages)
+    except Exception as e:
+        available_languages = f"Error retrieving Tesseract languages: {e}"
 
     # Get Python version
     python_version = platform.python_version()
 
     # Get Tesseract version
     try:
-        tesseract_version_output = subprocess.run(
-            ["tesseract", "--version"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-        tesseract_version = tesseract_version_output.stdout.splitlines()[0]
+        version = await asyncio.to_thread(tesseract_version)
     except Exception as e:
-        tesseract_version = f"Error retrieving Tesseract version: {e}"
+        version = f"Error retrieving Tesseract version: {e}"
 
     # Get operating system information
     os_info = platform.platform()
@@ -669,7 +1939,7 @@ async def get_info():
         content={
             "Installed Tesseract Languages": available_languages,
             "Python Version": python_version,
-            "Tesseract Version": tesseract_version,
+            "Tesseract Version": version,
             "OS Information": os_info,
             "System Architecture": architecture,
             #"CPU Information": cpu_info,
@@ -682,53 +1952,48 @@ async def get_info():
 
 
 @app.get(
-    "/health", summary="Health Check", description="Perform a system health check."
+    "/metrics",
+    summary="Prometheus Metrics",
+    description="Pipeline stage latencies, queue depth, worker utilization, throughput, cache and database metrics in the Prometheus text format.",
 )
-async def health_check():
-    try:
-        # Check Tesseract availability
-        result = subprocess.run(
-            ["tesseract", "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        if result.returncode != 0:
-            raise HTTPException(status_code=500, detail="Tesseract is not available")
-
-        # Check disk space
-        total, used, free = shutil.disk_usage("/")
-        if free < 1 * 1024 * 1024 * 1024:  # Less than 1GB free space
-            raise HTTPException(status_code=500, detail="Not enough disk space")
-
-        # Check if db file exists
-        if not os.path.exists(DB_PATH):
-            for root, dirs, files in os.walk("."):
-                if "ocr_results.db" in files:
-                    found_path = os.path.join(root, "ocr_results.db")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"""Health check failed:
-                                         Database file found at {found_path},
-                                         but not at the expected location. """,
-                    )
-            else:
-                raise FileNotFoundError("Database file not found")
+async def get_metrics():
+    # Set on scrape, one read of the job_counts table
+    QUEUE_DEPTH.set(await job_queue.depth())
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
 
-        # Easy DB connection check
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, detail=f"Could not connect to database: {e}"
-            )
 
-        # Check database connection and operations
-        check_db_operations(DB_PATH)
+@app.get(
+    "/health/live",
+    summary="Liveness Probe",
+    description="Answers as long as the API process is responsive, without running any checks.",
+)
+async def liveness_probe():
+    return JSONResponse(content={"status": "alive"})
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Health check failed: {e}")
+
+@app.get(
+    "/health/ready",
+    summary="Readiness Probe",
+    description="Result of the last background run of the Tesseract, disk, database and worker pool checks. 503 while any of them fails.",
+)
+async def readiness_probe():
+    return JSONResponse(
+        content=health_monitor.report(),
+        status_code=200 if health_monitor.ready() else 503,
+    )
+
+
+@app.get(
+    "/health", summary="Health Check", description="Perform a system health check."
+)
+async def health_check():
+    # Answered from the cached readiness checks, probes must stay cheap
+    if not health_monitor.ready():
+        failed = health_monitor.failed() or ["not checked yet"]
+        raise HTTPException(
+            status_code=500,
+            detail=f"Health check failed: {failed}",
+        )
 
     return JSONResponse(content={"status": "healthy"})
 
@@ -0,0 +1,125 @@
+import inspect
+import os
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app.tracing import current_trace
+
+# Seconds, from a fast Tesseract page up to a large document
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+STAGE_SECONDS = Histogram(
+    "ocr_stage_duration_seconds",
+    "Duration of the pipeline stages: upload, probe, rasterize, page (pool round "
+    "trip), resolution, the preprocessing steps, ocr, db_write and total",
+    ["stage", "lang", "psm"],
+    buckets=STAGE_BUCKETS,
+)
+DB_STATEMENT_SECONDS = Histogram(
+    "ocr_db_operation_duration_seconds",
+    "Duration of the SQLite operations of the API",
+    ["operation"],
+    buckets=DB_BUCKETS,
+)
+PAGES = Counter("ocr_pages_total", "Pages OCRed", ["lang", "psm"])
+JOBS = Counter("ocr_jobs_total", "Finished jobs", ["kind", "status"])
+UPLOAD_BYTES = Counter("ocr_upload_bytes_total", "Bytes of uploaded files")
+CACHE_LOOKUPS = Counter("ocr_cache_lookups_total", "Result cache lookups", ["result"])
+# How the gauges of several API processes are merged, see render_metrics
+QUEUE_DEPTH = Gauge(
+    "ocr_queue_depth", "Jobs waiting in the queue", multiprocess_mode="mostrecent"
+)
+QUEUE_ACTIVE = Gauge(
+    "ocr_queue_active_jobs", "Queued jobs being processed", multiprocess_mode="livesum"
+)
+POOL_WORKERS = Gauge(
+    "ocr_pool_workers", "Processes in the OCR worker pools", multiprocess_mode="livesum"
+)
+POOL_BUSY = Gauge(
+    "ocr_pool_busy_workers",
+    "Pool tasks submitted and not finished",
+    multiprocess_mode="livesum",
+)
+
+
+def render_metrics() -> bytes:
+    # With several API processes (see app/serve.py) every process writes its samples
+    # to PROMETHEUS_MULTIPROC_DIR and a scrape of any of them merges all of them
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest()
+    remove_dead_processes(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def remove_dead_processes(path: str) -> None:
+    # Workers replaced after a crash never get to remove their live gauges
+    for name in os.listdir(path):
+        match = re.fullmatch(r"gauge_live\w+_(\d+)\.db", name)
+        if match is None:
+            continue
+        pid = int(match.group(1))
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            multiprocess.mark_process_dead(pid, path)
+        except PermissionError:
+            pass
+
+
+def observe_stage(stage: str, lang: str, psm: int, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage, lang, str(psm)).observe(seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, lang: str, psm: int) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, lang, psm, time.perf_counter() - start)
+
+
+def observe_pages(pages: List[Dict[str, Any]], lang: str, psm: int) -> None:
+    # Workers run in other processes, their stage timings come back in page_info
+    PAGES.labels(lang, str(psm)).inc(len(pages))
+    for page in pages:
+        for stage, ms in page.get("timings_ms", {}).items():
+            STAGE_SECONDS.labels(stage, lang, str(psm)).observe(ms / 1000)
+
+
+def timed_db(func: Callable) -> Callable:
+    histogram = DB_STATEMENT_SECONDS.labels(func.__name__)
+
+    if inspect.iscoroutinefunction(func):
+        # Includes the wait for the writer thread
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with histogram.time():
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return func(*args, **kwargs)
+
+    return wrapper
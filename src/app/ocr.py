@@ -0,0 +1,251 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import pytesseract
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+from pypdf import PdfWriter
+
+from app.engine import TSV_COLUMNS, build_config, get_engine
+from app.preprocess import image_dpi, preprocess_image
+from app.regions import offset_rows, region_box
+from app.resolution import (
+    OCR_DPI_POLICY,
+    PROBE_DPI,
+    choose_dpi,
+    choose_scale,
+    downscale,
+    restore_scale,
+)
+
+# Resolution PDF pages are rendered at when no dpi is requested and
+# OCR_DPI_POLICY is "fixed"
+PDF_RASTER_DPI = 200
+
+
+def create_pool(max_workers: int) -> ProcessPoolExecutor:
+    # "spawn" keeps the workers free of the event loop / sqlite state of the parent
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def count_pages(pdf_path: str) -> int:
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def rasterize_pages(
+    pdf_path: str, first_page: int, last_page: int, dpi: int, output_folder: str
+) -> List[str]:
+    # Render a window of pages to disk, the images are only loaded by the OCR workers
+    kwargs: Dict[str, Any] = {
+        "first_page": first_page,
+        "last_page": last_page,
+        "output_folder": output_folder,
+        "paths_only": True,
+        "fmt": "ppm",
+        "dpi": dpi,
+    }
+    return convert_from_path(pdf_path, **kwargs)
+
+
+def page_resolutions(
+    pdf_path: str, first_page: int, last_page: int, dpi: int | None
+) -> List[int]:
+    # Render resolution of every page, measured on a low resolution rendering
+    if dpi or OCR_DPI_POLICY != "auto":
+        return [dpi or PDF_RASTER_DPI] * (last_page - first_page + 1)
+    probes = convert_from_path(
+        pdf_path,
+        dpi=PROBE_DPI,
+        first_page=first_page,
+        last_page=last_page,
+        grayscale=True,
+    )
+    return [choose_dpi(probe, PROBE_DPI) for probe in probes]
+
+
+def load_page(source: str, rasterized: bool) -> Image.Image:
+    # Pages are read from disk: the spooled upload of an image or a rasterized PDF page
+    try:
+        return Image.open(source).convert("RGB")
+    finally:
+        # Rasterized pages are released as soon as they are in memory
+        if rasterized:
+            os.remove(source)
+
+
+def ocr_page(
+    source: str,
+    page_num: int,
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+    preprocess: List[str] | None = None,
+    rasterized: bool = False,
+    render_dpi: int | None = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # Runs inside a pool worker: OCR a single page of a document
+    image = load_page(source, rasterized)
+    width, height = image.size
+    page_info: Dict[str, Any] = {"page_num": page_num, "width": width, "height": height}
+
+    data, info = recognize(
+        image,
+        dpi or render_dpi or image_dpi(image),
+        lang,
+        psm,
+        config,
+        preprocess,
+        auto_scale=not rasterized and dpi is None and OCR_DPI_POLICY == "auto",
+    )
+    page_info.update(info)
+    return {"data": data, "page_num": page_num}, page_info
+
+
+def ocr_regions(
+    source: str,
+    page_num: int,
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+    preprocess: List[str] | None,
+    regions: List[Dict[str, Any]],
+    rasterized: bool = False,
+    render_dpi: int | None = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    # Runs inside a pool worker: OCR only the crops of the given regions of a page,
+    # see app/regions.py for how the results of all regions are merged
+    image = load_page(source, rasterized)
+    width, height = image.size
+    ocr_dpi = dpi or render_dpi or image_dpi(image)
+    page_info: Dict[str, Any] = {
+        "page_num": page_num,
+        "width": width,
+        "height": height,
+        "dpi": ocr_dpi,
+        "ocr_pixels": 0,
+        "timings_ms": {},
+    }
+
+    results = []
+    for region in regions:
+        left, top, right, bottom = region_box(region, width, height)
+        result: Dict[str, Any] = {
+            "index": region["index"],
+            "name": region["name"],
+            "left": left,
+            "top": top,
+            "width": max(0, right - left),
+            "height": max(0, bottom - top),
+        }
+        data: Dict[str, List[Any]] = {column: [] for column in TSV_COLUMNS}
+        if result["width"] and result["height"]:
+            data, info = recognize(
+                image.crop((left, top, right, bottom)),
+                ocr_dpi,
+                lang,
+                region["psm"] or psm,
+                region["config"] or config,
+                preprocess,
+                auto_scale=False,
+            )
+            data = offset_rows(data, left, top)
+            page_info["ocr_pixels"] += info["ocr_pixels"]
+            for stage, ms in info["timings_ms"].items():
+                timings = page_info["timings_ms"]
+                timings[stage] = round(timings.get(stage, 0) + ms, 2)
+            if "skew_angle" in info:
+                result["skew_angle"] = info["skew_angle"]
+        result["data"] = data
+        results.append(result)
+    return results, page_info
+
+
+def recognize(
+    image: Image.Image,
+    ocr_dpi: int | None,
+    lang: str,
+    psm: int,
+    config: str | None,
+    preprocess: List[str] | None,
+    auto_scale: bool,
+) -> Tuple[Dict[str, List[Any]], Dict[str, Any]]:
+    # Resolution, preprocessing and Tesseract for one image, boxes in its coordinates
+    info: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+
+    ocr_image = image
+    scale = 1.0
+    if auto_scale:
+        # Oversized photos and scans are shrunk to the resolution their text needs
+        start = time.perf_counter()
+        scale, ocr_dpi = choose_scale(image, ocr_dpi)
+        if scale < 1:
+            ocr_image = downscale(image, scale)
+        timings["resolution"] = round((time.perf_counter() - start) * 1000, 2)
+
+    page = None
+    if preprocess:
+        page = preprocess_image(ocr_image, preprocess, ocr_dpi)
+        ocr_image, ocr_dpi = page.image, page.dpi
+        timings.update(page.timings)
+        info["skew_angle"] = page.angle
+    info["dpi"] = ocr_dpi
+    # Size of the image Tesseract works on, after any downscaling / preprocessing
+    info["ocr_pixels"] = ocr_image.size[0] * ocr_image.size[1]
+
+    # Perform OCR on the image
+    start = time.perf_counter()
+    data = get_engine().image_to_data(ocr_image, lang, ocr_dpi, psm, config)
+    timings["ocr"] = round((time.perf_counter() - start) * 1000, 2)
+    info["timings_ms"] = timings
+
+    # Boxes are reported in the coordinates of the original image
+    if page is not None:
+        page.restore_boxes(data)
+    if scale < 1:
+        restore_scale(data, scale)
+    return data, info
+
+
+def searchable_page(
+    source: str,
+    page_num: int,
+    lang: str,
+    dpi: int | None,
+    psm: int,
+    config: str | None,
+    pages_dir: str,
+    rasterized: bool = False,
+    render_dpi: int | None = None,
+) -> str:
+    # Runs inside a pool worker: one page of a searchable PDF, written to pages_dir
+    # so the page images do not travel back to the API process
+    image = load_page(source, rasterized)
+
+    # The resolution also decides the page size of the PDF
+    pdf = pytesseract.image_to_pdf_or_hocr(
+        image,
+        config=build_config(lang, dpi or render_dpi, psm, config),
+        extension="pdf",
+    )
+    path = os.path.join(pages_dir, f"{page_num}.pdf")
+    with open(path, "wb") as f:
+        f.write(pdf)
+    return path
+
+
+def merge_pdfs(pages: List[str], output_path: str) -> None:
+    # Page PDFs of searchable_page in page order, each is deleted once appended
+    writer = PdfWriter()
+    for path in pages:
+        writer.append(path)
+        os.remove(path)
+    with open(output_path, "wb") as f:
+        writer.write(f)
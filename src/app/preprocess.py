@@ -0,0 +1,232 @@
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Steps are always applied in this order, whatever order they are requested in
+PREPROCESS_STEPS = ["grayscale", "resample", "binarize", "deskew", "crop"]
+# Effective resolution pages are resampled to, Tesseract works best around 300 DPI
+PREPROCESS_TARGET_DPI = int(os.getenv("PREPROCESS_TARGET_DPI", 300))
+# Resampling factors are clamped, so a wrong resolution cannot blow up a page
+MIN_SCALE = 0.25
+MAX_SCALE = 2.0
+# Image metadata below this resolution is a screen default (72/96), not a scan
+MIN_METADATA_DPI = 100
+# Sauvola binarization
+SAUVOLA_K = 0.2
+SAUVOLA_R = 128.0
+# Rows converted / binarized at a time, only a band of the page is held in wide types
+BAND_ROWS = 128
+# Deskew searches +-MAX_SKEW degrees and uses at most DESKEW_SAMPLES ink pixels
+MAX_SKEW = 5.0
+SKEW_STEP = 0.25
+DESKEW_SAMPLES = 200_000
+# Rows / columns with more ink than this are scanner or photo borders
+BORDER_DENSITY = 0.5
+CROP_MARGIN = 10
+# ITU-R BT.601 luma weights in 1/256
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.uint32)
+
+
+def parse_steps(value: str | None) -> List[str]:
+    # "all" selects the whole pipeline, otherwise a comma separated list of steps
+    if not value:
+        return []
+    if value == "all":
+        return list(PREPROCESS_STEPS)
+    steps = [step.strip() for step in value.split(",") if step.strip()]
+    unknown = [step for step in steps if step not in PREPROCESS_STEPS]
+    if unknown:
+        raise ValueError(
+            f"Unknown preprocessing steps: {unknown}. "
+            f"Must be 'all' or any of: {PREPROCESS_STEPS}"
+        )
+    return [step for step in PREPROCESS_STEPS if step in steps]
+
+
+def image_dpi(image: Image.Image) -> int | None:
+    dpi = image.info.get("dpi")
+    if not dpi or dpi[0] < MIN_METADATA_DPI:
+        return None
+    return int(round(dpi[0]))
+
+
+def to_grayscale(image: Image.Image) -> np.ndarray:
+    if image.mode == "L":
+        return np.asarray(image)
+    pixels = np.asarray(image.convert("RGB"))
+    gray = np.empty(pixels.shape[:2], dtype=np.uint8)
+    for start in range(0, len(gray), BAND_ROWS):
+        end = start + BAND_ROWS
+        gray[start:end] = (pixels[start:end] @ LUMA_WEIGHTS) >> 8
+    return gray
+
+
+def resample(gray: np.ndarray, scale: float) -> np.ndarray:
+    height, width = gray.shape
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # BOX averages all source pixels when shrinking, LANCZOS keeps edges when enlarging
+    method = Image.Resampling.BOX if scale < 1 else Image.Resampling.LANCZOS
+    return np.asarray(Image.fromarray(gray).resize(size, method))
+
+
+def window_sums(padded: np.ndarray, window: int) -> np.ndarray:
+    # Sum over every window x window neighbourhood of padded from an integral image,
+    # padded has window // 2 extra rows / columns on every side
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    integral[1:, 1:] = padded.cumsum(axis=0).cumsum(axis=1)
+    return (
+        integral[window:, window:]
+        - integral[:-window, window:]
+        - integral[window:, :-window]
+        + integral[:-window, :-window]
+    )
+
+
+def binarize(gray: np.ndarray, dpi: int | None) -> np.ndarray:
+    # Sauvola thresholding: local mean and deviation decide per pixel, so uneven
+    # lighting of photos does not swallow text the way a global threshold does.
+    # Computed band by band: the float64 arrays of a whole A4 page at 600 DPI would
+    # take about 2 GB, a band of BAND_ROWS rows takes about 60 MB.
+    window = max(15, (dpi or PREPROCESS_TARGET_DPI) // 10) | 1
+    pad = window // 2
+    area = window * window
+    padded = np.pad(gray, pad, mode="edge")
+    binary = np.empty_like(gray)
+    for start in range(0, gray.shape[0], BAND_ROWS):
+        end = min(start + BAND_ROWS, gray.shape[0])
+        stop = end + 2 * pad
+        band = padded[start:stop].astype(np.float64)
+        mean = window_sums(band, window) / area
+        variance = window_sums(band * band, window) / area - mean * mean
+        deviation = np.sqrt(np.maximum(variance, 0))
+        threshold = mean * (1 + SAUVOLA_K * (deviation / SAUVOLA_R - 1))
+        binary[start:end] = np.where(gray[start:end] > threshold, 255, 0)
+    return binary
+
+
+def find_skew(binary: np.ndarray) -> float:
+    # Projection profiles: text lines give the sharpest row histogram when level.
+    # Returns the counter clockwise rotation that levels the page.
+    ys, xs = np.nonzero(binary == 0)
+    if len(ys) == 0:
+        return 0.0
+    step = max(1, len(ys) // DESKEW_SAMPLES)
+    ys = ys[::step].astype(np.float64)
+    xs = xs[::step].astype(np.float64)
+
+    angles = np.arange(-MAX_SKEW, MAX_SKEW + SKEW_STEP / 2, SKEW_STEP)
+    radians = np.deg2rad(angles)
+    rows = np.rint(
+        np.outer(np.cos(radians), ys) + np.outer(np.sin(radians), xs)
+    ).astype(np.int64)
+    rows -= rows.min(axis=1, keepdims=True)
+    scores = [np.sum(np.bincount(row).astype(np.float64) ** 2) for row in rows]
+    return -float(angles[int(np.argmax(scores))])
+
+
+def deskew(binary: np.ndarray) -> Tuple[np.ndarray, float]:
+    angle = find_skew(binary)
+    if not angle:
+        return binary, 0.0
+    image = Image.fromarray(binary).rotate(
+        angle, resample=Image.Resampling.NEAREST, fillcolor=255
+    )
+    return np.asarray(image), angle
+
+
+def content_bounds(binary: np.ndarray) -> tuple:
+    # Bounding box of the ink, ignoring empty and solid border rows / columns
+    ink = binary == 0
+    rows = ink.mean(axis=1)
+    columns = ink.mean(axis=0)
+    row_idx = np.flatnonzero((rows > 0) & (rows < BORDER_DENSITY))
+    column_idx = np.flatnonzero((columns > 0) & (columns < BORDER_DENSITY))
+    height, width = binary.shape
+    if len(row_idx) == 0 or len(column_idx) == 0:
+        return 0, 0, width, height
+    left = max(0, int(column_idx[0]) - CROP_MARGIN)
+    top = max(0, int(row_idx[0]) - CROP_MARGIN)
+    right = min(width, int(column_idx[-1]) + CROP_MARGIN + 1)
+    bottom = min(height, int(row_idx[-1]) + CROP_MARGIN + 1)
+    return left, top, right, bottom
+
+
+class PreprocessedPage:
+    # The preprocessed image plus what is needed to map boxes back to the original
+
+    def __init__(self, image: Image.Image, dpi: int | None):
+        self.image = image
+        self.dpi = dpi
+        self.scale = 1.0
+        self.angle = 0.0
+        self.center = (0.0, 0.0)
+        self.offset = (0, 0)
+        self.timings: Dict[str, float] = {}
+
+    def restore_boxes(self, data: Dict[str, List[Any]]) -> None:
+        # Undo crop, rotation and scaling on the box centres of image_to_data output
+        if not data["left"]:
+            return
+        left = np.asarray(data["left"], dtype=np.float64)
+        top = np.asarray(data["top"], dtype=np.float64)
+        width = np.asarray(data["width"], dtype=np.float64)
+        height = np.asarray(data["height"], dtype=np.float64)
+
+        x = left + width / 2 + self.offset[0] - self.center[0]
+        y = top + height / 2 + self.offset[1] - self.center[1]
+        if self.angle:
+            # PIL rotates counter clockwise on screen, rotate the centres back
+            radians = np.deg2rad(self.angle)
+            cos, sin = np.cos(radians), np.sin(radians)
+            x, y = x * cos - y * sin, x * sin + y * cos
+        x = (x + self.center[0]) / self.scale
+        y = (y + self.center[1]) / self.scale
+        width /= self.scale
+        height /= self.scale
+
+        data["left"] = np.maximum(np.rint(x - width / 2), 0).astype(int).tolist()
+        data["top"] = np.maximum(np.rint(y - height / 2), 0).astype(int).tolist()
+        data["width"] = np.rint(width).astype(int).tolist()
+        data["height"] = np.rint(height).astype(int).tolist()
+
+
+def preprocess_image(
+    image: Image.Image, steps: List[str], dpi: int | None
+) -> PreprocessedPage:
+    # dpi is the resolution of the source image, None if it is not known
+    page = PreprocessedPage(image, dpi)
+
+    def timed(name: str, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        page.timings[name] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    # Every other step works on the grayscale array
+    pixels = timed("grayscale", to_grayscale, image)
+
+    if "resample" in steps and dpi:
+        scale = min(MAX_SCALE, max(MIN_SCALE, PREPROCESS_TARGET_DPI / dpi))
+        if abs(scale - 1) > 0.05:
+            pixels = timed("resample", resample, pixels, scale)
+            page.scale = scale
+            page.dpi = round(dpi * scale)
+
+    if "binarize" in steps or "deskew" in steps or "crop" in steps:
+        pixels = timed("binarize", binarize, pixels, page.dpi)
+
+    if "deskew" in steps:
+        height, width = pixels.shape
+        pixels, page.angle = timed("deskew", deskew, pixels)
+        page.center = (width / 2, height / 2)
+
+    if "crop" in steps:
+        left, top, right, bottom = timed("crop", content_bounds, pixels)
+        pixels = pixels[top:bottom, left:right]
+        page.offset = (left, top)
+
+    page.image = Image.fromarray(np.ascontiguousarray(pixels))
+    return page
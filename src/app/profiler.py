@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+# Sampling interval of the debug profiler
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+
+
+class SamplingProfiler:
+    # Samples the stacks of the threads of this process from a background thread.
+    # Stacks are counted in the collapsed format of flamegraph.pl / speedscope.
+
+    def __init__(
+        self,
+        thread_ids: Iterable[int] | None = None,
+        prefix: str = "",
+        interval_ms: float = PROFILE_INTERVAL_MS,
+    ):
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.prefix = prefix
+        self.interval = interval_ms / 1000
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        self._thread.join()
+        return dict(self.counts)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(self.prefix or names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+
+
+def collapse(counts: Dict[str, int]) -> str:
+    lines = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return "".join(f"{stack} {count}\n" for stack, count in lines)
+
+
+def run_profiled(
+    func: Callable[..., Any], prefix: str, *args: Any, **kwargs: Any
+) -> Tuple[Any, Dict[str, int]]:
+    # Runs inside a pool worker: func plus the stacks sampled while it ran
+    profiler = SamplingProfiler([threading.get_ident()], prefix).start()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        counts = profiler.stop()
+    return result, counts
@@ -0,0 +1,201 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+from app.engine import TSV_COLUMNS
+
+# More regions than this are better served by OCRing the whole page
+MAX_REGIONS = 200
+REGION_UNITS = ["px", "relative"]
+REGION_PSM_VALUES = [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13]
+REGION_KEYS = {
+    "page",
+    "name",
+    "left",
+    "top",
+    "width",
+    "height",
+    "unit",
+    "psm",
+    "config",
+    "whitelist",
+}
+# Characters that would break the tesseract command line of a whitelist
+WHITELIST_FORBIDDEN = "\"'\\"
+
+
+def parse_regions(value: str | None) -> List[Dict[str, Any]] | None:
+    # JSON list of {"left", "top", "width", "height"} boxes, in pixels of the page
+    # image or, with "unit": "relative", as fractions of the page size. Optional are
+    # "page" (every page when missing), "name", "psm", "config" and "whitelist".
+    if not value:
+        return None
+    try:
+        items = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Regions must be a JSON list: {e}")
+    if not isinstance(items, list) or not items:
+        raise ValueError("Regions must be a non-empty JSON list")
+    if len(items) > MAX_REGIONS:
+        raise ValueError(f"At most {MAX_REGIONS} regions are supported")
+    return [parse_region(index, item) for index, item in enumerate(items)]
+
+
+def parse_region(index: int, item: Any) -> Dict[str, Any]:
+    if not isinstance(item, dict):
+        raise ValueError(f"Region {index} must be a JSON object")
+    unknown = sorted(set(item) - REGION_KEYS)
+    if unknown:
+        raise ValueError(
+            f"Region {index} has unknown keys {unknown}. "
+            f"Must be any of: {sorted(REGION_KEYS)}"
+        )
+
+    unit = item.get("unit", "px")
+    if unit not in REGION_UNITS:
+        raise ValueError(f"Region {index}: unit must be one of: {REGION_UNITS}")
+    box = {}
+    for key in ("left", "top", "width", "height"):
+        number = item.get(key)
+        if isinstance(number, bool) or not isinstance(number, (int, float)):
+            raise ValueError(f"Region {index}: {key} must be a number")
+        if number < 0:
+            raise ValueError(f"Region {index}: {key} must not be negative")
+        box[key] = number
+    if box["width"] == 0 or box["height"] == 0:
+        raise ValueError(f"Region {index}: width and height must be more than 0")
+    # The tolerance accepts e.g. 0.7 + 0.3, which is just above 1 as a float
+    if unit == "relative" and (
+        box["left"] + box["width"] > 1 + 1e-9 or box["top"] + box["height"] > 1 + 1e-9
+    ):
+        raise ValueError(f"Region {index}: relative regions must lie within 0..1")
+
+    page = item.get("page")
+    if page is not None and (
+        isinstance(page, bool) or not isinstance(page, int) or page < 1
+    ):
+        raise ValueError(f"Region {index}: page must be a page number from 1")
+    name = item.get("name")
+    if name is not None and not isinstance(name, str):
+        raise ValueError(f"Region {index}: name must be a string")
+    psm = item.get("psm")
+    if psm is not None and psm not in REGION_PSM_VALUES:
+        raise ValueError(f"Region {index}: psm must be one of: {REGION_PSM_VALUES}")
+    config = item.get("config")
+    if config is not None and (
+        not isinstance(config, str) or not config.startswith("--")
+    ):
+        raise ValueError(f"Region {index}: config must start with '--'")
+    whitelist = item.get("whitelist")
+    if whitelist is not None:
+        if (
+            not isinstance(whitelist, str)
+            or not whitelist
+            or any(c.isspace() or c in WHITELIST_FORBIDDEN for c in whitelist)
+        ):
+            raise ValueError(
+                f"Region {index}: whitelist must be a string of characters without "
+                "whitespace and quotes"
+            )
+        config = f"{config or ''} -c tessedit_char_whitelist={whitelist}".strip()
+
+    return {
+        "index": index,
+        "name": name,
+        "page": page,
+        "unit": unit,
+        **box,
+        "psm": psm,
+        "config": config,
+    }
+
+
+def split_regions(
+    regions: List[Dict[str, Any]], max_parts: int, page_num: int
+) -> List[Tuple[List[Dict[str, Any]]]]:
+    # Regions of a page, dealt out to at most max_parts pool tasks
+    page_regions = [region for region in regions if region["page"] in (None, page_num)]
+    parts = min(len(page_regions), max(1, max_parts))
+    return [(page_regions[part::parts],) for part in range(parts)]
+
+
+def region_box(
+    region: Dict[str, Any], width: int, height: int
+) -> Tuple[int, int, int, int]:
+    # (left, top, right, bottom) in pixels of the page, clipped to the page
+    left, top = region["left"], region["top"]
+    right, bottom = left + region["width"], top + region["height"]
+    if region["unit"] == "relative":
+        left, right = left * width, right * width
+        top, bottom = top * height, bottom * height
+    return (
+        min(width, max(0, round(left))),
+        min(height, max(0, round(top))),
+        min(width, round(right)),
+        min(height, round(bottom)),
+    )
+
+
+def offset_rows(
+    data: Dict[str, List[Any]], left: int, top: int
+) -> Dict[str, List[Any]]:
+    # Rows of a crop in page coordinates, without the page row of the crop
+    keep = [i for i, level in enumerate(data["level"]) if level != 1]
+    rows = {column: [data[column][i] for i in keep] for column in TSV_COLUMNS}
+    rows["left"] = [value + left for value in rows["left"]]
+    rows["top"] = [value + top for value in rows["top"]]
+    return rows
+
+
+def region_text(data: Dict[str, List[Any]]) -> Tuple[str, float | None]:
+    # Words of a region joined into lines, and their mean confidence
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confs = []
+    for i, level in enumerate(data["level"]):
+        word = str(data["text"][i]).strip()
+        if level != 5 or not word:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        if float(data["conf"][i]) >= 0:
+            confs.append(float(data["conf"][i]))
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, round(sum(confs) / len(confs), 2) if confs else None
+
+
+def merge_regions(
+    parts: List[Tuple[List[Dict[str, Any]], Dict[str, Any]]]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # Results of the pool tasks of one page as one page: a page row, then the rows
+    # of the regions in request order with block numbers unique within the page
+    results = sorted(
+        (result for part_results, _ in parts for result in part_results),
+        key=lambda result: result["index"],
+    )
+    page_info = dict(parts[0][1])
+    timings: Dict[str, float] = {}
+    for _, info in parts:
+        for stage, ms in info["timings_ms"].items():
+            timings[stage] = round(timings.get(stage, 0) + ms, 2)
+    page_info["timings_ms"] = timings
+    page_info["ocr_pixels"] = sum(info["ocr_pixels"] for _, info in parts)
+
+    page_num = page_info["page_num"]
+    page_row = [1, page_num, 0, 0, 0, 0, 0, 0]
+    page_row += [page_info["width"], page_info["height"], -1, ""]
+    data: Dict[str, List[Any]] = {
+        column: [value] for column, value in zip(TSV_COLUMNS, page_row)
+    }
+    block_offset = 0
+    summaries = []
+    for result in results:
+        rows = result.pop("data")
+        for column in TSV_COLUMNS:
+            values = rows[column]
+            if column == "block_num":
+                values = [block + block_offset for block in values]
+            data[column].extend(values)
+        block_offset += max(rows["block_num"], default=0)
+        result["text"], result["conf"] = region_text(rows)
+        summaries.append(result)
+    page_info["regions"] = summaries
+    return {"data": data, "page_num": page_num}, page_info
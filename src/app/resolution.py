@@ -0,0 +1,126 @@
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# "auto" picks the resolution of every page from its text size when no dpi is
+# requested, "fixed" renders PDFs at PDF_RASTER_DPI and OCRs images as uploaded
+OCR_DPI_POLICY = os.getenv("OCR_DPI_POLICY", "auto")
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", 150))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", 400))
+# Hard cap on the pixels of a page, whatever its text size
+OCR_MAX_PAGE_PIXELS = int(float(os.getenv("OCR_MAX_PAGE_MEGAPIXELS", 25)) * 1_000_000)
+# Resolution of pages without detectable text lines
+FALLBACK_DPI = 300
+# Text size is measured on a cheap low resolution copy of the page
+PROBE_DPI = 72
+PROBE_MAX_SIDE = 1600
+# Measured line height Tesseract recognizes reliably: 12 pt body text at 300 DPI
+# measures about 37 px with text_line_height(), plus headroom for skewed pages
+TARGET_LINE_PX = 42
+DPI_STEP = 50
+# Images without a resolution are assumed to show 12 pt body text, which
+# measures about 9 pt with text_line_height()
+BODY_LINE_PT = 9
+# Line heights are measured per vertical strip, so slightly skewed photos still
+# give separate lines, and the smaller lines of a page decide
+LINE_STRIPS = 12
+LINE_PERCENTILE = 25
+MIN_LINES = 3
+MIN_SCALE = 0.25
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)
+    total = weight[-1]
+    cumulative_mean = np.cumsum(histogram * levels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (cumulative_mean[-1] * weight - cumulative_mean * total) ** 2 / (
+            weight * (total - weight)
+        )
+    return int(np.nanargmax(variance))
+
+
+def text_line_height(gray: np.ndarray) -> float | None:
+    # Height of the text bands in the row profiles of the page, None without text
+    if gray.min() == gray.max():
+        # A page of a single shade has no threshold to split ink from paper
+        return None
+    ink = gray <= otsu_threshold(gray)
+    heights: List[np.ndarray] = []
+    for strip in np.array_split(ink, LINE_STRIPS, axis=1):
+        rows = strip.any(axis=1).astype(np.int8)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], rows, [0]))))
+        bands = edges[1::2] - edges[0::2]
+        # Single pixel bands are noise at probe resolution
+        heights.append(bands[bands > 2])
+    all_heights = np.concatenate(heights)
+    if len(all_heights) < MIN_LINES:
+        return None
+    return float(np.percentile(all_heights, LINE_PERCENTILE))
+
+
+def to_probe(image: Image.Image) -> Tuple[np.ndarray, int]:
+    # Grayscale copy with at most PROBE_MAX_SIDE pixels per side and its reduction
+    factor = max(1, math.ceil(max(image.size) / PROBE_MAX_SIDE))
+    probe = image.convert("L")
+    if factor > 1:
+        probe = probe.reduce(factor)
+    return np.asarray(probe), factor
+
+
+def choose_dpi(probe: Image.Image, probe_dpi: int) -> int:
+    # Render resolution of a PDF page from a rendering at probe_dpi
+    width_in = probe.size[0] / probe_dpi
+    height_in = probe.size[1] / probe_dpi
+    gray, factor = to_probe(probe)
+    line_height = text_line_height(gray)
+
+    if line_height is None:
+        dpi = FALLBACK_DPI
+    else:
+        dpi = probe_dpi * TARGET_LINE_PX / (line_height * factor)
+        dpi = math.ceil(dpi / DPI_STEP) * DPI_STEP
+        dpi = min(OCR_MAX_DPI, max(OCR_MIN_DPI, dpi))
+
+    max_dpi = int(math.sqrt(OCR_MAX_PAGE_PIXELS / (width_in * height_in)))
+    return max(1, min(dpi, max_dpi))
+
+
+def choose_scale(
+    image: Image.Image, source_dpi: int | None
+) -> Tuple[float, int | None]:
+    # Downscale factor of an uploaded image and the resolution it is OCRed at
+    gray, factor = to_probe(image)
+    line_height = text_line_height(gray)
+    if line_height is not None:
+        line_height *= factor
+
+    scale = 1.0
+    if line_height is not None:
+        scale = min(1.0, TARGET_LINE_PX / line_height)
+    width, height = image.size
+    scale = min(scale, math.sqrt(OCR_MAX_PAGE_PIXELS / (width * height)))
+    scale = max(MIN_SCALE, scale)
+
+    if source_dpi is None and line_height is not None:
+        source_dpi = round(line_height * 72 / BODY_LINE_PT)
+    if source_dpi is None:
+        return scale, None
+    return scale, round(source_dpi * scale)
+
+
+def downscale(image: Image.Image, scale: float) -> Image.Image:
+    size = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+    return image.resize(size, Image.Resampling.BOX)
+
+
+def restore_scale(data: Dict[str, List[Any]], scale: float) -> None:
+    # Map image_to_data boxes of a downscaled page back to the uploaded image
+    for key in ("left", "top", "width", "height"):
+        values = np.asarray(data[key], dtype=np.float64) / scale
+        data[key] = np.rint(values).astype(int).tolist()
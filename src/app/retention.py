@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from typing import Callable, List
+
+from app.database import (
+    checkpoint_wal,
+    database_size,
+    delete_jobs,
+    find_purgeable_jobs,
+    incremental_vacuum,
+    retention_cutoff,
+)
+
+# Finished jobs are purged after JOB_RETENTION_DAYS, beyond the newest
+# JOB_RETENTION_MAX_JOBS and while the data exceeds DB_MAX_SIZE_MB (0 = no limit)
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 30))
+JOB_RETENTION_MAX_JOBS = int(os.getenv("JOB_RETENTION_MAX_JOBS", 0))
+DB_MAX_SIZE_BYTES = int(float(os.getenv("DB_MAX_SIZE_MB", 0)) * 1024 * 1024)
+# Seconds between two purge runs
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 600))
+# Jobs deleted per transaction, writers of the API only ever wait for one batch
+PURGE_BATCH_JOBS = int(os.getenv("PURGE_BATCH_JOBS", 50))
+PURGE_BATCH_PAUSE = 0.05
+# Free pages returned to the file system per incremental_vacuum step
+VACUUM_STEP_PAGES = 1000
+
+
+class RetentionPurger:
+    # Deletes expired jobs in the background, then compacts the database
+
+    def __init__(
+        self,
+        db_path: str,
+        remove_job_files: Callable[[sqlite3.Row], None],
+        logger: logging.Logger,
+        interval: float = RETENTION_INTERVAL,
+    ):
+        self.db_path = db_path
+        self.remove_job_files = remove_job_files
+        self.logger = logger
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def purge(self) -> int:
+        deleted = 0
+        cutoff = await asyncio.to_thread(
+            retention_cutoff,
+            self.db_path,
+            JOB_RETENTION_DAYS * 24 * 60 * 60,
+            JOB_RETENTION_MAX_JOBS,
+        )
+        if cutoff is not None:
+            while batch := await self._delete_batch(cutoff):
+                deleted += batch
+
+        if DB_MAX_SIZE_BYTES > 0:
+            # Oldest jobs first, until the pages in use fit into the limit
+            while await self._used_bytes() > DB_MAX_SIZE_BYTES:
+                batch = await self._delete_batch(None)
+                if not batch:
+                    break
+                deleted += batch
+
+        await self.compact()
+        if deleted:
+            self.logger.info(f"Retention purged {deleted} jobs")
+        return deleted
+
+    async def compact(self) -> None:
+        # Small vacuum steps, each holds the write lock only briefly. Stops when a
+        # step frees nothing, e.g. while auto_vacuum is not incremental.
+        free_pages = None
+        while True:
+            left = await incremental_vacuum(self.db_path, VACUUM_STEP_PAGES)
+            if left == 0 or left == free_pages:
+                break
+            free_pages = left
+            await asyncio.sleep(PURGE_BATCH_PAUSE)
+        await asyncio.to_thread(checkpoint_wal, self.db_path)
+
+    async def _used_bytes(self) -> int:
+        used, _ = await asyncio.to_thread(database_size, self.db_path)
+        return used
+
+    async def _delete_batch(self, cutoff: str | None) -> int:
+        task_ids: List[str] = await asyncio.to_thread(
+            find_purgeable_jobs, self.db_path, cutoff, PURGE_BATCH_JOBS
+        )
+        if not task_ids:
+            return 0
+        deleted = await delete_jobs(self.db_path, task_ids)
+        for job in deleted:
+            self.remove_job_files(job)
+        await asyncio.sleep(PURGE_BATCH_PAUSE)
+        return len(deleted)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.purge()
+            except Exception as e:
+                self.logger.error(f"Retention purge failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,37 @@
+import os
+import shutil
+
+import uvicorn
+
+# Production entry point: python -m app.serve
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+# API processes, they share the jobs table, so any of them answers for any job
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+# Samples of all API processes are merged from here on scrape
+METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "/tmp/ocr-metrics")
+# Seconds in-flight requests get to finish on shutdown
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", 30))
+
+
+def main() -> None:
+    if WEB_CONCURRENCY > 1:
+        # Counters of a previous run would be added to the new ones
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+        os.makedirs(METRICS_DIR)
+        # Inherited by the worker processes before they import prometheus_client
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = METRICS_DIR
+
+    # Workers that die are replaced by uvicorn, their leased jobs are re-queued by
+    # the other workers
+    uvicorn.run(
+        "app.main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import json
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, List
+
+# Trace of the job handled by the current request / queue worker task. Tasks
+# created while handling it (e.g. the page tasks) see the same trace.
+current_trace: ContextVar["JobTrace | None"] = ContextVar("current_trace", default=None)
+
+
+class JobTrace:
+    # Where the time of one job went, stored with the job as compact JSON
+
+    def __init__(self):
+        self.queue_wait_ms: float | None = None
+        self.stages_ms: Dict[str, float] = {}
+        self.worker_ms: Dict[str, float] = {}
+        self.pages: Dict[str, List[Any]] = {}
+        # Collapsed stacks of a profiled (debug) job, None when not profiling
+        self.profile: Counter | None = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages_ms[stage] = self.stages_ms.get(stage, 0) + seconds * 1000
+
+    def add_pages(self, pages: List[Dict[str, Any]]) -> None:
+        # Worker timings come back per page in page_info
+        self.pages = {"page_num": [], "ocr_ms": [], "pixels": []}
+        for page in pages:
+            timings = page.get("timings_ms", {})
+            self.pages["page_num"].append(page["page_num"])
+            self.pages["ocr_ms"].append(timings.get("ocr"))
+            self.pages["pixels"].append(page.get("ocr_pixels"))
+            for step, ms in timings.items():
+                self.worker_ms[step] = self.worker_ms.get(step, 0) + ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        trace: Dict[str, Any] = {
+            "stages_ms": {stage: round(ms, 2) for stage, ms in self.stages_ms.items()}
+        }
+        if self.queue_wait_ms is not None:
+            trace["queue_wait_ms"] = round(self.queue_wait_ms, 2)
+        if self.pages:
+            trace["worker_ms"] = {
+                step: round(ms, 2) for step, ms in self.worker_ms.items()
+            }
+            trace["pages"] = self.pages
+            pixels = [value or 0 for value in self.pages["pixels"]]
+            if pixels:
+                peak = max(range(len(pixels)), key=pixels.__getitem__)
+                trace["peak_image_pixels"] = pixels[peak]
+                trace["peak_image_page"] = self.pages["page_num"][peak]
+        return trace
+
+    def encode(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    def server_timing(self) -> str:
+        # Worker times are summed over all pages, so they can exceed "total"
+        entries = []
+        if self.queue_wait_ms is not None:
+            entries.append(f"queue;dur={self.queue_wait_ms:.1f}")
+        for stage, ms in self.stages_ms.items():
+            entries.append(f"{stage};dur={ms:.1f}")
+        for step, ms in self.worker_ms.items():
+            entries.append(f'worker-{step};desc="sum over pages";dur={ms:.1f}')
+        return ", ".join(entries)
+
+
+def start_trace() -> JobTrace:
+    trace = JobTrace()
+    current_trace.set(trace)
+    return trace
@@ -0,0 +1,47 @@
+from typing import Callable
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Room for the multipart boundaries, part headers and form fields around the files
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+
+class UploadLimitMiddleware:
+    # The multipart parser writes every uploaded file to a temporary file before the
+    # endpoint runs, so the size limits of the endpoints only apply once the whole
+    # body is on disk. Bodies over the limit of their path are stopped before the
+    # parser sees them: right away when Content-Length announces them, otherwise
+    # (e.g. chunked uploads) as soon as the bytes received exceed the limit.
+
+    def __init__(self, app: ASGIApp, limit: Callable[[str], int]):
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limit(scope["path"])
+        max_bytes = limit + MULTIPART_OVERHEAD_BYTES
+        detail = f"Upload exceeds the limit of {limit // (1024 * 1024)} MB"
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            response = JSONResponse(content={"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from app import main
+from app.database import DatabaseConnection, init_db
+from app.engine import TSV_COLUMNS
+
+
+def page_result(
+    page_num: int, words: Tuple[str, ...] = ("hello", "world")
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # (data, page_info) of one page as the OCR workers return it
+    rows = [[1, page_num, 0, 0, 0, 0, 0, 0, 100, 100, -1, ""]]
+    for word_num, word in enumerate(words, start=1):
+        rows.append(
+            [5, page_num, 1, 1, 1, word_num, 10 * word_num, 10, 8, 10, 90, word]
+        )
+    data: Dict[str, List[Any]] = {column: [] for column in TSV_COLUMNS}
+    for row in rows:
+        for column, value in zip(TSV_COLUMNS, row):
+            data[column].append(value)
+    page_info = {
+        "page_num": page_num,
+        "width": 100,
+        "height": 100,
+        "dpi": 300,
+        "ocr_pixels": 10000,
+        "timings_ms": {"ocr": 1.0},
+    }
+    return {"data": data, "page_num": page_num}, page_info
+
+
+class FakeEngine:
+    # Stands in for rasterization and the OCR pool: every document has num_pages
+    # pages, and the OCR of hold_page waits until release is set
+
+    def __init__(self, num_pages: int = 3):
+        self.num_pages = num_pages
+        self.calls: List[int] = []
+        self.hold_page: int | None = None
+        self.holding = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def document_pages(
+        self, input_path: str, page_parts: Any = None
+    ) -> List[int]:
+        return list(range(1, self.num_pages + 1))
+
+    async def run_ocr(
+        self, input_path, pages, lang, dpi, psm, config, preprocess, regions, save_page
+    ) -> None:
+        for page_num in pages:
+            self.calls.append(page_num)
+            if page_num == self.hold_page:
+                self.holding.set()
+                await self.release.wait()
+            await save_page(page_result(page_num))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "ocr_results.db")
+    init_db(path, logging.getLogger("tests"))
+    yield path
+    DatabaseConnection.close(path)
+
+
+@pytest.fixture
+def app_env(db_path, tmp_path, monkeypatch):
+    # app.main working on a database and directories of its own
+    for name in ["SPOOL_DIR", "OUTPUT_DIR", "PROFILE_DIR"]:
+        directory = tmp_path / name.lower()
+        directory.mkdir()
+        monkeypatch.setattr(main, name, str(directory))
+    monkeypatch.setattr(main, "DB_PATH", db_path)
+    monkeypatch.setattr(main, "OCR_CACHE_MAX_ENTRIES", 0)
+    return main
+
+
+@pytest.fixture
+def fake_engine(app_env, monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(main, "document_pages", engine.document_pages)
+    monkeypatch.setattr(main, "run_ocr", engine.run_ocr)
+    return engine
@@ -0,0 +1,97 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+from app.main import BatchBudget, expand_archive, is_hidden_member
+
+
+def write_zip(path: str, members: dict) -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def test_expand_archive_spools_members(app_env):
+    path = os.path.join(app_env.SPOOL_DIR, "upload")
+    write_zip(path, {"a.png": b"a", "scans/b.pdf": b"bb", "__MACOSX/._a.png": b"x"})
+
+    documents = expand_archive("docs.zip", path, BatchBudget(10, 1024))
+
+    assert [name for _, name, _ in documents] == [
+        "docs.zip/a.png",
+        "docs.zip/scans/b.pdf",
+    ]
+    assert sorted(os.listdir(app_env.SPOOL_DIR)) == sorted(
+        task_id for task_id, _, _ in documents
+    )
+
+
+def test_too_many_members_are_rejected_while_unpacking(app_env):
+    path = os.path.join(app_env.SPOOL_DIR, "upload")
+    write_zip(path, {f"{i}.png": b"x" for i in range(20)})
+    budget = BatchBudget(5, 1024)
+
+    with pytest.raises(HTTPException) as error:
+        expand_archive("docs.zip", path, budget)
+
+    assert error.value.status_code == 400
+    assert budget.files == 6
+    assert os.listdir(app_env.SPOOL_DIR) == []
+
+
+def test_expanded_size_is_limited_across_members(app_env):
+    # Every member is small, together they exceed the batch limit
+    path = os.path.join(app_env.SPOOL_DIR, "upload")
+    write_zip(path, {f"{i}.png": b"\0" * 400 for i in range(10)})
+
+    with pytest.raises(HTTPException) as error:
+        expand_archive("docs.zip", path, BatchBudget(100, 1000))
+
+    assert error.value.status_code == 413
+    assert os.listdir(app_env.SPOOL_DIR) == []
+
+
+def test_plain_files_count_against_the_budget(app_env):
+    budget = BatchBudget(1, 1024)
+    for name in ["first", "second"]:
+        with open(os.path.join(app_env.SPOOL_DIR, name), "wb") as f:
+            f.write(b"%PDF")
+
+    expand_archive("a.pdf", os.path.join(app_env.SPOOL_DIR, "first"), budget)
+    with pytest.raises(HTTPException):
+        expand_archive("b.pdf", os.path.join(app_env.SPOOL_DIR, "second"), budget)
+
+    assert os.listdir(app_env.SPOOL_DIR) == ["first"]
+
+
+def test_tar_members_with_dot_prefix_are_kept(app_env):
+    path = os.path.join(app_env.SPOOL_DIR, "upload")
+    with tarfile.open(path, "w:gz") as archive:
+        for name in ["./scan.png", "./.DS_Store"]:
+            info = tarfile.TarInfo(name)
+            info.size = 1
+            archive.addfile(info, io.BytesIO(b"x"))
+
+    documents = expand_archive("docs.tgz", path, BatchBudget(10, 1024))
+
+    assert [name for _, name, _ in documents] == ["docs.tgz/./scan.png"]
+
+
+@pytest.mark.parametrize(
+    "name, hidden",
+    [
+        ("__MACOSX/scan.png", True),
+        ("scans/.DS_Store", True),
+        (".hidden/scan.png", True),
+        ("__init__.pdf", False),
+        ("__scans/page.png", False),
+        ("./scan.png", False),
+        ("scans/../scan.png", False),
+    ],
+)
+def test_is_hidden_member(name, hidden):
+    assert is_hidden_member(name) == hidden
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import sqlite3
+import uuid
+from contextlib import closing
+from typing import List
+
+import pytest
+from conftest import page_result
+
+from app.database import (
+    RESULT_COLUMNS,
+    LeaseLostError,
+    convert_incremental_vacuum,
+    count_jobs,
+    create_job,
+    delete_jobs,
+    get_cached_job,
+    get_job,
+    get_job_counts,
+    get_ocr_results,
+    init_db,
+    iter_ocr_results,
+    iter_ocr_rows,
+    list_jobs,
+    reclaim_expired_jobs,
+    save_cache_entry,
+    save_ocr_results,
+    save_page_results,
+    update_job,
+)
+
+
+def auto_vacuum(db_path: str) -> int:
+    with closing(sqlite3.connect(db_path)) as conn:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+
+def test_new_database_uses_incremental_vacuum(db_path):
+    assert auto_vacuum(db_path) == 2
+
+
+def test_existing_database_is_only_converted_on_request(tmp_path, caplog):
+    db_path = str(tmp_path / "old.db")
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("CREATE TABLE legacy (uuid TEXT PRIMARY KEY)")
+        conn.commit()
+    logger = logging.getLogger("tests")
+
+    init_db(db_path, logger)
+    assert auto_vacuum(db_path) == 0
+    assert "python -m app.database" in caplog.text
+
+    convert_incremental_vacuum(db_path, logger)
+    assert auto_vacuum(db_path) == 2
+
+
+async def add_job(db_path: str, start_datetime: str, **fields) -> str:
+    task_id = str(uuid.uuid4())
+    await create_job(db_path, task_id, "scan.png", start_datetime, fields=fields)
+    return task_id
+
+
+async def save_pages_of(db_path: str, task_id: str, pages, **kwargs) -> None:
+    for count, page_num in enumerate(pages, start=1):
+        page, _ = page_result(page_num)
+        await save_page_results(db_path, task_id, page, {"pages_done": count}, **kwargs)
+
+
+def test_saved_results_are_read_back_in_document_order(db_path):
+    pages = [page_result(page_num, ("a", "b", "c")) for page_num in (1, 2)]
+
+    async def scenario():
+        task_id, other_id = [
+            await add_job(db_path, "2024-01-01T00:00:00") for _ in range(2)
+        ]
+        await save_ocr_results(db_path, [page for page, _ in pages], task_id)
+        await save_ocr_results(db_path, [pages[0][0]], other_id)
+        return await get_ocr_results(db_path, task_id)
+
+    results = asyncio.run(scenario())
+
+    expected = [
+        dict(zip(RESULT_COLUMNS, row))
+        for page, _ in pages
+        for row in zip(*(page["data"][column] for column in RESULT_COLUMNS))
+    ]
+    assert results == expected
+
+
+@pytest.mark.parametrize("storage", ["rows", "columnar"])
+def test_saved_pages_resume_from_cursor(db_path, storage):
+    async def scenario():
+        task_id = await add_job(db_path, "2024-01-01T00:00:00")
+        await save_pages_of(db_path, task_id, [1, 2], storage=storage)
+        job = await get_job(db_path, task_id, ["pages_done"])
+        assert job["pages_done"] == 2
+        return task_id
+
+    task_id = asyncio.run(scenario())
+
+    rows = list(iter_ocr_rows(db_path, task_id, fields=["page_num", "text"]))
+    assert [row for _, row in rows] == [
+        {"page_num": page_num, "text": text}
+        for page_num in (1, 2)
+        for text in ("", "hello", "world")
+    ]
+    resumed = list(iter_ocr_rows(db_path, task_id, cursor=rows[2][0]))
+    assert [cursor for cursor, _ in resumed] == [cursor for cursor, _ in rows[3:]]
+    words = list(iter_ocr_results(db_path, task_id, page_from=2, min_conf=0))
+    assert [row["text"] for row in words] == ["hello", "world"]
+
+
+def test_page_results_are_only_saved_under_the_lease(db_path):
+    async def scenario():
+        task_id = await add_job(db_path, "2024-01-01T00:00:00", lease_owner="a")
+        await save_pages_of(db_path, task_id, [1], owner="a")
+        with pytest.raises(LeaseLostError):
+            await save_pages_of(db_path, task_id, [2], owner="b")
+        job = await get_job(db_path, task_id, ["pages_done"])
+        assert job["pages_done"] == 1
+        results = await get_ocr_results(db_path, task_id)
+        assert {row["page_num"] for row in results} == {1}
+
+    asyncio.run(scenario())
+
+
+def test_reclaim_expired_jobs(db_path):
+    now = "2024-01-01T12:00:00"
+    expired = {"status": "processing", "lease_owner": "a", "lease_expires": "2024"}
+
+    async def scenario():
+        # Queued job with saved progress resumes, one without starts from scratch
+        resumed = await add_job(db_path, now, input_path="in1", **expired)
+        await save_pages_of(db_path, resumed, [1])
+        restarted = await add_job(db_path, now, input_path="in2", **expired)
+        page, _ = page_result(1)
+        await save_ocr_results(db_path, [page], restarted)
+        # Synchronous requests cannot be re-run
+        sync = await add_job(db_path, now, **expired)
+        running = await add_job(
+            db_path,
+            now,
+            input_path="in3",
+            status="processing",
+            lease_owner="b",
+            lease_expires="2024-01-01T12:01:00",
+        )
+
+        assert await reclaim_expired_jobs(db_path, now) == (2, 1)
+
+        columns = ["status", "lease_owner", "pages_done"]
+        jobs = {
+            name: tuple(await get_job(db_path, task_id, columns))
+            for name, task_id in [
+                ("resumed", resumed),
+                ("restarted", restarted),
+                ("sync", sync),
+                ("running", running),
+            ]
+        }
+        assert jobs == {
+            "resumed": ("pending", None, 1),
+            "restarted": ("pending", None, 0),
+            "sync": ("failed", None, 0),
+            "running": ("processing", "b", 0),
+        }
+        assert len(await get_ocr_results(db_path, resumed)) == 3
+        assert await get_ocr_results(db_path, restarted) == []
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("statuses", [None, ["completed", "failed"]])
+@pytest.mark.parametrize("descending", [False, True])
+def test_list_jobs_pages_through_all_jobs(db_path, statuses, descending):
+    async def scenario():
+        for i in range(9):
+            # Pairs of jobs with the same start_datetime, ordered by rowid
+            start = f"2024-01-01T00:00:0{i // 2}"
+            await add_job(
+                db_path, start, status=["completed", "failed", "pending"][i % 3]
+            )
+
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.row_factory = sqlite3.Row
+            expected = [
+                row["uuid"]
+                for row in conn.execute(
+                    "SELECT rowid, uuid, status FROM jobs ORDER BY start_datetime, rowid"
+                )
+                if statuses is None or row["status"] in statuses
+            ]
+        if descending:
+            expected.reverse()
+
+        listed: List[str] = []
+        cursor = None
+        while True:
+            jobs = await list_jobs(
+                db_path, statuses, "start_datetime", descending, cursor=cursor, limit=2
+            )
+            listed.extend(job["uuid"] for job in jobs)
+            if len(jobs) < 2:
+                break
+            cursor = (jobs[-1]["start_datetime"], jobs[-1]["rowid"])
+        assert listed == expected
+
+    asyncio.run(scenario())
+
+
+def test_job_counts_follow_inserts_updates_and_deletes(db_path):
+    async def scenario():
+        first = await add_job(db_path, "2024-01-01T00:00:00")
+        second = await add_job(db_path, "2024-01-01T00:00:01")
+        await add_job(db_path, "2024-01-01T00:00:02")
+        assert await get_job_counts(db_path) == {"pending": 3}
+
+        await update_job(db_path, first, {"status": "processing"})
+        await update_job(db_path, first, {"status": "completed"})
+        await update_job(db_path, second, {"status": "failed"})
+        # Updates of other columns leave the counts alone
+        await update_job(db_path, second, {"error_message": "boom"})
+        assert await get_job_counts(db_path) == {
+            "pending": 1,
+            "completed": 1,
+            "failed": 1,
+        }
+        assert await count_jobs(db_path, ["completed", "failed"]) == 2
+
+        await delete_jobs(db_path, [first, second])
+        assert await get_job_counts(db_path) == {"pending": 1}
+
+    asyncio.run(scenario())
+
+
+def test_cache_entries_expire_and_are_evicted(db_path):
+    async def scenario():
+        task_ids = [
+            await add_job(db_path, "2024-01-01T00:00:00", status="completed")
+            for _ in range(3)
+        ]
+        for i, task_id in enumerate(task_ids[:2]):
+            await save_cache_entry(db_path, f"key{i}", task_id, 2, 3600)
+
+        hit = await get_cached_job(db_path, "key0", 3600)
+        assert hit["uuid"] == task_ids[0]
+        assert await get_cached_job(db_path, "key0", 0) is None
+
+        # key0 was used last, key1 is evicted for the new entry
+        await save_cache_entry(db_path, "key2", task_ids[2], 2, 3600)
+        assert await get_cached_job(db_path, "key1", 3600) is None
+        assert await get_cached_job(db_path, "key0", 3600) is not None
+
+    asyncio.run(scenario())
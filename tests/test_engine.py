@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+from PIL import Image
+
+from app import engine
+from app.engine import TesserocrEngine, parse_tsv
+
+# GetTSVText(0) output: no header row, and rows without text may lack the last
+# column entirely
+TSV = (
+    "1\t1\t0\t0\t0\t0\t0\t0\t640\t480\t-1\t\n"
+    "2\t1\t1\t0\t0\t0\t20\t30\t200\t40\t-1\n"
+    "5\t1\t1\t1\t1\t1\t20\t30\t90\t40\t96.5\tHello\n"
+    "5\t1\t1\t1\t1\t2\t120\t30\t100\t40\t91.2\tworld\n"
+    "\n"
+)
+
+
+def test_parse_tsv_maps_the_columns():
+    data = parse_tsv(TSV)
+
+    assert data == {
+        "level": [1, 2, 5, 5],
+        "page_num": [1, 1, 1, 1],
+        "block_num": [0, 1, 1, 1],
+        "par_num": [0, 0, 1, 1],
+        "line_num": [0, 0, 1, 1],
+        "word_num": [0, 0, 1, 2],
+        "left": [0, 20, 20, 120],
+        "top": [0, 30, 30, 30],
+        "width": [640, 200, 90, 100],
+        "height": [480, 40, 40, 40],
+        "conf": [-1, -1, 96, 91],
+        "text": ["", "", "Hello", "world"],
+    }
+
+
+def test_parse_tsv_of_an_empty_page():
+    assert all(values == [] for values in parse_tsv("").values())
+
+
+def test_parse_config_translates_cli_options():
+    options = TesserocrEngine.parse_config(
+        "--oem 1 --tessdata-dir '/opt/tess data' -c tessedit_char_whitelist=0-9 "
+        "-c preserve_interword_spaces=1"
+    )
+
+    assert options == {
+        "oem": 1,
+        "path": "/opt/tess data",
+        "variables": {
+            "tessedit_char_whitelist": "0-9",
+            "preserve_interword_spaces": "1",
+        },
+    }
+    assert TesserocrEngine.parse_config(None) == {"variables": {}}
+
+
+@pytest.mark.parametrize(
+    "config", ["--user-words words.txt", "-c novalue", "--oem", "-c"]
+)
+def test_parse_config_rejects_unsupported_options(config):
+    assert TesserocrEngine.parse_config(config) is None
+
+
+class FakeApi:
+    # Records the calls of tesserocr.PyTessBaseAPI and returns TSV
+
+    instances: List["FakeApi"] = []
+
+    def __init__(self, **kwargs: Any):
+        self.kwargs = kwargs
+        self.variables: Dict[str, str] = {}
+        self.calls: List[tuple] = []
+        self.ended = False
+        FakeApi.instances.append(self)
+
+    def SetVariable(self, name: str, value: str) -> bool:
+        self.variables[name] = value
+        return name != "unknown_variable"
+
+    def SetImageBytes(self, *args: Any) -> None:
+        self.calls.append(("SetImageBytes", len(args[0]), *args[1:]))
+
+    def SetSourceResolution(self, dpi: int) -> None:
+        self.calls.append(("SetSourceResolution", dpi))
+
+    def GetTSVText(self, page_index: int) -> str:
+        return TSV
+
+    def Clear(self) -> None:
+        self.calls.append(("Clear",))
+
+    def End(self) -> None:
+        self.ended = True
+
+
+@pytest.fixture
+def fake_tesserocr(monkeypatch):
+    FakeApi.instances = []
+    monkeypatch.setattr(engine, "tesserocr", SimpleNamespace(PyTessBaseAPI=FakeApi))
+    return FakeApi
+
+
+def test_tesserocr_engine_returns_the_rows_of_the_tsv(fake_tesserocr):
+    image = Image.new("L", (4, 3), 255)
+
+    data = TesserocrEngine().image_to_data(
+        image, "deu", 300, 6, "--oem 1 -c tessedit_char_whitelist=abc"
+    )
+
+    assert data == parse_tsv(TSV)
+    (api,) = fake_tesserocr.instances
+    assert api.kwargs == {"lang": "deu", "psm": 6, "oem": 1}
+    assert api.variables == {"tessedit_char_whitelist": "abc"}
+    # RGB pixels, 3 bytes per pixel
+    assert api.calls == [
+        ("SetImageBytes", 36, 4, 3, 3, 12),
+        ("SetSourceResolution", 300),
+        ("Clear",),
+    ]
+
+
+def test_tesserocr_engine_reuses_and_evicts_instances(fake_tesserocr):
+    tesserocr_engine = TesserocrEngine(cache_size=2)
+    image = Image.new("RGB", (2, 2))
+
+    for lang in ("eng", "deu", "eng", "fra"):
+        tesserocr_engine.image_to_data(image, lang, None, 3, None)
+
+    eng, deu, fra = fake_tesserocr.instances
+    assert [api.kwargs["lang"] for api in (eng, deu, fra)] == ["eng", "deu", "fra"]
+    # The least recently used instance is ended
+    assert (eng.ended, deu.ended, fra.ended) == (False, True, False)
+    assert ("SetSourceResolution", None) not in eng.calls
+
+
+def test_tesserocr_engine_rejects_unknown_variables(fake_tesserocr):
+    with pytest.raises(ValueError, match="unknown_variable"):
+        TesserocrEngine().image_to_data(
+            Image.new("RGB", (2, 2)), "eng", None, 3, "-c unknown_variable=1"
+        )
+
+    assert fake_tesserocr.instances[0].ended
+
+
+def test_tesserocr_engine_falls_back_for_unsupported_options(
+    fake_tesserocr, monkeypatch
+):
+    calls = []
+    monkeypatch.setattr(
+        engine.fallback_engine,
+        "image_to_data",
+        lambda *args: calls.append(args[1:]) or parse_tsv(TSV),
+    )
+
+    TesserocrEngine().image_to_data(
+        Image.new("RGB", (2, 2)), "eng", 300, 3, "--user-words words.txt"
+    )
+
+    assert calls == [("eng", 300, 3, "--user-words words.txt")]
+    assert fake_tesserocr.instances == []
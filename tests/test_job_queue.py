@@ -0,0 +1,106 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.database import (
+    LeaseLostError,
+    claim_next_job,
+    create_job,
+    get_job,
+    get_job_status,
+    get_ocr_results,
+    update_job,
+)
+from app.job_queue import WORKER_ID, JobQueue
+
+
+async def queue_job(main, file_name: str = "scan.png") -> str:
+    task_id = str(uuid.uuid4())
+    input_path = os.path.join(main.SPOOL_DIR, task_id)
+    with open(input_path, "wb") as f:
+        f.write(b"not a pdf")
+    await create_job(
+        main.DB_PATH,
+        task_id,
+        file_name,
+        datetime.now().isoformat(),
+        fields={"lang": "eng", "psm_type": 3, "input_path": input_path},
+    )
+    return task_id
+
+
+async def wait_for_status(main, task_id: str, status: str) -> None:
+    for _ in range(200):
+        if await get_job_status(main.DB_PATH, task_id) == status:
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"Job {task_id} did not reach {status}")
+
+
+def test_job_cancelled_by_shutdown_resumes_after_restart(app_env, fake_engine):
+    main = app_env
+    fake_engine.hold_page = 2
+
+    async def scenario():
+        task_id = await queue_job(main)
+        queue = JobQueue(main.DB_PATH, main.run_queued_job, 1, 10, main.logger)
+        await queue.start()
+        await asyncio.wait_for(fake_engine.holding.wait(), timeout=10)
+        await queue.stop()
+
+        job = await get_job(
+            main.DB_PATH, task_id, ["status", "pages_done", "input_path"]
+        )
+        assert (job["status"], job["pages_done"]) == ("processing", 1)
+        input_path = job["input_path"]
+        assert os.path.exists(input_path)
+
+        fake_engine.release.set()
+        queue = JobQueue(main.DB_PATH, main.run_queued_job, 1, 10, main.logger)
+        await queue.start()
+        try:
+            await wait_for_status(main, task_id, "completed")
+        finally:
+            await queue.stop()
+
+        job = await get_job(main.DB_PATH, task_id, ["pages_done"])
+        assert job["pages_done"] == 3
+        results = await get_ocr_results(main.DB_PATH, task_id)
+        assert [row["page_num"] for row in results] == [1, 1, 1, 2, 2, 2, 3, 3, 3]
+        assert not os.path.exists(input_path)
+
+    asyncio.run(scenario())
+
+    assert fake_engine.calls == [1, 2, 2, 3]
+
+
+def test_job_stops_once_its_lease_is_lost(app_env, fake_engine):
+    main = app_env
+    fake_engine.hold_page = 2
+
+    async def scenario():
+        task_id = await queue_job(main)
+        job = await claim_next_job(main.DB_PATH, WORKER_ID, datetime.now().isoformat())
+        run = asyncio.create_task(main.run_queued_job(job))
+        await asyncio.wait_for(fake_engine.holding.wait(), timeout=10)
+
+        # The lease expired and another API process claimed the job
+        await update_job(main.DB_PATH, task_id, {"lease_owner": "other"})
+        fake_engine.release.set()
+        with pytest.raises(LeaseLostError):
+            await run
+
+        job = await get_job(
+            main.DB_PATH, task_id, ["status", "pages_done", "input_path"]
+        )
+        assert (job["status"], job["pages_done"]) == ("processing", 1)
+        assert os.path.exists(job["input_path"])
+        results = await get_ocr_results(main.DB_PATH, task_id)
+        assert {row["page_num"] for row in results} == {1}
+
+    asyncio.run(scenario())
+
+    assert fake_engine.calls == [1, 2]
@@ -0,0 +1,21 @@
+import os
+
+from PIL import Image
+from pypdf import PdfReader
+
+from app.ocr import merge_pdfs
+
+
+def test_merge_pdfs_appends_page_files_in_order(tmp_path):
+    pages = []
+    for page_num, width in enumerate([100, 200, 300], start=1):
+        path = str(tmp_path / f"{page_num}.pdf")
+        Image.new("RGB", (width, 100), "white").save(path)
+        pages.append(path)
+    output_path = str(tmp_path / "merged.pdf")
+
+    merge_pdfs(pages, output_path)
+
+    widths = [round(page.mediabox.width) for page in PdfReader(output_path).pages]
+    assert widths == [100, 200, 300]
+    assert os.listdir(tmp_path) == ["merged.pdf"]
@@ -0,0 +1,38 @@
+import numpy as np
+from PIL import Image
+
+from app import preprocess
+from app.preprocess import binarize, to_grayscale
+
+
+def test_binarize_bands_match_a_single_pass(monkeypatch):
+    rng = np.random.default_rng(0)
+    gray = (rng.random((300, 200)) * 255).astype(np.uint8)
+    expected = binarize(gray, 300)
+
+    # Bands that do not divide the page, the last one is shorter
+    monkeypatch.setattr(preprocess, "BAND_ROWS", 7)
+
+    assert np.array_equal(binarize(gray, 300), expected)
+
+
+def test_binarize_keeps_text_on_uneven_background():
+    # Dark stroke on a background that darkens from left to right
+    gray = np.tile(np.linspace(230, 120, 200), (100, 1)).astype(np.uint8)
+    gray[45:55, 20:180] -= 100
+
+    binary = binarize(gray, 300)
+
+    assert (binary[48:52, 25:175] == 0).all()
+    assert (binary[:30] == 255).mean() > 0.95
+
+
+def test_to_grayscale_uses_luma_weights():
+    pixels = np.zeros((300, 2, 3), dtype=np.uint8)
+    pixels[:, 0] = [255, 0, 0]
+    pixels[:, 1] = [255, 255, 255]
+
+    gray = to_grayscale(Image.fromarray(pixels))
+
+    assert (gray[:, 0] == 76).all()
+    assert (gray[:, 1] == 255).all()
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+from conftest import page_result
+
+from app.regions import (
+    merge_regions,
+    offset_rows,
+    parse_regions,
+    region_box,
+    split_regions,
+)
+
+
+def region(**fields) -> dict:
+    return parse_regions(json.dumps([fields]))[0]
+
+
+def test_parse_regions_defaults_and_whitelist():
+    parsed = region(left=1, top=2, width=3, height=4, whitelist="0123456789")
+
+    assert parsed == {
+        "index": 0,
+        "name": None,
+        "page": None,
+        "unit": "px",
+        "left": 1,
+        "top": 2,
+        "width": 3,
+        "height": 4,
+        "psm": None,
+        "config": "-c tessedit_char_whitelist=0123456789",
+    }
+
+
+@pytest.mark.parametrize(
+    "fields, error",
+    [
+        ({"left": True}, "left must be a number"),
+        ({"width": 0}, "width and height must be more than 0"),
+        ({"top": -1}, "top must not be negative"),
+        ({"unit": "relative", "left": 0.5, "width": 0.6}, "must lie within 0..1"),
+        ({"unit": "mm"}, "unit must be one of"),
+        ({"page": 0}, "page must be a page number"),
+        ({"page": True}, "page must be a page number"),
+        ({"page": 1.0}, "page must be a page number"),
+        ({"psm": 2}, "psm must be one of"),
+        ({"whitelist": "a b"}, "whitelist must be a string"),
+        ({"foo": 1}, "unknown keys ['foo']"),
+    ],
+)
+def test_parse_regions_rejects_invalid_regions(fields, error):
+    box = {"left": 0, "top": 0, "width": 0.5, "height": 0.5, **fields}
+
+    with pytest.raises(ValueError, match=error.replace("(", r"\(").replace("[", r"\[")):
+        parse_regions(json.dumps([box]))
+
+
+def test_parse_regions_accepts_relative_regions_up_to_the_edge():
+    parsed = region(left=0.7, top=0, width=0.3, height=1, unit="relative")
+
+    assert (parsed["left"], parsed["width"]) == (0.7, 0.3)
+
+
+def test_region_box_converts_relative_units_to_pixels():
+    parsed = region(left=0.25, top=0.1, width=0.5, height=0.2, unit="relative")
+
+    assert region_box(parsed, 200, 1000) == (50, 100, 150, 300)
+
+
+def test_region_box_clips_pixel_regions_to_the_page():
+    parsed = region(left=150, top=900, width=100, height=200)
+
+    assert region_box(parsed, 200, 1000) == (150, 900, 200, 1000)
+
+
+def test_split_regions_deals_out_the_regions_of_a_page():
+    regions = parse_regions(
+        json.dumps(
+            [
+                {"left": i, "top": 0, "width": 1, "height": 1, "page": page}
+                for i, page in enumerate([1, None, 2, 1, None])
+            ]
+        )
+    )
+
+    parts = split_regions(regions, 2, 1)
+
+    assert [[r["index"] for r in part] for part, in parts] == [[0, 3], [1, 4]]
+    assert split_regions(regions, 8, 3) == [([regions[1]],), ([regions[4]],)]
+
+
+def test_offset_rows_moves_crop_rows_to_page_coordinates():
+    page, _ = page_result(1, ("a",))
+
+    rows = offset_rows(page["data"], 100, 50)
+
+    # The page row of the crop is dropped
+    assert rows["level"] == [5]
+    assert (rows["left"], rows["top"]) == ([110], [60])
+    assert rows["text"] == ["a"]
+
+
+def region_result(index: int, words, blocks) -> dict:
+    page, _ = page_result(1, words)
+    data = offset_rows(page["data"], 0, 0)
+    data["block_num"] = blocks
+    return {"index": index, "name": f"r{index}", "data": data}
+
+
+def test_merge_regions_renumbers_blocks_in_region_order():
+    _, info = page_result(1)
+    parts = [
+        ([region_result(1, ("c",), [1])], {**info, "ocr_pixels": 10}),
+        (
+            [region_result(0, ("a", "b"), [1, 2]), region_result(2, ("d",), [1])],
+            {**info, "ocr_pixels": 20},
+        ),
+    ]
+
+    page, page_info = merge_regions(parts)
+
+    data = page["data"]
+    assert data["level"] == [1, 5, 5, 5, 5]
+    assert data["text"] == ["", "a", "b", "c", "d"]
+    assert data["block_num"] == [0, 1, 2, 3, 4]
+    assert page_info["ocr_pixels"] == 30
+    assert page_info["timings_ms"] == {"ocr": 2.0}
+    assert [(r["name"], r["text"]) for r in page_info["regions"]] == [
+        ("r0", "a\nb"),
+        ("r1", "c"),
+        ("r2", "d"),
+    ]
@@ -0,0 +1,88 @@
+import numpy as np
+from PIL import Image
+
+from app import resolution
+from app.resolution import choose_dpi, choose_scale, text_line_height
+
+
+def lined_page(width: int, height: int, line_px: int) -> Image.Image:
+    # White page with black text lines of line_px rows, one line height apart
+    pixels = np.full((height, width), 255, dtype=np.uint8)
+    margin = width // 10
+    for top in range(line_px, height - line_px, 2 * line_px):
+        bottom = top + line_px
+        pixels[top:bottom, margin:-margin] = 0
+    return Image.fromarray(pixels)
+
+
+def test_text_line_height_measures_the_lines():
+    gray = np.asarray(lined_page(600, 800, 12))
+
+    assert text_line_height(gray) == 12
+
+
+def test_text_line_height_needs_text():
+    assert text_line_height(np.full((800, 600), 255, dtype=np.uint8)) is None
+    # Bands of one or two rows are noise
+    pixels = np.full((800, 600), 255, dtype=np.uint8)
+    pixels[100:102, 50:550] = 0
+    pixels[300:301, 50:550] = 0
+    assert text_line_height(pixels) is None
+
+
+def test_choose_dpi_raises_the_resolution_of_small_text():
+    # 12 px lines at 72 DPI are about 12 pt: 252 DPI rounded up to the next step
+    assert choose_dpi(lined_page(612, 792, 12), 72) == 300
+    # 4 px lines would need 756 DPI
+    assert choose_dpi(lined_page(612, 792, 4), 72) == resolution.OCR_MAX_DPI
+
+
+def test_choose_dpi_lowers_the_resolution_of_large_text():
+    assert choose_dpi(lined_page(612, 792, 40), 72) == resolution.OCR_MIN_DPI
+
+
+def test_choose_dpi_falls_back_without_text():
+    blank = Image.new("L", (612, 792), 255)
+
+    assert choose_dpi(blank, 72) == resolution.FALLBACK_DPI
+
+
+def test_choose_dpi_caps_the_pixels_of_large_pages(monkeypatch):
+    monkeypatch.setattr(resolution, "OCR_MAX_PAGE_PIXELS", 1_000_000)
+
+    # 1 MP on a 8.5 x 11 inch page allows at most 103 DPI
+    assert choose_dpi(lined_page(612, 792, 12), 72) == 103
+
+
+def test_choose_scale_downscales_large_text():
+    # Probed at half size, so the measured lines are 84 px high
+    scale, dpi = choose_scale(lined_page(2000, 2000, 84), 600)
+
+    assert scale == 0.5
+    assert dpi == 300
+
+
+def test_choose_scale_keeps_small_text():
+    assert choose_scale(lined_page(600, 800, 12), 300) == (1.0, 300)
+
+
+def test_choose_scale_estimates_the_resolution_without_dpi():
+    # 24 px lines of assumed body text: 24 * 72 / BODY_LINE_PT = 192 DPI
+    assert choose_scale(lined_page(600, 800, 24), None) == (1.0, 192)
+    assert choose_scale(Image.new("L", (600, 800), 255), None) == (1.0, None)
+
+
+def test_choose_scale_clamps_to_the_minimum_scale():
+    scale, dpi = choose_scale(lined_page(1200, 1600, 200), 400)
+
+    assert scale == resolution.MIN_SCALE
+    assert dpi == 100
+
+
+def test_choose_scale_caps_the_pixels_of_large_images(monkeypatch):
+    monkeypatch.setattr(resolution, "OCR_MAX_PAGE_PIXELS", 120_000)
+
+    scale, dpi = choose_scale(Image.new("L", (600, 800), 255), 300)
+
+    assert scale == 0.5
+    assert dpi == 150
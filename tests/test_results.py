@@ -0,0 +1,64 @@
+import asyncio
+import json
+import uuid
+
+from conftest import page_result
+
+from app.database import create_job, save_ocr_results, update_job
+
+
+async def read_lines(response) -> list:
+    body = "".join([chunk async for chunk in response.body_iterator])
+    return [json.loads(line) for line in body.splitlines()]
+
+
+def test_ndjson_pages_continue_at_their_cursor(app_env, monkeypatch):
+    main = app_env
+    monkeypatch.setattr(main, "NDJSON_CHUNK_ROWS", 2)
+    filters = {"level": 5, "fields": ["page_num", "text"]}
+
+    async def scenario():
+        task_id = str(uuid.uuid4())
+        await create_job(main.DB_PATH, task_id, "scan.pdf", "2024-01-01T00:00:00")
+        pages = [page_result(page_num, ("a", "b"))[0] for page_num in (1, 2)]
+        await save_ocr_results(main.DB_PATH, pages, task_id)
+
+        first = await read_lines(
+            main.stream_results({"task_id": task_id}, task_id, filters, limit=3)
+        )
+        cursor = first[-1]["next_cursor"]
+        rest = await read_lines(
+            main.stream_results({}, task_id, {**filters, "cursor": cursor}, limit=3)
+        )
+        return first, rest
+
+    first, rest = asyncio.run(scenario())
+
+    assert first[0]["task_id"]
+    assert first[1:-1] == [
+        {"page_num": 1, "text": "a"},
+        {"page_num": 1, "text": "b"},
+        {"page_num": 2, "text": "a"},
+    ]
+    # The last page has no next_cursor line
+    assert rest == [{}, {"page_num": 2, "text": "b"}]
+
+
+def test_running_job_returns_the_pages_so_far(app_env):
+    main = app_env
+
+    async def scenario():
+        task_id = str(uuid.uuid4())
+        await create_job(main.DB_PATH, task_id, "scan.pdf", "2024-01-01T00:00:00")
+        pending = json.loads((await main.get_result(task_id)).body)
+        await update_job(main.DB_PATH, task_id, {"status": "processing"})
+        await save_ocr_results(main.DB_PATH, [page_result(1, ("a",))[0]], task_id)
+        running = json.loads((await main.get_result(task_id, level=5)).body)
+        return pending, running
+
+    pending, running = asyncio.run(scenario())
+
+    assert (pending["state"], pending["status"]) == ("PENDING", "pending")
+    assert "results" not in pending
+    assert (running["state"], running["status"]) == ("RUNNING", "processing")
+    assert [row["text"] for row in running["results"]] == ["a"]
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+
+from conftest import page_result
+
+from app import retention
+from app.database import (
+    create_job,
+    database_size,
+    get_job_status,
+    get_ocr_results,
+    save_ocr_results,
+)
+from app.retention import RetentionPurger
+
+
+def test_purge_deletes_expired_finished_jobs(db_path, monkeypatch):
+    monkeypatch.setattr(retention, "JOB_RETENTION_DAYS", 1)
+    monkeypatch.setattr(retention, "PURGE_BATCH_JOBS", 2)
+    monkeypatch.setattr(retention, "PURGE_BATCH_PAUSE", 0)
+    removed = []
+
+    async def add_job(status: str, end_datetime: str | None) -> str:
+        task_id = str(uuid.uuid4())
+        fields = {"status": status, "end_datetime": end_datetime}
+        await create_job(db_path, task_id, "scan.png", "2020-01-01", fields=fields)
+        # Enough rows that deleting them frees pages
+        pages = [page_result(page_num, ("word",) * 200)[0] for page_num in range(5)]
+        await save_ocr_results(db_path, pages, task_id)
+        return task_id
+
+    async def scenario():
+        now = datetime.now().isoformat()
+        expired = [
+            await add_job(status, "2020-01-02")
+            for status in ["completed"] * 2 + ["failed"]
+        ]
+        kept = [
+            await add_job("completed", now),
+            # Never finished, whatever its age
+            await add_job("processing", None),
+        ]
+
+        purger = RetentionPurger(db_path, removed.append, logging.getLogger("tests"))
+        assert await purger.purge() == 3
+
+        for task_id in expired:
+            assert await get_job_status(db_path, task_id) is None
+            assert await get_ocr_results(db_path, task_id) == []
+        for task_id in kept:
+            assert await get_job_status(db_path, task_id) is not None
+        return expired
+
+    expired = asyncio.run(scenario())
+
+    assert sorted(job["uuid"] for job in removed) == sorted(expired)
+    # The freed pages were returned to the file system
+    assert database_size(db_path)[1] == 0
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from app.uploads import MULTIPART_OVERHEAD_BYTES, UploadLimitMiddleware
+
+CHUNK_BYTES = 64 * 1024
+
+
+def upload_app(received: list) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, limit=lambda path: 1024)
+
+    @app.post("/upload/")
+    async def upload(file: UploadFile = File(...)):
+        received.append(file.size)
+        return {"size": file.size}
+
+    return app
+
+
+def multipart_body(size: int) -> bytes:
+    return (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="scan.png"\r\n\r\n'
+        + b"x" * size
+        + b"\r\n--boundary--\r\n"
+    )
+
+
+def test_upload_within_the_limit_is_accepted():
+    received: list = []
+    client = TestClient(upload_app(received))
+
+    response = client.post("/upload/", files={"file": ("scan.png", b"x" * 1024)})
+
+    assert (response.status_code, received) == (200, [1024])
+
+
+def test_oversized_upload_is_rejected_by_its_content_length():
+    received: list = []
+    client = TestClient(upload_app(received))
+
+    response = client.post(
+        "/upload/",
+        files={"file": ("scan.png", b"x" * (2 * MULTIPART_OVERHEAD_BYTES))},
+    )
+
+    assert (response.status_code, received) == (413, [])
+    assert response.json() == {"detail": "Upload exceeds the limit of 0 MB"}
+
+
+def test_oversized_chunked_upload_is_rejected():
+    received: list = []
+    client = TestClient(upload_app(received))
+    body = multipart_body(2 * MULTIPART_OVERHEAD_BYTES)
+
+    def chunks():
+        for start in range(0, len(body), CHUNK_BYTES):
+            end = start + CHUNK_BYTES
+            yield body[start:end]
+
+    # Without Content-Length
+    response = client.post(
+        "/upload/",
+        content=chunks(),
+        headers={"Content-Type": "multipart/form-data; boundary=boundary"},
+    )
+
+    assert (response.status_code, received) == (413, [])
+
+
+def test_body_is_not_read_past_the_limit():
+    sent = 0
+
+    async def receive():
+        nonlocal sent
+        sent += CHUNK_BYTES
+        return {"type": "http.request", "body": b"x" * CHUNK_BYTES, "more_body": True}
+
+    async def read_body(scope, receive, send):
+        while (await receive())["more_body"]:
+            pass
+
+    middleware = UploadLimitMiddleware(read_body, limit=lambda path: 0)
+    scope = {"type": "http", "method": "POST", "path": "/upload/", "headers": []}
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(middleware(scope, receive, None))
+
+    assert error.value.status_code == 413
+    assert sent == MULTIPART_OVERHEAD_BYTES + CHUNK_BYTES